@@ -0,0 +1,122 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import metrics
+from cache import MISSING
+
+logger = logging.getLogger(__name__)
+
+# Количество потоков, выполняющих запросы к БД.
+# У каждого потока свое постоянное соединение (см. db_pool.py),
+# в режиме WAL читатели работают параллельно с писателем.
+DB_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+
+
+async def run(func, *args, **kwargs):
+    """Выполняет синхронную функцию БД в пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_event_loop()
+    submitted = time.perf_counter()
+
+    def call():
+        # Сколько запрос ждал свободного потока - показатель конкуренции за БД
+        metrics.executor_wait_seconds.observe(time.perf_counter() - submitted)
+        return func(*args, **kwargs)
+
+    return await loop.run_in_executor(_executor, call)
+
+
+def _async(func):
+    """Создает асинхронную обертку над функцией из database.py"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+
+async def get_keyboard_state(user_id: int):
+    """Состояние главной клавиатуры; при попадании в кэш обходится без пула потоков"""
+    state = database.keyboard_state_cache.peek(user_id, MISSING)
+    if state is MISSING:
+        state = await run(database.get_keyboard_state, user_id)
+    return state
+
+
+async def get_profile(user_id: int):
+    """Профиль пользователя; при попадании в кэш обходится без пула потоков"""
+    profile = database.profile_cache.peek(user_id, MISSING)
+    if profile is MISSING:
+        profile = await run(database.get_profile, user_id)
+    return profile
+
+
+async def get_interest_catalog():
+    """Справочник интересов; при попадании в кэш обходится без пула потоков"""
+    catalog = database.interest_catalog_cache.peek('all', MISSING)
+    if catalog is MISSING:
+        catalog = await run(database.get_interest_catalog)
+    return catalog
+
+
+async def get_all_interests():
+    """Список интересов (id, name) в порядке названий; [] при ошибке чтения"""
+    try:
+        return list((await get_interest_catalog()).items)
+    except Exception as e:
+        logger.error(f"Error getting interests: {e}")
+        return []
+
+
+async def get_interest_names():
+    """Справочник интересов id -> название"""
+    return (await get_interest_catalog()).names
+
+
+def shutdown():
+    """Дожидается выполнения запросов в очереди и закрывает соединения"""
+    _executor.shutdown(wait=True)
+    database.close_connections()
+    logger.info("Database executor stopped")
+
+
+bootstrap = _async(database.bootstrap)
+add_profile = _async(database.add_profile)
+create_profile = _async(database.create_profile)
+update_profile = _async(database.update_profile)
+get_matching_profiles = _async(database.get_matching_profiles)
+get_matching_profile_ids = _async(database.get_matching_profile_ids)
+get_feed_card = _async(database.get_feed_card)
+get_stale_photos = _async(database.get_stale_photos)
+set_photo_status = _async(database.set_photo_status)
+add_like = _async(database.add_like)
+like_and_check_match = _async(database.like_and_check_match)
+check_mutual_like = _async(database.check_mutual_like)
+get_matches = _async(database.get_matches)
+add_viewed_profile = _async(database.add_viewed_profile)
+get_user_interests = _async(database.get_user_interests)
+clear_user_interests = _async(database.clear_user_interests)
+add_user_interests = _async(database.add_user_interests)
+replace_user_interests = _async(database.replace_user_interests)
+get_recent_likes = _async(database.get_recent_likes)
+get_pending_likes_count = _async(database.get_pending_likes_count)
+get_last_like = _async(database.get_last_like)
+add_report = _async(database.add_report)
+add_block = _async(database.add_block)
+get_all_users = _async(database.get_all_users)
+update_last_active = _async(database.update_last_active)
+update_username = _async(database.update_username)
+get_users_by_interests = _async(database.get_users_by_interests)
+create_broadcast_job = _async(database.create_broadcast_job)
+get_broadcast_job = _async(database.get_broadcast_job)
+get_unfinished_broadcast_jobs = _async(database.get_unfinished_broadcast_jobs)
+get_pending_broadcast_recipients = _async(database.get_pending_broadcast_recipients)
+save_broadcast_progress = _async(database.save_broadcast_progress)
+set_broadcast_progress_message = _async(database.set_broadcast_progress_message)
+finish_broadcast_job = _async(database.finish_broadcast_job)
+get_fsm_record = _async(database.get_fsm_record)
+save_fsm_records = _async(database.save_fsm_records)
@@ -0,0 +1,320 @@
+"""
+Микробенчмарки функций database.py.
+
+Заполняет отдельную БД синтетическими данными (анкеты, интересы, лайки,
+просмотры, блокировки) и замеряет время публичных функций database.py.
+Уровни --profiles наращиваются в одной БД: после замеров на 10 000
+анкет досоздаются анкеты до следующего уровня - так видно, на каком
+объеме ломается кривая стоимости каждого запроса.
+
+    python bench_db.py --profiles 10000,100000,1000000 --json bench.json
+
+Данные генерируются детерминированно (--seed), результаты сохраняются в
+JSON вместе с коммитом и версией SQLite - файлы разных веток можно
+сравнивать между собой. Рабочую dating_bot.db бенчмарк не трогает:
+по умолчанию используется bench.db, которая пересоздается при запуске.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import migrations
+
+# Идентификаторы интересов из migrations.BASIC_INTERESTS
+INTEREST_IDS = list(range(1, 16))
+SEED_BATCH = 5000
+# id анкет, создаваемых бенчмарком create_profile, - вне диапазона синтетических
+_new_user_ids = itertools.count(10 ** 12)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Seeder:
+    """Генерация синтетических данных пачками через executemany"""
+
+    def __init__(self, conn: sqlite3.Connection, args, rnd: random.Random):
+        self.conn = conn
+        self.args = args
+        self.random = rnd
+        self.now = datetime.datetime.utcnow()
+
+    def _timestamp(self) -> str:
+        moment = self.now - datetime.timedelta(seconds=self.random.randint(0, 30 * 86400))
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+    def _batches(self, start: int, end: int) -> Iterator[range]:
+        for first in range(start, end, SEED_BATCH):
+            yield range(first, min(first + SEED_BATCH, end))
+
+    def _profile(self, user_id: int) -> tuple:
+        rnd = self.random
+        gender = rnd.choice('MF')
+        roll = rnd.random()
+        looking_for = 'MF' if roll < 0.1 else (gender if roll < 0.2 else ('F' if gender == 'M' else 'M'))
+        return (user_id, f'User{user_id}', rnd.randint(18, 60), 'Синтетическая анкета для бенчмарка',
+                f'photo{user_id}', gender, looking_for, rnd.choice(['Москва', 'Казань', None]),
+                f'user{user_id}', self._timestamp())
+
+    def _targets(self, user_id: int, total: int, count: int) -> List[int]:
+        targets = {self.random.randint(1, total) for _ in range(count)}
+        targets.discard(user_id)
+        return list(targets)
+
+    def seed(self, start: int, end: int):
+        """Создает анкеты start..end-1 и их связи с анкетами 1..end-1"""
+        args, rnd, total = self.args, self.random, end - 1
+        with self.conn:
+            for batch in self._batches(start, end):
+                self.conn.executemany('''
+                    INSERT INTO profiles (user_id, name, age, description, photo_id,
+                                          gender, looking_for, city, username, last_active)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [self._profile(user_id) for user_id in batch])
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO user_interests (user_id, interest_id) VALUES (?, ?)",
+                    [(user_id, interest_id) for user_id in batch
+                     for interest_id in rnd.sample(INTEREST_IDS, rnd.randint(1, args.interests))]
+                )
+                likes = []
+                for user_id in batch:
+                    for target in self._targets(user_id, total, args.likes):
+                        likes.append((user_id, target, self._timestamp()))
+                        if rnd.random() < args.like_back:
+                            likes.append((target, user_id, self._timestamp()))
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO likes (user_id, liked_user_id, created_at) VALUES (?, ?, ?)", likes
+                )
+                # Взаимные лайки пачки - в matches, как это делает like_and_check_match
+                self.conn.executemany('''
+                    INSERT OR IGNORE INTO matches (user_id, matched_user_id, created_at)
+                    SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM likes WHERE user_id = ? AND liked_user_id = ?)
+                ''', [row for user_id, target, created_at in likes
+                      for row in ((user_id, target, created_at, target, user_id),
+                                  (target, user_id, created_at, target, user_id))])
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO viewed_profiles (user_id, viewed_user_id, viewed_at) VALUES (?, ?, ?)",
+                    [(user_id, target, self._timestamp()) for user_id in batch
+                     for target in self._targets(user_id, total, args.views)]
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO blocks (user_id, blocked_user_id) VALUES (?, ?)",
+                    [(user_id, target) for user_id in batch
+                     for target in self._targets(user_id, total, args.blocks)]
+                )
+        with self.conn:
+            migrations.rebuild_like_inbox(self.conn)
+        self.conn.execute('ANALYZE')
+
+
+class Bench:
+    """Замеры функций database.py на текущем объеме данных"""
+
+    def __init__(self, database, profiles: int, iterations: int, rnd: random.Random):
+        self.db = database
+        self.profiles = profiles
+        self.iterations = iterations
+        self.random = rnd
+
+    def user(self) -> int:
+        return self.random.randint(1, self.profiles)
+
+    @staticmethod
+    def new_user() -> int:
+        return next(_new_user_ids)
+
+    def interests(self) -> List[int]:
+        return self.random.sample(INTEREST_IDS, self.random.randint(1, 3))
+
+    def reset_caches(self):
+        for cache in (self.db.profile_cache, self.db.keyboard_state_cache, self.db.interest_catalog_cache):
+            cache.clear()
+
+    def measure(self, func: Callable[[], object], prepare: Optional[Callable[[], object]] = None) -> Dict:
+        """Вызывает func iterations раз; prepare выполняется перед каждым вызовом вне замера"""
+        self.reset_caches()
+        timings = []
+        for _ in range(self.iterations):
+            arg = prepare() if prepare else None
+            started = time.perf_counter()
+            func(arg) if prepare else func()
+            timings.append(time.perf_counter() - started)
+        return self.summary(timings)
+
+    @staticmethod
+    def summary(timings: List[float]) -> Dict:
+        total = sum(timings)
+        return {
+            'calls': len(timings),
+            'mean_ms': round(total / len(timings) * 1000, 4),
+            'p50_ms': round(percentile(timings, 50) * 1000, 4),
+            'p95_ms': round(percentile(timings, 95) * 1000, 4),
+            'p99_ms': round(percentile(timings, 99) * 1000, 4),
+            'max_ms': round(max(timings) * 1000, 4),
+            'ops_per_second': round(len(timings) / total, 1) if total else None,
+        }
+
+    def engine_load(self) -> Dict:
+        """Полная загрузка движка подбора из БД (первый запрос ленты после старта)"""
+        from matching import MatchingEngine
+        self.db.matching_engine = MatchingEngine()
+        started = time.perf_counter()
+        self.db.matching_engine.ensure_loaded(self.db._load_matching_data)
+        return self.summary([time.perf_counter() - started])
+
+    def run(self) -> Dict[str, Dict]:
+        db = self.db
+        results = {'matching_engine_load': self.engine_load()}
+
+        def viewer():
+            user_id = self.user()
+            return user_id, db.get_profile(user_id).looking_for
+
+        def cold_user():
+            # Кэши сбрасываются, чтобы замерить запрос к БД, а не попадание в кэш
+            self.reset_caches()
+            return self.user()
+
+        benchmarks: List[Tuple[str, Callable, Optional[Callable]]] = [
+            # Чтение
+            ('get_profile', lambda user_id: db.get_profile(user_id), cold_user),
+            ('get_profile_cached', lambda: db.get_profile(1), None),
+            ('get_keyboard_state', lambda user_id: db.get_keyboard_state(user_id), cold_user),
+            ('get_matching_profiles', lambda v: db.get_matching_profiles(v[0], None, v[1], limit=20), viewer),
+            ('get_matching_profile_ids', lambda v: db.get_matching_profile_ids(v[0], v[1], limit=20), viewer),
+            ('get_feed_card', lambda user_id: db.get_feed_card(user_id), self.user),
+            ('get_recent_likes', lambda user_id: db.get_recent_likes(user_id), self.user),
+            ('get_pending_likes_count', lambda user_id: db.get_pending_likes_count(user_id), self.user),
+            ('get_last_like', lambda user_id: db.get_last_like(user_id), self.user),
+            ('check_mutual_like', lambda pair: db.check_mutual_like(*pair), lambda: (self.user(), self.user())),
+            ('get_matches', lambda user_id: db.get_matches(user_id), self.user),
+            ('get_user_interests', lambda user_id: db.get_user_interests(user_id), self.user),
+            ('get_all_interests', db.get_all_interests, None),
+            ('get_users_by_interests', lambda ids: db.get_users_by_interests(ids), self.interests),
+            ('get_all_users', db.get_all_users, None),
+            # Запись
+            ('add_viewed_profile', lambda pair: db.add_viewed_profile(*pair), lambda: (self.user(), self.user())),
+            ('write_buffer_flush', lambda: db.write_buffer.flush(), None),
+            ('update_last_active', lambda user_id: db.update_last_active(user_id), self.user),
+            ('like_and_check_match', lambda pair: db.like_and_check_match(*pair),
+             lambda: (self.user(), self.user())),
+            ('add_block', lambda pair: db.add_block(*pair), lambda: (self.user(), self.user())),
+            ('update_profile', lambda user_id: db.update_profile(user_id, age=self.random.randint(18, 60)),
+             self.user),
+            ('replace_user_interests', lambda user_id: db.replace_user_interests(user_id, self.interests()),
+             self.user),
+            ('create_profile', lambda user_id: db.create_profile(
+                user_id, f'User{user_id}', 30, 'Анкета бенчмарка', f'photo{user_id}', 'F', 'M', None,
+                f'user{user_id}', self.interests()), self.new_user),
+        ]
+        for name, func, prepare in benchmarks:
+            if name == 'get_all_users' and self.iterations > 20:
+                # Полный список id - дорогой запрос, достаточно нескольких замеров
+                iterations, self.iterations = self.iterations, 20
+                results[name] = self.measure(func, prepare)
+                self.iterations = iterations
+            else:
+                results[name] = self.measure(func, prepare)
+            print(f"  {name:<26}{results[name]['mean_ms']:>10} ms mean{results[name]['p99_ms']:>10} ms p99",
+                  file=sys.stderr)
+        db.write_buffer.flush()
+        return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Микробенчмарки database.py')
+    parser.add_argument('--profiles', default='10000,100000',
+                        help='объемы анкет через запятую; уровни наращиваются в одной БД')
+    parser.add_argument('--likes', type=int, default=20, help='лайков от каждой анкеты')
+    parser.add_argument('--like-back', type=float, default=0.2, help='доля взаимных лайков')
+    parser.add_argument('--views', type=int, default=50, help='просмотров от каждой анкеты')
+    parser.add_argument('--blocks', type=int, default=1, help='блокировок от каждой анкеты')
+    parser.add_argument('--interests', type=int, default=5, help='максимум интересов у анкеты')
+    parser.add_argument('--iterations', type=int, default=200, help='вызовов каждой функции на уровень')
+    parser.add_argument('--db', default='bench.db', help='файл БД бенчмарка (пересоздается)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='файл результатов (по умолчанию - stdout)')
+    args = parser.parse_args(argv)
+    args.profiles = sorted(int(value) for value in args.profiles.split(',') if value)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if os.path.abspath(args.db) == os.path.abspath(os.getenv('DATABASE_PATH', 'dating_bot.db')):
+        sys.exit(f"Refusing to benchmark against the bot database {args.db}")
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    # database.py читает путь к БД при импорте
+    os.environ['DATABASE_PATH'] = args.db
+    import database
+
+    database.bootstrap()
+    rnd = random.Random(args.seed)
+    seeder = Seeder(database.get_connection(), args, rnd)
+    report = {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'started_at': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'params': {key: value for key, value in vars(args).items() if key not in ('json', 'db')},
+        'levels': [],
+    }
+
+    seeded = 0
+    try:
+        for profiles in args.profiles:
+            print(f"Seeding {seeded + 1}..{profiles}", file=sys.stderr)
+            started = time.perf_counter()
+            seeder.seed(seeded + 1, profiles + 1)
+            seed_seconds = time.perf_counter() - started
+            seeded = profiles
+
+            conn = database.get_connection()
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ('profiles', 'user_interests', 'likes', 'viewed_profiles', 'blocks')}
+            print(f"Level {profiles}: {counts}", file=sys.stderr)
+            report['levels'].append({
+                'profiles': profiles,
+                'rows': counts,
+                'seed_seconds': round(seed_seconds, 2),
+                'db_size_bytes': os.path.getsize(args.db),
+                'results': Bench(database, profiles, args.iterations, rnd).run(),
+            })
+    finally:
+        database.close_connections()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    BotBlocked, CantInitiateConversation, ChatNotFound, MessageNotModified,
+    RetryAfter, TelegramAPIError, UserDeactivated
+)
+
+import async_db as db
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает около 30 сообщений в секунду от бота и 1 в секунду в один чат
+GLOBAL_RATE = 25
+PER_CHAT_RATE = 1
+# Число одновременных отправок
+WORKERS = 20
+# Сколько получателей читаем из БД и сохраняем за раз
+BATCH_SIZE = 500
+# Как часто обновлять сообщение с прогрессом у администратора (секунды)
+PROGRESS_INTERVAL = 5
+# Сколько раз повторять отправку при ошибках сети/API (RetryAfter не считается)
+MAX_ATTEMPTS = 3
+# Сколько раз подряд ждать по RetryAfter перед отказом от получателя
+MAX_FLOOD_WAITS = 10
+# Как часто рассылающий процесс ищет новые рассылки других процессов (секунды)
+WATCH_INTERVAL = 5
+
+# Ошибки, после которых повторять отправку бессмысленно
+PERMANENT_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated, CantInitiateConversation)
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов (после RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """Ограничивает частоту сообщений в каждый отдельный чат"""
+
+    def __init__(self, rate: float, max_chats: int = 10000):
+        self.interval = 1 / rate
+        self.max_chats = max_chats
+        self._next_allowed: Dict[int, float] = {}
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        next_allowed = self._next_allowed.get(chat_id, now)
+        self._next_allowed[chat_id] = max(now, next_allowed) + self.interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+        if len(self._next_allowed) > self.max_chats:
+            # Забываем чаты, для которых ограничение уже истекло
+            self._next_allowed = {chat: moment for chat, moment in self._next_allowed.items()
+                                  if moment > now}
+
+
+class Broadcaster:
+    """
+    Фоновая рассылка сообщений.
+
+    Получатели и прогресс хранятся в таблицах broadcast_jobs и
+    broadcast_recipients, поэтому после перезапуска бота рассылка
+    продолжается с места остановки (resume). Отправка идет пулом из
+    WORKERS корутин с общим и per-chat ограничением частоты.
+
+    Ограничение частоты действует в пределах процесса. Когда процессов
+    несколько (cluster.py), рассылает только один - с active=True; в
+    остальных start() лишь оставляет созданную рассылку в БД, а
+    рассылающий процесс находит ее через watch().
+    """
+
+    def __init__(self, bot: Bot, workers: int = WORKERS,
+                 rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE):
+        self.bot = bot
+        self.workers = workers
+        self.active = True
+        self._global_limit = TokenBucket(rate)
+        self._chat_limit = PerChatLimiter(per_chat_rate)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self, job_id: int) -> Optional[asyncio.Task]:
+        """Запускает рассылку в фоне; None - ее отправит другой процесс"""
+        if not self.active:
+            logger.info(f"Broadcast job {job_id} left to the broadcasting process")
+            return None
+        task = self._tasks.get(job_id)
+        if task is None:
+            task = asyncio.ensure_future(self._run(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return task
+
+    async def resume(self):
+        """Продолжает рассылки, прерванные остановкой бота"""
+        for job_id in await db.get_unfinished_broadcast_jobs():
+            if job_id not in self._tasks:
+                logger.info(f"Resuming broadcast job {job_id}")
+                self.start(job_id)
+
+    def watch(self, interval: float = WATCH_INTERVAL):
+        """Периодически запускает рассылки, созданные другими процессами"""
+        if self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch(interval))
+
+    async def _watch(self, interval: float):
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            try:
+                await self.resume()
+            except Exception as e:
+                logger.error(f"Error looking for new broadcast jobs: {e}")
+
+    async def stop(self):
+        """Дожидается отправки текущих порций; незавершенные рассылки продолжатся при запуске"""
+        self._stopping = True
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, job_id: int):
+        try:
+            job = await db.get_broadcast_job(job_id)
+            if not job:
+                logger.error(f"Broadcast job {job_id} not found")
+                return
+            text = job[1]
+            last_report = time.monotonic()
+
+            while not self._stopping:
+                recipients = await db.get_pending_broadcast_recipients(job_id, BATCH_SIZE)
+                if not recipients:
+                    await db.finish_broadcast_job(job_id)
+                    await self._report(job_id, finished=True)
+                    return
+                sent, failed = await self._send_batch(text, recipients)
+                await db.save_broadcast_progress(job_id, sent, failed)
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    await self._report(job_id)
+                    last_report = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error in broadcast job {job_id}: {e}", exc_info=True)
+
+    async def _send_batch(self, text: str, recipients: List[int]) -> Tuple[List[int], List[int]]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in recipients:
+            queue.put_nowait(user_id)
+        sent: List[int] = []
+        failed: List[int] = []
+
+        async def worker():
+            while not self._stopping:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    delivered = await self._deliver(user_id, text)
+                except Exception as e:
+                    # Исключение прервало бы всю порцию, и уже отправленные
+                    # в ней сообщения ушли бы повторно после перезапуска
+                    logger.error(f"Unexpected error sending broadcast message to user {user_id}: {e}",
+                                 exc_info=True)
+                    delivered = False
+                if delivered:
+                    sent.append(user_id)
+                else:
+                    failed.append(user_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(recipients)))))
+        return sent, failed
+
+    async def _deliver(self, user_id: int, text: str) -> bool:
+        attempts = 0
+        flood_waits = 0
+        while attempts < MAX_ATTEMPTS and flood_waits < MAX_FLOOD_WAITS:
+            await self._global_limit.acquire()
+            await self._chat_limit.acquire(user_id)
+            try:
+                await self.bot.send_message(user_id, text)
+                return True
+            except RetryAfter as e:
+                flood_waits += 1
+                logger.warning(f"Flood limit hit, pausing broadcast for {e.timeout}s")
+                self._global_limit.pause(e.timeout)
+            except PERMANENT_ERRORS as e:
+                logger.info(f"Broadcast message not delivered to user {user_id}: {e}")
+                return False
+            except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+                attempts += 1
+                logger.error(f"Error sending broadcast message to user {user_id} "
+                             f"(attempt {attempts}): {e}")
+                await asyncio.sleep(attempts)
+        return False
+
+    async def _report(self, job_id: int, finished: bool = False):
+        """Показывает администратору прогресс рассылки"""
+        job = await db.get_broadcast_job(job_id)
+        if not job:
+            return
+        _, _, admin_chat_id, progress_message_id, _, total, sent, failed = job
+        if finished:
+            text = f"Рассылка успешно отправлена! Доставлено: {sent} из {total}, ошибок: {failed}"
+        else:
+            text = f"Рассылка выполняется: {sent + failed} из {total} (доставлено: {sent}, ошибок: {failed})"
+        try:
+            if progress_message_id and not finished:
+                await self.bot.edit_message_text(text, chat_id=admin_chat_id,
+                                                 message_id=progress_message_id)
+            else:
+                await self.bot.send_message(admin_chat_id, text)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.error(f"Error reporting progress of broadcast job {job_id}: {e}")
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с необязательным временем жизни записей.
+
+    get_or_load() защищает от гонки "прочитали из БД старое значение,
+    параллельно его изменили и инвалидировали, а потом мы положили
+    старое значение в кэш": значение, загруженное до инвалидации,
+    в кэш не попадает.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            if item is not MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Как get(), но промах не учитывается в статистике.
+
+        Для быстрой проверки перед get_or_load(), которая сама учтет промах.
+        Чтение не без последствий: попадание учитывается в hits и делает
+        запись самой свежей в порядке LRU. Истекшая запись не удаляется
+        (это сделают get() и get_or_load()), а поколение не проверяется -
+        его проверяет только set().
+        """
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            if item is not MISSING and (item[1] is None or item[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            return default
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """Сохраняет значение; если передан generation и с тех пор была инвалидация - не сохраняет"""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        generation = self._generation
+        value = loader()
+        self.set(key, value, generation=generation)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
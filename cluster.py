@@ -0,0 +1,369 @@
+"""
+Запуск бота несколькими процессами.
+
+    python cluster.py [--workers N]
+
+Фронтовой процесс получает обновления от Telegram (getUpdates или
+webhook - по BOT_MODE, см. webhook.py) и передает каждое одному из N
+рабочих процессов по user_id: все обновления пользователя обрабатывает
+один и тот же процесс, строго по очереди - следующее передается только
+после ответа на предыдущее. Обновления разных пользователей
+обрабатываются параллельно в разных процессах.
+
+Рабочий процесс - обычный бот из main.py (обработчики, FSM, кэши),
+который принимает обновления по HTTP на 127.0.0.1:CLUSTER_BASE_PORT+номер.
+Все процессы работают с одной БД SQLite в режиме WAL. Изменения,
+влияющие на кэши и движок подбора других процессов (профили, интересы,
+лайки, блокировки), пишутся в журнал changes в той же транзакции, что и
+данные; каждый процесс раз в CLUSTER_POLL_INTERVAL секунд применяет
+чужие записи (database.apply_changes).
+
+Память: каждый рабочий процесс строит полный MatchingEngine с
+InterestIndex по всем анкетам - в ленту пользователя попадают анкеты
+из любого шарда, поэтому индекс по одному шарду не подходит. Расход
+памяти на индекс растет линейно с числом процессов; очереди ленты
+строятся только для пользователей своего шарда. При выборе
+CLUSTER_WORKERS учитывайте память одного процесса бота, умноженную на N.
+
+Рассылки отправляет только процесс 0: ограничение частоты Broadcaster
+действует в пределах процесса. Рассылку, подтвержденную в другом
+процессе, он находит в БД (Broadcaster.watch).
+
+Настройки (переменные окружения / .env):
+- CLUSTER_WORKERS - число рабочих процессов (по числу ядер);
+- CLUSTER_BASE_PORT - порт первого рабочего процесса (8100);
+- CLUSTER_POLL_INTERVAL - период чтения журнала изменений, секунды (0.2);
+- CLUSTER_CHANGES_RETENTION - сколько секунд хранить записи журнала (600);
+- METRICS_PORT - если задан, рабочий процесс N отдает метрики на METRICS_PORT+1+N.
+
+Остановка (SIGINT/SIGTERM фронта): фронт перестает получать обновления,
+дожидается передачи уже полученных и останавливает рабочие процессы,
+которые дописывают свои данные в БД.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import aiohttp
+from aiohttp import web
+
+import webhook
+from logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 1)))
+CLUSTER_BASE_PORT = int(os.getenv('CLUSTER_BASE_PORT', '8100'))
+CLUSTER_POLL_INTERVAL = float(os.getenv('CLUSTER_POLL_INTERVAL', '0.2'))
+CLUSTER_CHANGES_RETENTION = float(os.getenv('CLUSTER_CHANGES_RETENTION', '600'))
+
+WORKER_PATH = '/update'
+# Попыток передать обновление рабочему процессу (он может перезапускаться)
+DELIVERY_ATTEMPTS = 5
+# Рабочий процесс отвечает не позже чем через 55 секунд (aiogram RESPONSE_TIMEOUT)
+DELIVERY_TIMEOUT = 60
+STARTUP_TIMEOUT = 60
+
+
+def update_user_id(update: dict) -> int:
+    """id пользователя (или чата), от которого пришло обновление; 0 - не определен"""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        for field in ('from', 'user', 'chat'):
+            if isinstance(value.get(field), dict) and 'id' in value[field]:
+                return value[field]['id']
+    return 0
+
+
+def shard_for(user_id: int, workers: int) -> int:
+    return hash(user_id) % workers
+
+
+# --- рабочий процесс ---
+
+async def _apply_changes_loop(index: int):
+    """Применяет изменения других процессов; первый процесс еще и чистит журнал"""
+    import async_db as db
+    import database
+
+    last_prune = time.monotonic()
+    while True:
+        await asyncio.sleep(CLUSTER_POLL_INTERVAL)
+        try:
+            await db.run(database.apply_changes)
+            if index == 0 and time.monotonic() - last_prune > CLUSTER_CHANGES_RETENTION / 2:
+                last_prune = time.monotonic()
+                pruned = await db.run(database.prune_changes, CLUSTER_CHANGES_RETENTION)
+                logger.debug(f"Pruned {pruned} old changes")
+        except Exception as e:
+            logger.error(f"Error applying changes from other processes: {e}", exc_info=True)
+
+
+def run_worker(index: int, port: int):
+    """Точка входа рабочего процесса"""
+    # Ctrl+C в терминале получает вся группа процессов; рабочие процессы
+    # останавливает фронт, после того как передаст им все обновления
+    os.setpgrp()
+    metrics_port = int(os.getenv('METRICS_PORT', '0'))
+    if metrics_port:
+        os.environ['METRICS_PORT'] = str(metrics_port + 1 + index)
+
+    import async_db as db
+    import database
+    import main
+    from aiogram.utils.executor import Executor
+
+    # Лимит частоты рассылки действует в пределах процесса: рассылает
+    # только первый процесс, иначе общая скорость выросла бы в N раз
+    main.broadcaster.active = index == 0
+    apply_task: Optional[asyncio.Task] = None
+
+    async def startup(dp):
+        nonlocal apply_task
+        await db.bootstrap()
+        await db.run(database.enable_change_log, index)
+        apply_task = asyncio.ensure_future(_apply_changes_loop(index))
+        await main.metrics_exporter.start()
+        # Рассылки (прерванные и созданные другими процессами) и
+        # перепроверку фото ведет только один процесс
+        if index == 0:
+            await main.broadcaster.resume()
+            main.broadcaster.watch()
+            main.photo_validator.start()
+        logger.info(f"Worker {index} listening on 127.0.0.1:{port}")
+
+    async def shutdown(dp):
+        if not await webhook.in_flight.drain(webhook.WEBHOOK_DRAIN_TIMEOUT):
+            logger.warning(f"Worker {index}: {webhook.in_flight.count} update(s) still in progress")
+        if apply_task is not None:
+            apply_task.cancel()
+        await main.on_shutdown(dp)
+
+    executor = Executor(main.dp, skip_updates=False)
+    executor.on_startup(startup, polling=False)
+    executor.on_shutdown(shutdown, polling=False)
+    executor.start_webhook(
+        webhook_path=WORKER_PATH,
+        request_handler=webhook.DrainingRequestHandler,
+        host='127.0.0.1',
+        port=port,
+        shutdown_timeout=webhook.WEBHOOK_DRAIN_TIMEOUT + 5,
+        access_log=None,
+        print=None
+    )
+
+
+# --- фронтовой процесс ---
+
+class Router:
+    """
+    Передает обновления рабочим процессам.
+
+    Для каждого пользователя держит цепочку доставки: следующее
+    обновление уходит после ответа рабочего процесса на предыдущее.
+    """
+
+    def __init__(self, worker_urls: List[str]):
+        self.worker_urls = worker_urls
+        self._chains: Dict[int, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._headers = {webhook.SECRET_HEADER: webhook.WEBHOOK_SECRET} if webhook.WEBHOOK_SECRET else {}
+        self.delivered = 0
+        self.failed = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=DELIVERY_TIMEOUT))
+        return self._session
+
+    def dispatch(self, update: dict):
+        user_id = update_user_id(update)
+        previous = self._chains.get(user_id)
+        task = asyncio.ensure_future(self._deliver(user_id, update, previous))
+        self._chains[user_id] = task
+        task.add_done_callback(lambda done: self._release(user_id, done))
+
+    def _release(self, user_id: int, task: asyncio.Task):
+        if self._chains.get(user_id) is task:
+            del self._chains[user_id]
+
+    async def _deliver(self, user_id: int, update: dict, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            # Ошибка предыдущего обновления не мешает доставке следующего
+            await asyncio.wait([previous])
+        url = self.worker_urls[shard_for(user_id, len(self.worker_urls))]
+        for attempt in range(1, DELIVERY_ATTEMPTS + 1):
+            try:
+                async with self.session.post(url, json=update, headers=self._headers) as response:
+                    if response.status == 200:
+                        self.delivered += 1
+                        return
+                    logger.warning(f"Worker {url} answered {response.status} to update "
+                                   f"{update.get('update_id')} (attempt {attempt})")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Error delivering update {update.get('update_id')} to {url} "
+                               f"(attempt {attempt}): {e!r}")
+            await asyncio.sleep(0.5 * attempt)
+        self.failed += 1
+        logger.error(f"Update {update.get('update_id')} for user {user_id} was not delivered")
+
+    async def wait_ready(self, processes: List[multiprocessing.Process]):
+        """Ждет, пока все рабочие процессы начнут принимать обновления"""
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        for url, process in zip(self.worker_urls, processes):
+            while True:
+                if not process.is_alive():
+                    raise RuntimeError(f"Worker {process.name} exited with code {process.exitcode}")
+                try:
+                    async with self.session.get(url) as response:
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker {process.name} did not start in {STARTUP_TIMEOUT}s")
+                await asyncio.sleep(0.2)
+        logger.info(f"{len(self.worker_urls)} workers ready")
+
+    async def drain(self):
+        """Дожидается доставки всех полученных обновлений"""
+        while self._chains:
+            await asyncio.wait(list(self._chains.values()))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class Poller:
+    """Получение обновлений через getUpdates"""
+
+    def __init__(self, bot, router: Router):
+        self.bot = bot
+        self.router = router
+        self.offset: Optional[int] = None
+
+    async def run(self):
+        await self.bot.delete_webhook()
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=self.offset, timeout=20)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error getting updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                self.router.dispatch(update.to_python())
+                self.offset = update.update_id + 1
+
+    async def confirm(self):
+        """Подтверждает Telegram уже переданные обновления, чтобы они не пришли повторно"""
+        if self.offset is not None:
+            await self.bot.get_updates(offset=self.offset, limit=1, timeout=0)
+
+
+async def _serve_webhook(router: Router, stop: asyncio.Event, bot):
+    async def handle(request: web.Request):
+        if webhook.WEBHOOK_SECRET and request.headers.get(webhook.SECRET_HEADER) != webhook.WEBHOOK_SECRET:
+            return web.Response(status=403)
+        if stop.is_set():
+            return web.Response(status=503)
+        router.dispatch(await request.json())
+        return web.Response(text='ok')
+
+    app = web.Application()
+    app.router.add_post(webhook.WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, webhook.WEBAPP_HOST, webhook.WEBAPP_PORT).start()
+    await bot.set_webhook(
+        webhook.webhook_url(),
+        secret_token=webhook.WEBHOOK_SECRET or None,
+        max_connections=webhook.WEBHOOK_MAX_CONNECTIONS,
+        drop_pending_updates=False
+    )
+    logger.info(f"Webhook set to {webhook.webhook_url()}, "
+                f"listening on {webhook.WEBAPP_HOST}:{webhook.WEBAPP_PORT}")
+    await stop.wait()
+    await runner.cleanup()
+
+
+async def run_front(processes: List[multiprocessing.Process], worker_urls: List[str]):
+    from aiogram import Bot
+
+    token = os.getenv('BOT_TOKEN')
+    if not token:
+        raise ValueError("Не установлен токен бота. Проверьте файл .env")
+    if webhook.BOT_MODE == 'webhook' and not webhook.WEBHOOK_URL:
+        raise ValueError("Не задан WEBHOOK_URL для режима webhook. Проверьте файл .env")
+    bot = Bot(token=token)
+    router = Router(worker_urls)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await router.wait_ready(processes)
+        if webhook.BOT_MODE == 'webhook':
+            await _serve_webhook(router, stop, bot)
+            await router.drain()
+        else:
+            poller = Poller(bot, router)
+            poll_task = asyncio.ensure_future(poller.run())
+            await stop.wait()
+            poll_task.cancel()
+            await asyncio.wait([poll_task])
+            await router.drain()
+            await poller.confirm()
+        logger.info(f"Front stopped: {router.delivered} updates delivered, {router.failed} failed")
+    finally:
+        await router.close()
+        await (await bot.get_session()).close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Запуск бота несколькими процессами')
+    parser.add_argument('--workers', type=int, default=CLUSTER_WORKERS)
+    parser.add_argument('--base-port', type=int, default=CLUSTER_BASE_PORT)
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    context = multiprocessing.get_context('spawn')
+    ports = [args.base_port + index for index in range(args.workers)]
+    processes = [
+        context.Process(target=run_worker, args=(index, port), name=f'worker-{index}', daemon=True)
+        for index, port in enumerate(ports)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} workers")
+
+    try:
+        asyncio.run(run_front(processes, [f'http://127.0.0.1:{port}{WORKER_PATH}' for port in ports]))
+    finally:
+        # SIGTERM: рабочий процесс дорабатывает принятые обновления и закрывает БД
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(webhook.WEBHOOK_DRAIN_TIMEOUT + 10)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,160 +1,264 @@
+import os
 import sqlite3
-from typing import Optional, List, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, List, Tuple, Dict
 import logging
 from datetime import datetime
 
-# Настройка логирования
+import metrics
+import migrations
+import queries
+from cache import LRUCache
+from db_pool import ConnectionPool
+from matching import MatchingEngine
+from models import InterestCatalog, Profile
+from write_buffer import WriteBuffer
+
+# Логирование настраивается в logging_config.py (вывод идет через очередь в фоновом потоке)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
-# Создаем обработчик для вывода в файл
-file_handler = logging.FileHandler('database.log')
-file_handler.setLevel(logging.INFO)
+# Константы
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'dating_bot.db')
+# 1 - не запускать бота, если план горячего запроса не использует индекс (см. migrations.py)
+STRICT_QUERY_PLANS = os.getenv('STRICT_QUERY_PLANS', '0') == '1'
 
-# Создаем обработчик для вывода в консоль
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+# Постоянные соединения (по одному на поток)
+pool = ConnectionPool(DATABASE_PATH)
 
-# Создаем форматтер для логов
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+# Отложенная запись просмотров, last_active и username
+write_buffer = WriteBuffer(pool, on_flush=lambda conn, usernames: _publish_usernames(conn, usernames))
 
-# Добавляем обработчики к логгеру
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+# Очереди кандидатов для ленты анкет
+matching_engine = MatchingEngine()
 
-# Константы
-DATABASE_PATH = 'dating_bot.db'
+# Состояние главной клавиатуры: user_id -> (есть профиль, есть новые лайки).
+# Сбрасывается в add_profile/update_profile/add_like, TTL - страховка
+keyboard_state_cache = LRUCache(maxsize=50000, ttl=300)
 
-def init_db():
-    """Инициализация базы данных"""
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        
-        # Создание таблицы профилей с полем username
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS profiles (
-                user_id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                age INTEGER NOT NULL,
-                description TEXT NOT NULL,
-                photo_id TEXT NOT NULL,
-                gender TEXT NOT NULL,
-                looking_for TEXT NOT NULL,
-                city TEXT,
-                username TEXT,  -- Добавлено поле username
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Попытка добавить столбец username, если его нет
+# Профили по user_id (None - профиля нет).
+# Сбрасывается в add_profile/update_profile/update_username
+profile_cache = LRUCache(maxsize=10000, ttl=600)
+
+# Справочник интересов (models.InterestCatalog). Меняется миграциями, а
+# TTL подхватывает правки таблицы interests, сделанные вручную
+interest_catalog_cache = LRUCache(maxsize=1, ttl=300)
+
+metrics.REGISTRY.gauge('db_connections_open', 'Open SQLite connections',
+                       lambda: {(): pool.size})
+metrics.REGISTRY.gauge('db_connections_opened_total', 'SQLite connections opened since start',
+                       lambda: {(): pool.opened})
+metrics.REGISTRY.gauge('db_write_buffer_pending', 'Buffered writes not yet flushed',
+                       lambda: {(): len(write_buffer)})
+metrics.REGISTRY.gauge('cache_entries', 'Entries in in-process caches', lambda: {
+    (('cache', name),): len(cache) for name, cache in _CACHES.items()})
+metrics.REGISTRY.gauge('cache_hits', 'Cache hits', lambda: {
+    (('cache', name),): cache.hits for name, cache in _CACHES.items()})
+metrics.REGISTRY.gauge('cache_misses', 'Cache misses', lambda: {
+    (('cache', name),): cache.misses for name, cache in _CACHES.items()})
+
+_CACHES = {
+    'keyboard_state': keyboard_state_cache,
+    'profile': profile_cache,
+    'interest_catalog': interest_catalog_cache,
+}
+
+_bootstrap_lock = threading.Lock()
+_bootstrapped = False
+
+def bootstrap():
+    """
+    Подготовка БД к работе; вызывается один раз при запуске бота.
+
+    Если версия схемы устарела, применяет недостающие миграции одной
+    транзакцией; если актуальна - обходится одним чтением PRAGMA user_version.
+    В обоих случаях проверяет планы горячих запросов (см. migrations.py):
+    индекс мог быть удален вручную. По умолчанию проблемы только пишутся в
+    лог - бот с медленным запросом лучше неработающего; STRICT_QUERY_PLANS=1
+    останавливает запуск. Повторные вызовы ничего не делают.
+    """
+    global _bootstrapped
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
         try:
-            c.execute('ALTER TABLE profiles ADD COLUMN username TEXT;')
-            logger.info("Added username column to profiles table")
-        except sqlite3.OperationalError:
-            logger.info("Username column already exists")
-        
-        # Создание таблицы интересов
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS interests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE
-            )
-        ''')
-        
-        # Создание таблицы интересов пользователей
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS user_interests (
-                user_id INTEGER,
-                interest_id INTEGER,
-                FOREIGN KEY (user_id) REFERENCES profiles (user_id),
-                FOREIGN KEY (interest_id) REFERENCES interests (id),
-                PRIMARY KEY (user_id, interest_id)
-            )
-        ''')
-        
-        # Создание таблицы лайков
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS likes (
-                user_id INTEGER,
-                liked_user_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES profiles (user_id),
-                FOREIGN KEY (liked_user_id) REFERENCES profiles (user_id),
-                PRIMARY KEY (user_id, liked_user_id)
-            )
-        ''')
-        
-        # Создание таблицы просмотренных профилей
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS viewed_profiles (
-                user_id INTEGER,
-                viewed_user_id INTEGER,
-                viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES profiles (user_id),
-                FOREIGN KEY (viewed_user_id) REFERENCES profiles (user_id),
-                PRIMARY KEY (user_id, viewed_user_id)
-            )
-        ''')
-        
-        # Создание таблицы жалоб
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                from_user_id INTEGER,
-                reported_user_id INTEGER,
-                reason TEXT,  -- Добавлено поле для причины жалобы
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (from_user_id) REFERENCES profiles (user_id),
-                FOREIGN KEY (reported_user_id) REFERENCES profiles (user_id),
-                PRIMARY KEY (from_user_id, reported_user_id)
-            )
-        ''')
-        
-        # Создание таблицы блокировок
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS blocks (
-                user_id INTEGER,
-                blocked_user_id INTEGER,
-                reason TEXT,  -- Добавлено поле для причины блокировки
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES profiles (user_id),
-                FOREIGN KEY (blocked_user_id) REFERENCES profiles (user_id),
-                PRIMARY KEY (user_id, blocked_user_id)
-            )
-        ''')
-        
-        # Создание индексов для оптимизации
-        c.execute('CREATE INDEX IF NOT EXISTS idx_likes_user ON likes(user_id)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_likes_liked_user ON likes(liked_user_id)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_viewed_user ON viewed_profiles(user_id)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_user_interests ON user_interests(user_id)')
-        
-        conn.commit()
-        logger.info("Database initialized successfully")
-        
-    except Exception as e:
-        logger.error(f"Error initializing database: {e}")
-        raise
-    finally:
-        conn.close()
+            conn = get_connection()
+            version = migrations.get_version(conn)
+            if version == migrations.SCHEMA_VERSION:
+                logger.info(f"Database schema is up to date (version {version})")
+            else:
+                version = migrations.migrate(conn)
+                interest_catalog_cache.clear()
+                logger.info(f"Database initialized successfully, schema version {version}")
+            for problem in migrations.check_query_plans(conn, strict=STRICT_QUERY_PLANS):
+                logger.warning(f"Query plan check failed: {problem}")
+        except Exception as e:
+            logger.error(f"Error initializing database: {e}")
+            raise
+        _bootstrapped = True
 
 # ... продолжение следует ...
 def get_connection():
-    """Создает и возвращает соединение с БД"""
+    """Возвращает постоянное соединение с БД для текущего потока"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        logger.info(f"Successfully connected to database: {DATABASE_PATH}")
-        return conn
+        return pool.connection()
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         raise
 
-def execute_query(query: str, params: tuple = (), fetch: bool = False):
-    """Выполняет запрос к БД с обработкой ошибок"""
+# Состояние транзакции текущего потока (см. transaction())
+_tx_state = threading.local()
+
+def in_transaction() -> bool:
+    return getattr(_tx_state, 'depth', 0) > 0
+
+@contextmanager
+def transaction():
+    """
+    Единица работы: все запросы внутри блока фиксируются одним COMMIT
+    или целиком откатываются при исключении.
+
+    Вложенные блоки присоединяются к внешней транзакции. Функции,
+    переданные в on_commit(), выполняются только после COMMIT - так
+    кэши и движок подбора не видят откаченных изменений.
+    """
+    conn = get_connection()
+    depth = getattr(_tx_state, 'depth', 0)
+    if depth == 0:
+        _tx_state.hooks = []
+        started = time.perf_counter()
+    _tx_state.depth = depth + 1
+    try:
+        yield conn
+        if depth == 0:
+            conn.commit()
+    except BaseException:
+        if depth == 0:
+            conn.rollback()
+            _tx_state.hooks = []
+            logger.info("Transaction rolled back")
+        raise
+    finally:
+        _tx_state.depth = depth
+
+    if depth == 0:
+        metrics.transaction_seconds.observe(time.perf_counter() - started)
+        hooks, _tx_state.hooks = _tx_state.hooks, []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Error in after-commit hook {hook!r}: {e}", exc_info=True)
+
+def on_commit(func: Callable[[], None]):
+    """Выполняет func после фиксации текущей транзакции (или сразу, если транзакции нет)"""
+    if in_transaction():
+        _tx_state.hooks.append(func)
+    else:
+        func()
+
+def close_connections():
+    """Сбрасывает отложенные записи и закрывает все соединения с БД"""
+    try:
+        write_buffer.close()
+    except Exception as e:
+        logger.error(f"Error flushing write buffer: {e}")
+    pool.close_all()
+
+# --- журнал изменений для нескольких процессов (см. cluster.py) ---
+
+# Номер процесса, пишущего журнал; None - бот работает одним процессом
+# и журнал не ведется
+_change_origin: Optional[int] = None
+# Последняя прочитанная запись журнала
+_change_cursor = 0
+
+def enable_change_log(origin: int):
+    """
+    Включает журнал изменений: изменения профилей, интересов, лайки и
+    блокировки записываются в changes в той же транзакции, что и сами
+    данные, а apply_changes() применяет записи других процессов.
+    """
+    global _change_origin, _change_cursor
+    row = get_connection().execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()
+    _change_cursor = row[0]
+    _change_origin = origin
+    logger.info(f"Change log enabled for process {origin}, starting after change {_change_cursor}")
+
+def _publish(conn: sqlite3.Connection, kind: str, user_id: int, other_id: Optional[int] = None):
+    """Записывает изменение в журнал (внутри транзакции изменения)"""
+    if _change_origin is not None:
+        _timed_execute(conn, '_publish',
+                       "INSERT INTO changes (kind, user_id, other_id, origin) VALUES (?, ?, ?, ?)",
+                       (kind, user_id, other_id, _change_origin))
+
+def _publish_usernames(conn: sqlite3.Connection, usernames: Dict[int, str]):
+    if _change_origin is not None:
+        _timed_execute(conn, '_publish_usernames',
+                       "INSERT INTO changes (kind, user_id, origin) VALUES ('profile', ?, ?)",
+                       [(user_id, _change_origin) for user_id in usernames], many=True)
+
+def apply_changes() -> int:
+    """
+    Применяет записи журнала, сделанные другими процессами: сбрасывает
+    кэши и обновляет движок подбора. Возвращает число примененных записей.
+    """
+    global _change_cursor
+    if _change_origin is None:
+        return 0
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id, kind, user_id, other_id, origin FROM changes WHERE id > ? ORDER BY id",
+        (_change_cursor,)
+    ).fetchall()
+    if not rows:
+        return 0
+    _change_cursor = rows[-1][0]
+    changes = [row[1:4] for row in rows if row[4] != _change_origin]
+
+    profile_ids = {user_id for kind, user_id, _ in changes if kind == 'profile'}
+    interest_ids = {user_id for kind, user_id, _ in changes if kind == 'interests'}
+    if profile_ids:
+        query = queries.CHANGED_PROFILES.format(','.join(['?'] * len(profile_ids)))
+        for user_id, gender, looking_for, age in conn.execute(query, tuple(profile_ids)):
+            matching_engine.upsert_profile(user_id, gender, looking_for, age)
+        for user_id in profile_ids:
+            profile_cache.invalidate(user_id)
+            invalidate_keyboard_state(user_id)
+    for user_id in interest_ids:
+        ids = [row[0] for row in conn.execute(
+            "SELECT interest_id FROM user_interests WHERE user_id = ?", (user_id,))]
+        matching_engine.set_interests(user_id, ids)
+    for kind, user_id, other_id in changes:
+        if kind == 'like':
+            invalidate_keyboard_state(user_id, other_id)
+        elif kind == 'block':
+            matching_engine.block(user_id, other_id)
+            invalidate_keyboard_state(user_id, other_id)
+    if changes:
+        logger.debug(f"Applied {len(changes)} changes from other processes")
+    return len(changes)
+
+def prune_changes(max_age: float) -> int:
+    """Удаляет записи журнала старше max_age секунд"""
+    with transaction() as conn:
+        cursor = _timed_execute(
+            conn, 'prune_changes',
+            "DELETE FROM changes WHERE created_at < datetime('now', ?)", (f'-{int(max_age)} seconds',))
+    return cursor.rowcount
+
+def execute_query(name: str, query: str, params: tuple = (), fetch: bool = False):
+    """
+    Выполняет запрос к БД с обработкой ошибок.
+
+    name - метка запроса в метриках db_query_* (обычно имя вызывающей функции).
+
+    Внутри transaction() запрос не фиксируется сам по себе - COMMIT
+    или откат выполнит транзакция.
+    """
     connection = None
+    started = time.perf_counter()
     try:
         connection = get_connection()
         cursor = connection.cursor()
@@ -163,146 +267,329 @@ def execute_query(query: str, params: tuple = (), fetch: bool = False):
         
         if fetch:
             result = cursor.fetchall()
+            metrics.query_rows.inc(len(result), query=name)
             logger.debug(f"Query returned {len(result)} results")
         else:
-            connection.commit()
+            if not in_transaction():
+                connection.commit()
             result = None
             logger.debug("Query executed successfully")
             
+        metrics.query_seconds.observe(time.perf_counter() - started, query=name)
         return result
     except sqlite3.Error as e:
+        metrics.query_errors.inc(query=name)
         logger.error(f"Database error: {e}\nQuery: {query}\nParams: {params}")
-        if connection:
+        if connection and not in_transaction():
             connection.rollback()
             logger.info("Transaction rolled back")
         raise
-    finally:
-        if connection:
-            connection.close()
-            logger.debug("Database connection closed")
 
+def _timed_execute(conn: sqlite3.Connection, name: str, query: str, params=(),
+                   many: bool = False) -> sqlite3.Cursor:
+    """
+    conn.execute (или executemany при many=True) с учетом в метриках db_query_*.
 
-def get_profile(user_id: int) -> Optional[tuple]:
-    """Получает профиль пользователя"""
+    Для запросов внутри transaction(), которые работают с соединением
+    напрямую: время и ошибки попадают в те же метрики, что и у
+    execute_query, с меткой name.
+    """
+    started = time.perf_counter()
     try:
-        query = """
-            SELECT user_id, name, age, description, photo_id, gender, looking_for, city, username
-            FROM profiles WHERE user_id = ?
-        """
-        result = execute_query(query, (user_id,), fetch=True)
-        logger.info(f"Retrieved profile for user {user_id}: {'Found' if result else 'Not found'}")
-        if result:
-            logger.debug(f"Profile data: {result[0]}")
-        return result[0] if result else None
+        cursor = conn.executemany(query, params) if many else conn.execute(query, params)
+    except sqlite3.Error as e:
+        metrics.query_errors.inc(query=name)
+        logger.error(f"Database error: {e}\nQuery: {query}")
+        raise
+    metrics.query_seconds.observe(time.perf_counter() - started, query=name)
+    return cursor
+
+
+def _load_profile(user_id: int) -> Optional[Profile]:
+    query = """
+        SELECT user_id, name, age, description, photo_id, gender, looking_for, city, username,
+               photo_broken
+        FROM profiles WHERE user_id = ?
+    """
+    result = execute_query('_load_profile', query, (user_id,), fetch=True)
+    logger.debug(f"Loaded profile for user {user_id}: {'Found' if result else 'Not found'}")
+    if not result:
+        return None
+    profile = Profile(*result[0])
+    # username мог быть изменен, но еще не записан в БД
+    profile.username = write_buffer.pending_username(user_id) or profile.username
+    return profile
+
+def get_profile(user_id: int) -> Optional[Profile]:
+    """Получает профиль пользователя (через кэш)"""
+    try:
+        return profile_cache.get_or_load(user_id, lambda: _load_profile(user_id))
     except Exception as e:
         logger.error(f"Error getting profile for user {user_id}: {e}")
         return None
 
+def _profile_changed(user_id: int, gender: Optional[str] = None,
+                     looking_for: Optional[str] = None, age: Optional[int] = None):
+    """Обновляет движок подбора и сбрасывает кэши после изменения профиля"""
+    matching_engine.upsert_profile(user_id, gender, looking_for, age)
+    profile_cache.invalidate(user_id)
+    invalidate_keyboard_state(user_id)
+
 def add_profile(user_id: int, name: str, age: int, description: str, 
                 photo_id: str, gender: str, looking_for: str, city: Optional[str], username: Optional[str] = None):
     """Добавляет или обновляет профиль пользователя"""
     try:
         query = '''
             INSERT OR REPLACE INTO profiles 
-            (user_id, name, age, description, photo_id, gender, looking_for, city, username, last_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            (user_id, name, age, description, photo_id, gender, looking_for, city, username, last_active,
+             photo_checked_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
         '''
-        execute_query(query, (user_id, name, age, description, photo_id, 
-                            gender, looking_for, city, username))
+        with transaction() as conn:
+            execute_query('add_profile', query, (user_id, name, age, description, photo_id, 
+                                gender, looking_for, city, username))
+            _publish(conn, 'profile', user_id)
+            on_commit(lambda: _profile_changed(user_id, gender, looking_for, age))
         logger.info(f"Profile added/updated for user {user_id} with username {username}")
     except Exception as e:
         logger.error(f"Error adding/updating profile for user {user_id}: {e}")
         raise
 
-def get_matching_profiles(user_id: int, gender: str, looking_for: str, exclude_viewed: bool = True) -> List[tuple]:
-    """Получает список подходящих анкет"""
+def _load_matching_data():
+    """Читает из БД данные для движка подбора анкет"""
+    conn = get_connection()
+    # Несброшенные просмотры берем до чтения таблицы: если их успеют
+    # записать в промежутке, они окажутся в результате запроса
+    pending_viewed = write_buffer.pending_viewed()
+    return (
+        conn.execute("SELECT user_id, gender, looking_for, age FROM profiles").fetchall(),
+        conn.execute("SELECT user_id, interest_id FROM user_interests").fetchall(),
+        conn.execute('''
+            SELECT user_id, viewed_user_id FROM viewed_profiles
+            UNION
+            SELECT user_id, liked_user_id FROM likes
+        ''').fetchall() + list(pending_viewed),
+        conn.execute("SELECT user_id, blocked_user_id FROM blocks").fetchall(),
+    )
+
+def _load_feed_cards(profile_ids: List[int]) -> Dict[int, tuple]:
+    """
+    Данные карточек ленты: user_id -> (user_id, name, age, description,
+    photo_id, [названия интересов]). Интересы читаются тем же запросом,
+    photo_id нерабочего фото - None.
+    """
+    if not profile_ids:
+        return {}
+    query = queries.FEED_CARDS.format(','.join(['?'] * len(profile_ids)))
+    interest_names = get_interest_names()
+    cards = {}
+    for row in execute_query('_load_feed_cards', query, tuple(profile_ids), fetch=True):
+        interest_ids = sorted(int(i) for i in row[5].split(',')) if row[5] else []
+        cards[row[0]] = row[:5] + ([interest_names[i] for i in interest_ids if i in interest_names],)
+    return cards
+
+def get_feed_card(profile_id: int) -> Optional[tuple]:
+    """Карточка анкеты для ленты (см. _load_feed_cards) или None, если анкеты уже нет"""
     try:
-        query = '''
-            SELECT 
-                p.user_id,
-                p.name,
-                p.age,
-                p.description,
-                p.photo_id,
-                COUNT(DISTINCT ui1.interest_id) as common_interests,
-                ABS(p.age - (SELECT age FROM profiles WHERE user_id = ?)) as age_diff
-            FROM profiles p
-            LEFT JOIN user_interests ui1 ON p.user_id = ui1.user_id
-            LEFT JOIN user_interests ui2 ON ui1.interest_id = ui2.interest_id AND ui2.user_id = ?
-            WHERE p.user_id != ?
-            AND (
-                ? = 'MF'
-                OR 
-                (? = 'M' AND p.gender = 'M')
-                OR 
-                (? = 'F' AND p.gender = 'F')
-            )
-        '''
-        
-        if exclude_viewed:
-            query += '''
-                AND NOT EXISTS (
-                    SELECT 1 FROM viewed_profiles 
-                    WHERE user_id = ? AND viewed_user_id = p.user_id
-                )
-                AND NOT EXISTS (
-                    SELECT 1 FROM blocks
-                    WHERE (user_id = ? AND blocked_user_id = p.user_id)
-                       OR (user_id = p.user_id AND blocked_user_id = ?)
-                )
-            '''
-        
-        query += '''
-            GROUP BY p.user_id, p.name, p.age, p.description, p.photo_id
-            ORDER BY common_interests DESC, age_diff ASC
-            LIMIT 50
-        '''
-        
-        params = [user_id, user_id, user_id, looking_for, looking_for, looking_for]
-        if exclude_viewed:
-            params.extend([user_id, user_id, user_id])
+        return _load_feed_cards([profile_id]).get(profile_id)
+    except Exception as e:
+        logger.error(f"Error loading feed card {profile_id}: {e}")
+        return None
+
+def get_stale_photos(max_age: float, limit: int = 50, broken: bool = False) -> List[Tuple[int, str]]:
+    """
+    Фото анкет, не проверявшиеся дольше max_age секунд: (user_id, photo_id),
+    давние первыми. broken=True - только отмеченные нерабочими, иначе только рабочие.
+    """
+    query = queries.STALE_BROKEN_PHOTOS if broken else queries.STALE_PHOTOS
+    return execute_query('get_stale_photos', query, (f'-{int(max_age)} seconds', limit), fetch=True)
+
+def set_photo_status(user_id: int, photo_id: str, broken: Optional[bool]) -> bool:
+    """
+    Запоминает результат проверки фото photo_id анкеты user_id.
+
+    broken=None - проверить не удалось: запоминается только время попытки,
+    отметка о нерабочем фото не меняется. Если фото в анкете уже сменили,
+    ничего не делает. Возвращает True, если фото стало нерабочим или снова
+    рабочим.
+    """
+    with transaction() as conn:
+        changed = 0
+        if broken is not None:
+            changed = _timed_execute(
+                conn,
+                'set_photo_status',
+                "UPDATE profiles SET photo_broken = ? WHERE user_id = ? AND photo_id = ? AND photo_broken != ?",
+                (int(broken), user_id, photo_id, int(broken))
+            ).rowcount
+        _timed_execute(
+            conn,
+            'set_photo_status',
+            "UPDATE profiles SET photo_checked_at = CURRENT_TIMESTAMP WHERE user_id = ? AND photo_id = ?",
+            (user_id, photo_id)
+        )
+        if changed:
+            _publish(conn, 'profile', user_id)
+            on_commit(lambda: profile_cache.invalidate(user_id))
+    if changed:
+        logger.info(f"Photo of user {user_id} marked as {'broken' if broken else 'working'}")
+    return bool(changed)
+
+def get_matching_profiles(user_id: int, gender: str, looking_for: str, exclude_viewed: bool = True,
+                          limit: int = 50, after: Optional[tuple] = None) -> List[tuple]:
+    """
+    Получает список подходящих анкет.
+
+    Каждая анкета - (user_id, name, age, description, photo_id,
+    common_interests, age_diff, [названия интересов]). Для следующей
+    страницы передайте after=(-common_interests, age_diff, user_id)
+    последней анкеты.
+    """
+    try:
+        matching_engine.ensure_loaded(_load_matching_data)
+        ranked = matching_engine.page(user_id, looking_for, limit=limit, exclude_viewed=exclude_viewed,
+                                      after=tuple(after) if after is not None else None)
+        if not ranked:
+            logger.info(f"Found 0 matching profiles for user {user_id}")
+            return []
 
-        results = execute_query(query, tuple(params), fetch=True)
+        # Данные карточек читаем только для страницы выдачи
+        cards = _load_feed_cards([candidate_id for candidate_id, _, _ in ranked])
+        results = [
+            cards[candidate_id][:5] + (common_interests, age_diff, cards[candidate_id][5])
+            for candidate_id, common_interests, age_diff in ranked
+            if candidate_id in cards
+        ]
         logger.info(f"Found {len(results)} matching profiles for user {user_id}")
         return results
     except Exception as e:
         logger.error(f"Error getting matching profiles for user {user_id}: {e}")
         return []
 
-def add_like(from_user_id: int, to_user_id: int):
-    """Добавляет лайк"""
+def get_matching_profile_ids(user_id: int, looking_for: str, exclude_viewed: bool = True,
+                             limit: int = 50, after: Optional[tuple] = None
+                             ) -> Tuple[List[int], Optional[tuple]]:
+    """
+    Страница ленты: id подходящих анкет в порядке показа (карточки - get_feed_card).
+
+    Возвращает (ids, курсор следующей страницы); курсор None - анкет больше нет.
+    Курсор передается в after при запросе следующей страницы.
+    """
+    try:
+        matching_engine.ensure_loaded(_load_matching_data)
+        ranked = matching_engine.page(user_id, looking_for, limit=limit, exclude_viewed=exclude_viewed,
+                                      after=tuple(after) if after is not None else None)
+        logger.info(f"Found {len(ranked)} matching profiles for user {user_id}")
+        cursor = matching_engine.cursor(ranked[-1]) if len(ranked) == limit else None
+        return [candidate_id for candidate_id, _, _ in ranked], cursor
+    except Exception as e:
+        logger.error(f"Error getting matching profiles for user {user_id}: {e}")
+        return [], None
+
+def _like_added(from_user_id: int, to_user_id: int):
+    matching_engine.mark_seen(from_user_id, to_user_id)
+    invalidate_keyboard_state(from_user_id, to_user_id)
+
+def _inbox_add(conn: sqlite3.Connection, user_id: int, liker_id: int):
+    """Кладет лайк liker_id во входящие user_id (повторный лайк обновляет время)"""
+    updated = _timed_execute(
+        conn,
+        '_inbox_add',
+        "UPDATE like_inbox SET created_at = CURRENT_TIMESTAMP WHERE user_id = ? AND liker_id = ?",
+        (user_id, liker_id)
+    ).rowcount
+    if updated:
+        return
+    _timed_execute(conn, '_inbox_add', "INSERT INTO like_inbox (user_id, liker_id) VALUES (?, ?)",
+                   (user_id, liker_id))
+    if not _timed_execute(conn, '_inbox_add',
+                          "UPDATE like_inbox_counts SET pending = pending + 1 WHERE user_id = ?",
+                          (user_id,)).rowcount:
+        _timed_execute(conn, '_inbox_add', "INSERT INTO like_inbox_counts (user_id, pending) VALUES (?, 1)",
+                       (user_id,))
+
+def _inbox_remove(conn: sqlite3.Connection, user_id: int, liker_id: int):
+    """Убирает лайк liker_id из входящих user_id"""
+    if _timed_execute(conn, '_inbox_remove', "DELETE FROM like_inbox WHERE user_id = ? AND liker_id = ?",
+                      (user_id, liker_id)).rowcount:
+        _timed_execute(conn, '_inbox_remove',
+                       "UPDATE like_inbox_counts SET pending = pending - 1 WHERE user_id = ?", (user_id,))
+
+def like_and_check_match(from_user_id: int, to_user_id: int) -> bool:
+    """
+    Добавляет лайк и проверяет взаимность одной транзакцией.
+
+    Если ответный лайк уже есть, пара записывается в matches, а лайк
+    убирается из входящих (like_inbox); иначе лайк попадает во входящие
+    to_user_id. Возвращает True, только если симпатия возникла именно
+    этим лайком: при одновременных встречных лайках запись лайков
+    сериализуется SQLite, и взаимность обнаружит ровно один из них.
+    """
     try:
-        query = "INSERT OR REPLACE INTO likes (user_id, liked_user_id) VALUES (?, ?)"
-        execute_query(query, (from_user_id, to_user_id))
-        logger.info(f"Like added: from {from_user_id} to {to_user_id}")
+        with transaction() as conn:
+            _timed_execute(conn, 'like_and_check_match',
+                           "INSERT OR REPLACE INTO likes (user_id, liked_user_id) VALUES (?, ?)",
+                           (from_user_id, to_user_id))
+            reciprocal, blocked = _timed_execute(
+                conn,
+                'like_and_check_match',
+                queries.LIKE_STATE,
+                (to_user_id, from_user_id, from_user_id, to_user_id, to_user_id, from_user_id)
+            ).fetchone()
+            matched = False
+            # Пара, где один заблокировал другого, не попадает ни во входящие, ни в симпатии
+            if reciprocal and not blocked:
+                _inbox_remove(conn, from_user_id, to_user_id)
+                cursor = _timed_execute(
+                    conn,
+                    'like_and_check_match',
+                    "INSERT OR IGNORE INTO matches (user_id, matched_user_id) VALUES (?, ?)",
+                    [(from_user_id, to_user_id), (to_user_id, from_user_id)],
+                    many=True
+                )
+                matched = cursor.rowcount > 0
+            elif not blocked:
+                _inbox_add(conn, to_user_id, from_user_id)
+            _publish(conn, 'like', from_user_id, to_user_id)
+            on_commit(lambda: _like_added(from_user_id, to_user_id))
+        logger.info(f"Like added: from {from_user_id} to {to_user_id}" + (" (match)" if matched else ""))
+        return matched
     except Exception as e:
         logger.error(f"Error adding like from {from_user_id} to {to_user_id}: {e}")
         raise
 
+def add_like(from_user_id: int, to_user_id: int):
+    """Добавляет лайк (см. like_and_check_match)"""
+    like_and_check_match(from_user_id, to_user_id)
+
 # ... продолжение следует ...
 def check_mutual_like(user1_id: int, user2_id: int) -> bool:
     """Проверяет наличие взаимных лайков"""
     try:
-        query = '''
-            SELECT COUNT(*) FROM likes 
-            WHERE (user_id = ? AND liked_user_id = ?)
-            AND EXISTS (
-                SELECT 1 FROM likes 
-                WHERE user_id = ? AND liked_user_id = ?
-            )
-        '''
-        result = execute_query(query, (user1_id, user2_id, user2_id, user1_id), fetch=True)
+        query = "SELECT EXISTS (SELECT 1 FROM matches WHERE user_id = ? AND matched_user_id = ?)"
+        result = execute_query('check_mutual_like', query, (user1_id, user2_id), fetch=True)
         return bool(result and result[0][0])
     except Exception as e:
         logger.error(f"Error checking mutual like between {user1_id} and {user2_id}: {e}")
         return False
 
+def get_matches(user_id: int, limit: int = 50) -> List[tuple]:
+    """
+    Взаимные симпатии пользователя, новые сначала:
+    (user_id, name, age, photo_id, username, created_at)
+    """
+    try:
+        return execute_query('get_matches', queries.MATCHES, (user_id, limit), fetch=True)
+    except Exception as e:
+        logger.error(f"Error getting matches for user {user_id}: {e}")
+        return []
+
 def add_viewed_profile(user_id: int, viewed_user_id: int):
-    """Отмечает профиль как просмотренный"""
+    """Отмечает профиль как просмотренный (запись в БД отложена, см. write_buffer.py)"""
     try:
-        query = "INSERT OR REPLACE INTO viewed_profiles (user_id, viewed_user_id) VALUES (?, ?)"
-        execute_query(query, (user_id, viewed_user_id))
-        logger.info(f"Viewed profile added: {user_id} viewed {viewed_user_id}")
+        write_buffer.add_viewed(user_id, viewed_user_id)
+        matching_engine.mark_seen(user_id, viewed_user_id)
+        logger.debug(f"Viewed profile added: {user_id} viewed {viewed_user_id}")
     except Exception as e:
         logger.error(f"Error adding viewed profile: {e}")
         raise
@@ -316,28 +603,42 @@ def get_user_interests(user_id: int) -> List[str]:
             JOIN user_interests ui ON i.id = ui.interest_id
             WHERE ui.user_id = ?
         '''
-        result = execute_query(query, (user_id,), fetch=True)
+        result = execute_query('get_user_interests', query, (user_id,), fetch=True)
         return [row[0] for row in result]
     except Exception as e:
         logger.error(f"Error getting interests for user {user_id}: {e}")
         return []
 
+def _load_interest_catalog() -> InterestCatalog:
+    result = execute_query('_load_interest_catalog', "SELECT id, name FROM interests ORDER BY name",
+                           fetch=True)
+    logger.info(f"Loaded {len(result)} interests")
+    return InterestCatalog(result)
+
+def get_interest_catalog() -> InterestCatalog:
+    """Справочник интересов (через кэш)"""
+    return interest_catalog_cache.get_or_load('all', _load_interest_catalog)
+
 def get_all_interests() -> List[tuple]:
-    """Получает список всех интересов"""
+    """Получает список всех интересов: (id, name) в порядке названий"""
     try:
-        query = "SELECT id, name FROM interests ORDER BY name"
-        result = execute_query(query, fetch=True)
-        logger.info(f"Retrieved {len(result)} interests")
-        return result
+        return list(get_interest_catalog().items)
     except Exception as e:
         logger.error(f"Error getting interests: {e}")
         return []
 
+def get_interest_names() -> Dict[int, str]:
+    """Справочник интересов id -> название"""
+    return get_interest_catalog().names
+
 def clear_user_interests(user_id: int):
     """Удаляет все интересы пользователя"""
     try:
         query = "DELETE FROM user_interests WHERE user_id = ?"
-        execute_query(query, (user_id,))
+        with transaction() as conn:
+            execute_query('clear_user_interests', query, (user_id,))
+            _publish(conn, 'interests', user_id)
+            on_commit(lambda: matching_engine.clear_interests(user_id))
         logger.info(f"Cleared interests for user {user_id}")
     except Exception as e:
         logger.error(f"Error clearing interests for user {user_id}: {e}")
@@ -346,111 +647,125 @@ def clear_user_interests(user_id: int):
 def add_user_interests(user_id: int, interests: List[int]):
     """Добавляет интересы пользователя"""
     try:
-        query = "INSERT INTO user_interests (user_id, interest_id) VALUES (?, ?)"
-        for interest_id in interests:
-            execute_query(query, (user_id, interest_id))
+        with transaction() as conn:
+            _timed_execute(
+                conn,
+                'add_user_interests',
+                "INSERT INTO user_interests (user_id, interest_id) VALUES (?, ?)",
+                [(user_id, interest_id) for interest_id in interests],
+                many=True
+            )
+            _publish(conn, 'interests', user_id)
+            on_commit(lambda: matching_engine.add_interests(user_id, interests))
         logger.info(f"Added {len(interests)} interests for user {user_id}")
     except Exception as e:
         logger.error(f"Error adding interests for user {user_id}: {e}")
         raise
 
-def get_recent_likes(user_id: int, limit: int = 10) -> List[tuple]:
-    """Получает последние лайки пользователя"""
+def replace_user_interests(user_id: int, interests: List[int]):
+    """Заменяет интересы пользователя одной транзакцией"""
     try:
-        query = '''
-            SELECT 
-                l.user_id,
-                p.name,
-                p.age,
-                p.description,
-                p.photo_id,
-                l.created_at
-            FROM likes l
-            JOIN profiles p ON l.user_id = p.user_id
-            WHERE l.liked_user_id = ?
-            AND NOT EXISTS (
-                SELECT 1 FROM likes 
-                WHERE user_id = ? AND liked_user_id = l.user_id
+        with transaction() as conn:
+            _timed_execute(conn, 'replace_user_interests', "DELETE FROM user_interests WHERE user_id = ?",
+                           (user_id,))
+            _timed_execute(
+                conn,
+                'replace_user_interests',
+                "INSERT INTO user_interests (user_id, interest_id) VALUES (?, ?)",
+                [(user_id, interest_id) for interest_id in interests],
+                many=True
             )
-            ORDER BY l.created_at DESC
-            LIMIT ?
-        '''
-        result = execute_query(query, (user_id, user_id, limit), fetch=True)
+            _publish(conn, 'interests', user_id)
+            on_commit(lambda: matching_engine.set_interests(user_id, interests))
+        logger.info(f"Replaced interests for user {user_id}: {len(interests)} interests")
+    except Exception as e:
+        logger.error(f"Error replacing interests for user {user_id}: {e}")
+        raise
+
+def create_profile(user_id: int, name: str, age: int, description: str, photo_id: str,
+                   gender: str, looking_for: str, city: Optional[str], username: Optional[str],
+                   interests: List[int]):
+    """Сохраняет профиль вместе с интересами: либо все, либо ничего"""
+    with transaction():
+        add_profile(user_id, name, age, description, photo_id,
+                    gender, looking_for, city, username)
+        replace_user_interests(user_id, interests)
+
+def get_recent_likes(user_id: int, limit: int = 10) -> List[tuple]:
+    """Получает последние лайки пользователя, на которые он еще не ответил (photo_id нерабочего фото - None)"""
+    try:
+        result = execute_query('get_recent_likes', queries.RECENT_LIKES, (user_id, limit), fetch=True)
         logger.info(f"Retrieved {len(result)} recent likes for user {user_id}")
         return result
     except Exception as e:
         logger.error(f"Error getting recent likes for user {user_id}: {e}")
         return []
 
+def get_pending_likes_count(user_id: int) -> int:
+    """Число лайков, на которые пользователь еще не ответил"""
+    try:
+        result = execute_query('get_pending_likes_count',
+                               "SELECT pending FROM like_inbox_counts WHERE user_id = ?", (user_id,), fetch=True)
+        return result[0][0] if result else 0
+    except Exception as e:
+        logger.error(f"Error getting pending likes count for user {user_id}: {e}")
+        return 0
+
+def _load_keyboard_state(user_id: int) -> Tuple[bool, bool]:
+    row = execute_query('_load_keyboard_state', queries.KEYBOARD_STATE, (user_id, user_id), fetch=True)[0]
+    return bool(row[0]), row[1] > 0
+
+def get_keyboard_state(user_id: int) -> Tuple[bool, bool]:
+    """Возвращает (есть профиль, есть новые лайки) для главной клавиатуры"""
+    try:
+        return keyboard_state_cache.get_or_load(user_id, lambda: _load_keyboard_state(user_id))
+    except Exception as e:
+        logger.error(f"Error getting keyboard state for user {user_id}: {e}")
+        return False, False
+
+def invalidate_keyboard_state(*user_ids: int):
+    """Сбрасывает закэшированное состояние клавиатуры пользователей"""
+    for user_id in user_ids:
+        keyboard_state_cache.invalidate(user_id)
+
 def add_report(from_user_id: int, reported_user_id: int):
     """Добавляет жалобу"""
     try:
         query = "INSERT OR REPLACE INTO reports (from_user_id, reported_user_id) VALUES (?, ?)"
-        execute_query(query, (from_user_id, reported_user_id))
+        execute_query('add_report', query, (from_user_id, reported_user_id))
         logger.info(f"Report added: from {from_user_id} on {reported_user_id}")
     except Exception as e:
         logger.error(f"Error adding report: {e}")
         raise
 
 def add_block(user_id: int, blocked_user_id: int):
-    """Добавляет блокировку"""
+    """Добавляет блокировку; симпатия и входящие лайки пары удаляются"""
     try:
-        query = "INSERT OR REPLACE INTO blocks (user_id, blocked_user_id) VALUES (?, ?)"
-        execute_query(query, (user_id, blocked_user_id))
+        with transaction() as conn:
+            _timed_execute(conn, 'add_block',
+                           "INSERT OR REPLACE INTO blocks (user_id, blocked_user_id) VALUES (?, ?)",
+                           (user_id, blocked_user_id))
+            _timed_execute(
+                conn,
+                'add_block',
+                "DELETE FROM matches WHERE (user_id = ? AND matched_user_id = ?) "
+                "OR (user_id = ? AND matched_user_id = ?)",
+                (user_id, blocked_user_id, blocked_user_id, user_id)
+            )
+            _inbox_remove(conn, user_id, blocked_user_id)
+            _inbox_remove(conn, blocked_user_id, user_id)
+            _publish(conn, 'block', user_id, blocked_user_id)
+            on_commit(lambda: matching_engine.block(user_id, blocked_user_id))
+            on_commit(lambda: invalidate_keyboard_state(user_id, blocked_user_id))
         logger.info(f"Block added: {user_id} blocked {blocked_user_id}")
     except Exception as e:
         logger.error(f"Error adding block: {e}")
         raise
 
-def init_interests():
-    """Инициализация базовых интересов"""
-    interests = [
-        "Спорт",
-        "Музыка",
-        "Кино",
-        "Путешествия",
-        "Книги",
-        "Искусство",
-        "Фотография",
-        "Кулинария",
-        "Танцы",
-        "Игры",
-        "Технологии",
-        "Природа",
-        "Животные",
-        "Йога",
-        "Медитация"
-    ]
-    
-    try:
-        query = "INSERT OR IGNORE INTO interests (name) VALUES (?)"
-        for interest in interests:
-            execute_query(query, (interest,))
-        logger.info(f"Initialized {len(interests)} basic interests")
-    except Exception as e:
-        logger.error(f"Error initializing interests: {e}")
-        raise
-# В конце файла database.py
-init_db()
-init_interests()  # Добавьте эту строку
-
 def get_last_like(user_id: int) -> Optional[tuple]:
     """Получает информацию о последнем лайке"""
     try:
-        query = '''
-            SELECT 
-                l.user_id,
-                p.name,
-                p.age,
-                p.photo_id,
-                l.created_at
-            FROM likes l
-            JOIN profiles p ON l.user_id = p.user_id
-            WHERE l.liked_user_id = ?
-            ORDER BY l.created_at DESC
-            LIMIT 1
-        '''
-        result = execute_query(query, (user_id,), fetch=True)
+        result = execute_query('get_last_like', queries.LAST_LIKE, (user_id,), fetch=True)
         return result[0] if result else None
     except Exception as e:
         logger.error(f"Error getting last like for user {user_id}: {e}")
@@ -467,11 +782,7 @@ def update_profile(user_id: int, **kwargs) -> bool:
     Returns:
         bool: True если обновление успешно, False в противном случае
     """
-    conn = None
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
         # Формируем SQL запрос для обновления
         update_fields = []
         values = []
@@ -483,6 +794,10 @@ def update_profile(user_id: int, **kwargs) -> bool:
         if not update_fields:
             return False
             
+        if 'photo_id' in kwargs:
+            # Фото только что прислал пользователь - file_id заведомо рабочий
+            update_fields.append("photo_checked_at = CURRENT_TIMESTAMP, photo_broken = 0")
+            
         values.append(user_id)
         
         query = f"""
@@ -491,21 +806,22 @@ def update_profile(user_id: int, **kwargs) -> bool:
             WHERE user_id = ?
         """
         
-        cursor.execute(query, values)
-        conn.commit()
+        with transaction() as conn:
+            _timed_execute(conn, 'update_profile', query, values)
+            _publish(conn, 'profile', user_id)
+            on_commit(lambda: _profile_changed(
+                user_id,
+                gender=kwargs.get('gender'),
+                looking_for=kwargs.get('looking_for'),
+                age=kwargs.get('age')
+            ))
         logger.info(f"Profile updated for user {user_id}: {kwargs}")
         
         return True
         
     except Exception as e:
         logger.error(f"Error updating profile: {e}")
-        if conn:
-            conn.rollback()
         return False
-        
-    finally:
-        if conn:
-            conn.close()
 
 def get_all_users() -> list:
     """Получает ID всех пользователей"""
@@ -522,25 +838,25 @@ def get_all_users() -> list:
     except Exception as e:
         logger.error(f"Error getting all users: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 def update_last_active(user_id: int):
     """Обновляет время последней активности пользователя"""
     try:
-        query = "UPDATE profiles SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?"
-        execute_query(query, (user_id,))
+        write_buffer.touch(user_id)
         logger.debug(f"Updated last_active for user {user_id}")
     except Exception as e:
         logger.error(f"Error updating last_active for user {user_id}: {e}")
         raise
 
 def update_username(user_id: int, username: str):
-    """Обновляет username пользователя"""
+    """Обновляет username пользователя (если он изменился)"""
     try:
-        query = "UPDATE profiles SET username = ? WHERE user_id = ?"
-        execute_query(query, (username, user_id))
+        profile = get_profile(user_id)
+        # Без профиля обновлять нечего
+        if profile is None or profile.username == username:
+            return
+        write_buffer.set_username(user_id, username)
+        profile_cache.invalidate(user_id)
         logger.info(f"Updated username for user {user_id}: {username}")
     except Exception as e:
         logger.error(f"Error updating username for user {user_id}: {e}")
@@ -549,17 +865,135 @@ def update_username(user_id: int, username: str):
 def get_users_by_interests(interest_ids: List[int]) -> List[int]:
     """Получает список пользователей, у которых есть указанные интересы"""
     try:
-        query = '''
-            SELECT DISTINCT user_id 
-            FROM user_interests 
-            WHERE interest_id IN ({})
-        '''.format(','.join(['?'] * len(interest_ids)))
-        
-        result = execute_query(query, tuple(interest_ids), fetch=True)
+        query = queries.USERS_BY_INTERESTS.format(','.join(['?'] * len(interest_ids)))
+        result = execute_query('get_users_by_interests', query, tuple(interest_ids), fetch=True)
         return [row[0] for row in result]
     except Exception as e:
         logger.error(f"Error getting users by interests: {e}")
         return []
 
-# Инициализация базы данных при импорте модуля
-init_db()
\ No newline at end of file
+def create_broadcast_job(text: str, admin_chat_id: int, recipients: List[int]) -> int:
+    """Создает задачу рассылки со списком получателей и возвращает ее id"""
+    conn = get_connection()
+    try:
+        cursor = _timed_execute(
+            conn,
+            'create_broadcast_job',
+            "INSERT INTO broadcast_jobs (text, admin_chat_id, total) VALUES (?, ?, ?)",
+            (text, admin_chat_id, len(recipients))
+        )
+        job_id = cursor.lastrowid
+        _timed_execute(
+            conn,
+            'create_broadcast_job',
+            "INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id) VALUES (?, ?)",
+            [(job_id, user_id) for user_id in recipients],
+            many=True
+        )
+        conn.commit()
+        logger.info(f"Broadcast job {job_id} created for {len(recipients)} recipients")
+        return job_id
+    except Exception as e:
+        logger.error(f"Error creating broadcast job: {e}")
+        conn.rollback()
+        raise
+
+def get_broadcast_job(job_id: int) -> Optional[tuple]:
+    """Получает задачу рассылки: (id, text, admin_chat_id, progress_message_id, status, total, sent, failed)"""
+    try:
+        query = '''
+            SELECT id, text, admin_chat_id, progress_message_id, status, total, sent, failed
+            FROM broadcast_jobs WHERE id = ?
+        '''
+        result = execute_query('get_broadcast_job', query, (job_id,), fetch=True)
+        return result[0] if result else None
+    except Exception as e:
+        logger.error(f"Error getting broadcast job {job_id}: {e}")
+        return None
+
+def get_unfinished_broadcast_jobs() -> List[int]:
+    """Получает id незавершенных рассылок (для продолжения после перезапуска)"""
+    try:
+        query = "SELECT id FROM broadcast_jobs WHERE status = 'running' ORDER BY id"
+        result = execute_query('get_unfinished_broadcast_jobs', query, fetch=True)
+        return [row[0] for row in result]
+    except Exception as e:
+        logger.error(f"Error getting unfinished broadcast jobs: {e}")
+        return []
+
+def get_pending_broadcast_recipients(job_id: int, limit: int = 500) -> List[int]:
+    """Получает следующую порцию получателей, которым сообщение еще не отправлено"""
+    try:
+        result = execute_query('get_pending_broadcast_recipients', queries.PENDING_BROADCAST_RECIPIENTS,
+                               (job_id, limit), fetch=True)
+        return [row[0] for row in result]
+    except Exception as e:
+        # Пустой список означал бы "получателей не осталось" - рассылка
+        # завершилась бы без отправки; ошибка прерывает ее до перезапуска
+        logger.error(f"Error getting recipients of broadcast job {job_id}: {e}")
+        raise
+
+def save_broadcast_progress(job_id: int, sent: List[int], failed: List[int]):
+    """Сохраняет результаты отправки порции сообщений одной транзакцией"""
+    conn = get_connection()
+    try:
+        query = "UPDATE broadcast_recipients SET status = ? WHERE job_id = ? AND user_id = ?"
+        _timed_execute(conn, 'save_broadcast_progress', query,
+                       [('sent', job_id, user_id) for user_id in sent], many=True)
+        _timed_execute(conn, 'save_broadcast_progress', query,
+                       [('failed', job_id, user_id) for user_id in failed], many=True)
+        _timed_execute(
+            conn,
+            'save_broadcast_progress',
+            "UPDATE broadcast_jobs SET sent = sent + ?, failed = failed + ? WHERE id = ?",
+            (len(sent), len(failed), job_id)
+        )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error saving progress of broadcast job {job_id}: {e}")
+        conn.rollback()
+        raise
+
+def set_broadcast_progress_message(job_id: int, message_id: int):
+    """Запоминает сообщение администратору, в котором отображается прогресс"""
+    try:
+        query = "UPDATE broadcast_jobs SET progress_message_id = ? WHERE id = ?"
+        execute_query('set_broadcast_progress_message', query, (message_id, job_id))
+    except Exception as e:
+        logger.error(f"Error setting progress message for broadcast job {job_id}: {e}")
+        raise
+
+def finish_broadcast_job(job_id: int):
+    """Отмечает рассылку как завершенную"""
+    try:
+        query = "UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?"
+        execute_query('finish_broadcast_job', query, (job_id,))
+        logger.info(f"Broadcast job {job_id} finished")
+    except Exception as e:
+        logger.error(f"Error finishing broadcast job {job_id}: {e}")
+        raise
+
+def get_fsm_record(chat: str, user: str) -> Optional[tuple]:
+    """Возвращает (state, data, bucket) состояния FSM; data и bucket - JSON"""
+    query = "SELECT state, data, bucket FROM fsm_storage WHERE chat = ? AND user = ?"
+    result = execute_query('get_fsm_record', query, (chat, user), fetch=True)
+    return result[0] if result else None
+
+def save_fsm_records(records: List[tuple]):
+    """
+    Сохраняет состояния FSM одной транзакцией.
+
+    records - (chat, user, state, data, bucket); пустые состояния удаляются.
+    """
+    empty = [(chat, user) for chat, user, state, data, bucket in records
+             if state is None and data is None and bucket is None]
+    filled = [record for record in records if record[2:] != (None, None, None)]
+    with transaction() as conn:
+        if empty:
+            _timed_execute(conn, 'save_fsm_records', "DELETE FROM fsm_storage WHERE chat = ? AND user = ?",
+                           empty, many=True)
+        if filled:
+            _timed_execute(conn, 'save_fsm_records', '''
+                INSERT OR REPLACE INTO fsm_storage (chat, user, state, data, bucket, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', filled, many=True)
@@ -0,0 +1,84 @@
+import sqlite3
+import threading
+import logging
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA, применяемые к каждому новому соединению
+DEFAULT_PRAGMAS: Tuple[Tuple[str, object], ...] = (
+    ('journal_mode', 'WAL'),          # читатели не блокируют писателя
+    ('synchronous', 'NORMAL'),        # в режиме WAL безопасно и намного быстрее FULL
+    ('mmap_size', 256 * 1024 * 1024), # чтение страниц через mmap
+    ('cache_size', -16000),           # ~16 МБ кэша страниц на соединение
+    ('busy_timeout', 5000),           # ждем блокировку вместо мгновенного SQLITE_BUSY
+    ('temp_store', 'MEMORY'),
+)
+
+# Размер кэша подготовленных выражений sqlite3 на соединение
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionPool:
+    """
+    Пул постоянных соединений с SQLite: по одному соединению на поток.
+
+    Соединение открывается при первом обращении из потока и живет до
+    вызова close_all(), поэтому горячие обработчики не платят за
+    connect/close на каждый запрос. Подготовленные выражения кэшируются
+    самим sqlite3 (параметр cached_statements).
+    """
+
+    def __init__(self, path: str, pragmas=DEFAULT_PRAGMAS,
+                 cached_statements: int = STATEMENT_CACHE_SIZE):
+        self.path = path
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self.opened = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=5.0,
+            cached_statements=self.cached_statements,
+            # Соединение используется только своим потоком; флаг снят,
+            # чтобы close_all() мог закрыть его из другого потока
+            check_same_thread=False
+        )
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._connections.append(conn)
+            self.opened += 1
+        logger.info(f"Opened database connection to {self.path} "
+                    f"for thread {threading.current_thread().name}")
+        return conn
+
+    @property
+    def size(self) -> int:
+        """Число открытых сейчас соединений"""
+        return len(self._connections)
+
+    def connection(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, открывая его при необходимости"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.connection = conn
+        return conn
+
+    def close_all(self):
+        """Закрывает все открытые соединения (при остановке бота)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing database connection: {e}")
+        # Потоки откроют новые соединения при следующем обращении
+        self._local = threading.local()
+        logger.info(f"Closed {len(connections)} database connections")
@@ -0,0 +1,203 @@
+import asyncio
+import copy
+import json
+import logging
+import typing
+from typing import Dict, Optional, Tuple
+
+from aiogram.dispatcher.storage import BaseStorage
+
+import async_db as db
+from cache import LRUCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# Как часто записывать измененные состояния в БД (секунды)
+FLUSH_INTERVAL = 1.0
+# Сколько состояний держать в памяти
+HOT_CACHE_SIZE = 10000
+
+Address = Tuple[str, str]
+
+
+def _empty_record() -> Dict:
+    return {'state': None, 'data': {}, 'bucket': {}}
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в таблице fsm_storage.
+
+    Недавно использованные записи лежат в LRU-кэше, поэтому чтение
+    обычно обходится без БД. Изменения копятся в памяти и пишутся
+    одной транзакцией раз в FLUSH_INTERVAL секунд; несколько изменений
+    одной записи за это время схлопываются в одно. close() записывает
+    оставшиеся изменения - после перезапуска бота пользователи
+    продолжают с того же места.
+
+    Данные сериализуются в JSON, поэтому класть в них можно только
+    простые значения (для ленты - id анкет и позицию, а не сами анкеты).
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, cache_size: int = HOT_CACHE_SIZE):
+        self.flush_interval = flush_interval
+        self._cache = LRUCache(maxsize=cache_size)
+        # Измененные, но еще не записанные записи; из кэша их не вытесняет
+        self._dirty: Dict[Address, Dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._closed = False
+
+    # --- запись в БД ---
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error saving FSM states: {e}", exc_info=True)
+            if self._dirty:
+                self._schedule_flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения в БД"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            records = [
+                (chat, user, record['state'],
+                 json.dumps(record['data'], ensure_ascii=False) if record['data'] else None,
+                 json.dumps(record['bucket'], ensure_ascii=False) if record['bucket'] else None)
+                for (chat, user), record in dirty.items()
+            ]
+            try:
+                await db.save_fsm_records(records)
+            except Exception:
+                # Более новые изменения, сделанные во время записи, не затираем
+                for address, record in dirty.items():
+                    self._dirty.setdefault(address, record)
+                raise
+            logger.debug(f"Saved {len(records)} FSM states")
+
+    async def close(self):
+        self._closed = True
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    # --- чтение ---
+
+    async def _record(self, chat, user) -> Tuple[Address, Dict]:
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        address = (chat, user)
+        record = self._dirty.get(address)
+        if record is not None:
+            return address, record
+        record = self._cache.get(address, MISSING)
+        if record is MISSING:
+            row = await db.get_fsm_record(chat, user)
+            # Пока читали из БД, запись могли изменить
+            record = self._dirty.get(address) or self._cache.get(address)
+            if record is None:
+                record = _empty_record()
+                if row:
+                    record['state'] = row[0]
+                    record['data'] = json.loads(row[1]) if row[1] else {}
+                    record['bucket'] = json.loads(row[2]) if row[2] else {}
+                self._cache.set(address, record)
+        return address, record
+
+    def _changed(self, address: Address, record: Dict):
+        self._cache.set(address, record)
+        self._dirty[address] = record
+        if self._closed:
+            # Бот останавливается - фоновой записи уже не будет
+            asyncio.ensure_future(self.flush())
+        else:
+            self._schedule_flush()
+
+    # --- API BaseStorage ---
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        _, record = await self._record(chat, user)
+        return record['state'] if record['state'] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[str] = None) -> typing.Dict:
+        _, record = await self._record(chat, user)
+        return copy.deepcopy(record['data'])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        address, record = await self._record(chat, user)
+        record['state'] = self.resolve_state(state)
+        self._changed(address, record)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        address, record = await self._record(chat, user)
+        record['data'] = copy.deepcopy(data) if data else {}
+        self._changed(address, record)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        address, record = await self._record(chat, user)
+        record['data'].update(copy.deepcopy(data or {}), **copy.deepcopy(kwargs))
+        self._changed(address, record)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        address, record = await self._record(chat, user)
+        record['state'] = None
+        if with_data:
+            record['data'] = {}
+        self._changed(address, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        _, record = await self._record(chat, user)
+        return copy.deepcopy(record['bucket'])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        address, record = await self._record(chat, user)
+        record['bucket'] = copy.deepcopy(bucket) if bucket else {}
+        self._changed(address, record)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        address, record = await self._record(chat, user)
+        record['bucket'].update(copy.deepcopy(bucket or {}), **copy.deepcopy(kwargs))
+        self._changed(address, record)
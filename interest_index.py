@@ -0,0 +1,277 @@
+import array
+import bisect
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Интересы пользователя хранятся битовой маской (целое Python без
+# ограничения длины): бит N - интерес с id N
+# Возраст хранится в байте; больший возраст при ранжировании считается равным MAX_AGE
+MAX_AGE = 255
+
+_GENDER_CODES = {'M': 1, 'F': 2}
+_LOOKING_FOR_CODES = {'M': 1, 'F': 2, 'MF': 3}
+_GENDER_NAMES = {code: name for name, code in _GENDER_CODES.items()}
+_LOOKING_FOR_NAMES = {code: name for name, code in _LOOKING_FOR_CODES.items()}
+
+
+def interests_mask(interest_ids: Iterable[int]) -> int:
+    """Собирает битовую маску из id интересов"""
+    mask = 0
+    for interest_id in interest_ids:
+        if interest_id < 0:
+            raise ValueError(f"Interest id {interest_id} does not fit into the interest mask")
+        mask |= 1 << interest_id
+    return mask
+
+
+def _clamp_age(age: int) -> int:
+    return min(max(age, 0), MAX_AGE)
+
+
+def popcount(value: int) -> int:
+    return bin(value).count('1')
+
+
+def _bit_positions(bits: int) -> Iterator[int]:
+    """Номера установленных битов по возрастанию"""
+    digits = bin(bits)[:1:-1]  # младший бит первым, без префикса '0b'
+    i = digits.find('1')
+    while i != -1:
+        yield i
+        i = digits.find('1', i + 1)
+
+
+class InterestIndex:
+    """
+    Колоночный индекс анкет для ранжирования по общим интересам.
+
+    Каждой анкете выделяется слот. По слотам хранятся компактные
+    массивы (маска интересов, пол, кого ищет, возраст), а для каждого
+    интереса, пола и возраста - битовый вектор слотов (целое число
+    Python). Число общих интересов для всех анкет сразу считается
+    побитовым сумматором над векторами интересов зрителя, поэтому
+    ранжирование сводится к нескольким операциям над длинными
+    целыми, которые выполняются в C, а не к циклу по анкетам.
+    """
+
+    def __init__(self):
+        self._slots: Dict[int, int] = {}
+        self._user_ids = array.array('q')
+        self._masks: List[int] = []
+        self._genders = array.array('b')       # 0 - анкеты нет
+        self._looking_for = array.array('b')
+        self._ages = array.array('B')
+        self._live = 0                          # слоты с анкетой
+        self._gender_bits: Dict[int, int] = {}
+        self._age_bits: Dict[int, int] = {}
+        self._interest_bits: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return popcount(self._live)
+
+    def __contains__(self, user_id: int) -> bool:
+        slot = self._slots.get(user_id)
+        return slot is not None and self._genders[slot] != 0
+
+    # --- обновление ---
+
+    def load(self, profiles: Iterable[tuple], interests: Iterable[tuple]):
+        """
+        Массовое заполнение пустого индекса.
+
+        profiles - строки (user_id, gender, looking_for, age),
+        interests - строки (user_id, interest_id). Битовые векторы
+        собираются один раз в конце, а не по одному биту на строку.
+        """
+        rows = list(profiles)
+        self._slots = {row[0]: slot for slot, row in enumerate(rows)}
+        self._user_ids = array.array('q', (row[0] for row in rows))
+        self._genders = array.array('b', (_GENDER_CODES.get(row[1], 3) for row in rows))
+        self._looking_for = array.array('b', (_LOOKING_FOR_CODES.get(row[2], 0) for row in rows))
+        self._ages = array.array('B', (_clamp_age(row[3]) for row in rows))
+        self._masks = [0] * len(rows)
+
+        slots, masks = self._slots, self._masks
+        interest_slots: Dict[int, List[int]] = {}
+        for user_id, interest_id in interests:
+            if interest_id < 0:
+                raise ValueError(f"Interest id {interest_id} does not fit into the interest mask")
+            slot = slots.get(user_id)
+            if slot is None:
+                slot = self._slot(user_id)
+            masks[slot] |= 1 << interest_id
+            interest_slots.setdefault(interest_id, []).append(slot)
+        self._rebuild_bits()
+        self._interest_bits = {}
+        for interest_id, interest_slot_list in interest_slots.items():
+            buf = bytearray((len(self._user_ids) >> 3) + 1)
+            for slot in interest_slot_list:
+                buf[slot >> 3] |= 1 << (slot & 7)
+            self._interest_bits[interest_id] = int.from_bytes(buf, 'little')
+
+    def _rebuild_bits(self):
+        """Пересобирает битовые векторы пола и возраста из колонок за O(n) операций в C"""
+        genders = self._genders.tobytes()
+        ages = self._ages.tobytes()
+
+        def column_bits(column: bytes, table: bytes) -> int:
+            # Байт колонки -> символ '0'/'1', строка читается как двоичное число
+            digits = column.translate(table)[::-1]
+            return int(digits, 2) if digits else 0
+
+        def table_for(predicate) -> bytes:
+            return bytes(49 if predicate(value) else 48 for value in range(256))
+
+        self._live = column_bits(genders, table_for(lambda code: code != 0))
+        self._gender_bits = {
+            code: column_bits(genders, table_for(lambda value: value == code))
+            for code in set(self._genders) if code
+        }
+        live_ages = {age for age, gender in zip(self._ages, self._genders) if gender}
+        self._age_bits = {
+            age: column_bits(ages, table_for(lambda value: value == age)) & self._live
+            for age in live_ages
+        }
+
+    def _slot(self, user_id: int) -> int:
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = len(self._user_ids)
+            self._slots[user_id] = slot
+            self._user_ids.append(user_id)
+            self._masks.append(0)
+            self._genders.append(0)
+            self._looking_for.append(0)
+            self._ages.append(0)
+        return slot
+
+    def set_profile(self, user_id: int, gender: str, looking_for: str, age: int):
+        slot = self._slot(user_id)
+        bit = 1 << slot
+        old_gender = self._genders[slot]
+        if old_gender:
+            self._gender_bits[old_gender] &= ~bit
+            self._age_bits[self._ages[slot]] &= ~bit
+        gender_code = _GENDER_CODES.get(gender, 3)
+        age = _clamp_age(age)
+        self._genders[slot] = gender_code
+        self._looking_for[slot] = _LOOKING_FOR_CODES.get(looking_for, 0)
+        self._ages[slot] = age
+        self._live |= bit
+        self._gender_bits[gender_code] = self._gender_bits.get(gender_code, 0) | bit
+        self._age_bits[age] = self._age_bits.get(age, 0) | bit
+
+    def set_interests(self, user_id: int, interest_ids: Iterable[int]):
+        slot = self._slot(user_id)
+        bit = 1 << slot
+        old_mask = self._masks[slot]
+        new_mask = interests_mask(interest_ids)
+        for interest_id in _bit_positions(old_mask & ~new_mask):
+            self._interest_bits[interest_id] &= ~bit
+        for interest_id in _bit_positions(new_mask & ~old_mask):
+            self._interest_bits[interest_id] = self._interest_bits.get(interest_id, 0) | bit
+        self._masks[slot] = new_mask
+
+    def add_interests(self, user_id: int, interest_ids: Iterable[int]):
+        slot = self._slot(user_id)
+        current = _bit_positions(self._masks[slot])
+        self.set_interests(user_id, list(current) + list(interest_ids))
+
+    # --- чтение ---
+
+    def profile(self, user_id: int) -> Optional[Tuple[str, str, int]]:
+        """(gender, looking_for, age) анкеты или None"""
+        slot = self._slots.get(user_id)
+        if slot is None or not self._genders[slot]:
+            return None
+        return (_GENDER_NAMES.get(self._genders[slot], ''),
+                _LOOKING_FOR_NAMES.get(self._looking_for[slot], ''),
+                self._ages[slot])
+
+    def matches_gender(self, user_id: int, looking_for: str) -> bool:
+        slot = self._slots.get(user_id)
+        if slot is None or not self._genders[slot]:
+            return False
+        return looking_for == 'MF' or self._genders[slot] == _GENDER_CODES.get(looking_for)
+
+    def score(self, viewer_id: int, candidate_id: int) -> Tuple[int, int]:
+        """(число общих интересов, разница в возрасте)"""
+        viewer = self._slots[viewer_id]
+        candidate = self._slots[candidate_id]
+        return (popcount(self._masks[viewer] & self._masks[candidate]),
+                abs(self._ages[candidate] - self._ages[viewer]))
+
+    def _bitset(self, user_ids: Iterable[int]) -> int:
+        buf = bytearray((len(self._user_ids) >> 3) + 1)
+        for user_id in user_ids:
+            slot = self._slots.get(user_id)
+            if slot is not None:
+                buf[slot >> 3] |= 1 << (slot & 7)
+        return int.from_bytes(buf, 'little')
+
+    def rank(self, viewer_id: int, looking_for: str, exclude: Iterable[int] = (),
+             limit: int = 50, after: Optional[Tuple[int, int, int]] = None) -> List[Tuple[int, int, int]]:
+        """
+        Лучшие кандидаты для зрителя.
+
+        Возвращает до limit ключей (-общие интересы, разница в возрасте, user_id)
+        в порядке возрастания. Если передан after - только ключи больше него
+        (следующая страница выдачи).
+        """
+        slot = self._slots.get(viewer_id)
+        if slot is None or not self._genders[slot]:
+            return []
+
+        if looking_for == 'MF':
+            allowed = self._live
+        else:
+            allowed = self._gender_bits.get(_GENDER_CODES.get(looking_for), 0)
+        allowed &= ~(1 << slot)
+        if exclude:
+            allowed &= ~self._bitset(exclude)
+        if not allowed:
+            return []
+
+        # Побитовый сумматор: planes[k] - k-й бит числа общих интересов для каждого слота
+        planes: List[int] = []
+        for interest_id in _bit_positions(self._masks[slot]):
+            carry = self._interest_bits.get(interest_id, 0) & allowed
+            for k in range(len(planes)):
+                if not carry:
+                    break
+                planes[k], carry = planes[k] ^ carry, planes[k] & carry
+            if carry:
+                planes.append(carry)
+
+        my_age = self._ages[slot]
+        distances: Dict[int, List[int]] = {}
+        for age in self._age_bits:
+            distances.setdefault(abs(age - my_age), []).append(age)
+
+        result: List[Tuple[int, int, int]] = []
+        top = min(popcount(self._masks[slot]), (1 << len(planes)) - 1)
+        if after is not None:
+            top = min(top, -after[0])
+        for common in range(top, -1, -1):
+            tier = allowed
+            for k, plane in enumerate(planes):
+                tier &= plane if common >> k & 1 else ~plane
+            if not tier:
+                continue
+            for age_diff in sorted(distances):
+                if after is not None and (-common, age_diff) < after[:2]:
+                    continue
+                group = 0
+                for age in distances[age_diff]:
+                    group |= tier & self._age_bits[age]
+                if not group:
+                    continue
+                user_ids = sorted(self._user_ids[i] for i in _bit_positions(group))
+                if after is not None and (-common, age_diff) == after[:2]:
+                    user_ids = user_ids[bisect.bisect_right(user_ids, after[2]):]
+                result.extend((-common, age_diff, user_id) for user_id in user_ids)
+                if len(result) >= limit:
+                    return result[:limit]
+                tier &= ~group
+                if not tier:
+                    break
+        return result
@@ -0,0 +1,52 @@
+from typing import Iterable, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from cache import LRUCache
+from models import InterestCatalog
+
+
+class InterestKeyboard:
+    """
+    Inline-клавиатура выбора интересов (по две кнопки в ряд и "Готово").
+
+    Кнопки каждого интереса - с отметкой "✅" и без - создаются один раз
+    на справочник, а готовая разметка кэшируется по битовой маске
+    выбранных интересов. Нажатие на интерес не обращается к БД и обычно
+    не собирает клавиатуру заново.
+    """
+
+    def __init__(self, prefix: str, done_data: str, cache_size: int = 1024):
+        self.prefix = prefix
+        self._done = InlineKeyboardButton(text="Готово ✅", callback_data=done_data)
+        self._catalog: Optional[InterestCatalog] = None
+        # (без отметки, с отметкой) для каждого интереса в порядке справочника
+        self._buttons: Tuple[Tuple[InlineKeyboardButton, InlineKeyboardButton], ...] = ()
+        self._markups = LRUCache(maxsize=cache_size)
+
+    def _prepare(self, catalog: InterestCatalog):
+        if catalog is self._catalog:
+            return
+        # Справочник перечитан из БД - кнопки пересобираем, только если он изменился
+        if self._catalog is None or catalog.items != self._catalog.items:
+            self._buttons = tuple(
+                (InlineKeyboardButton(text=name, callback_data=f"{self.prefix}{interest_id}"),
+                 InlineKeyboardButton(text=f"✅ {name}", callback_data=f"{self.prefix}{interest_id}"))
+                for interest_id, name in catalog.items
+            )
+            self._markups.clear()
+        self._catalog = catalog
+
+    def build(self, catalog: InterestCatalog, selected: Iterable[int] = ()) -> InlineKeyboardMarkup:
+        """Разметка клавиатуры; возвращаемый объект общий - не изменяйте его"""
+        self._prepare(catalog)
+        mask = catalog.mask(selected)
+        markup = self._markups.get(mask)
+        if markup is None:
+            markup = InlineKeyboardMarkup(row_width=2)
+            buttons = [pair[mask >> position & 1] for position, pair in enumerate(self._buttons)]
+            for i in range(0, len(buttons), 2):
+                markup.row(*buttons[i:i + 2])
+            markup.row(self._done)
+            self._markups.set(mask, markup)
+        return markup
@@ -0,0 +1,335 @@
+"""
+Нагрузочный тест бота.
+
+Прогоняет через настоящий Dispatcher из main.py синтетические обновления
+(types.Update) от множества одновременных пользователей. Вместо Telegram
+запросы бота принимает локальный HTTP-сервер, имитирующий Bot API.
+
+Каждый пользователь проходит сценарий: создание анкеты (ProfileStates),
+просмотр ленты с лайками и дизлайками, просмотр лайкнувших и ответный
+лайк (взаимная симпатия), редактирование анкеты (profile_editor).
+
+Для каждого уровня нагрузки выводятся пропускная способность,
+p50/p95/p99 времени обработки обновлений по шагам сценария и показатели
+конкуренции за БД (ожидание потока пула, время запросов, ошибки
+"database is locked").
+
+    python loadtest.py --users 10,100,1000 --reactions 10 --api-latency 20
+
+Пользователи каждого уровня добавляются к уже созданным, как при росте
+аудитории. База - отдельный файл (--db, по умолчанию loadtest.db),
+пересоздается при запуске.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+# Интересы в каталоге по умолчанию (см. migrations.BASIC_INTERESTS)
+INTEREST_IDS = list(range(1, 16))
+USER_ID_BASE = 10_000_000
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class FakeBotAPI:
+    """Локальный сервер с ответами в формате Telegram Bot API"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.url = None
+
+    def _message(self, data) -> dict:
+        chat_id = int(data.get('chat_id', 0) or 0)
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': data.get('text') or data.get('caption') or '',
+        }
+
+    async def _handle(self, request):
+        from aiohttp import web
+        method = request.match_info['method']
+        data = await request.post()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in ('sendMessage', 'editMessageText'):
+            result = self._message(data)
+        elif method == 'sendPhoto':
+            result = self._message(data)
+            photo = data.get('photo')
+            result['photo'] = [{'file_id': str(photo), 'file_unique_id': str(photo)[:16],
+                                'width': 640, 'height': 640}]
+        elif method == 'getFile':
+            file_id = data.get('file_id')
+            result = {'file_id': file_id, 'file_unique_id': str(file_id)[:16],
+                      'file_path': f'photos/{file_id}.jpg'}
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'loadtest', 'username': 'loadtest_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class UpdateFactory:
+    """Синтетические обновления от имени пользователя"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}',
+                'username': f'user{user_id}'}
+
+    def message(self, user_id: int, text: Optional[str] = None, photo: Optional[str] = None):
+        from aiogram import types
+        message = {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        if photo is not None:
+            message['photo'] = [{'file_id': photo, 'file_unique_id': photo[:16], 'width': 640, 'height': 640}]
+        return types.Update(update_id=next(self._ids), message=message)
+
+    def callback(self, user_id: int, data: str):
+        from aiogram import types
+        return types.Update(update_id=next(self._ids), callback_query={
+            'id': str(next(self._ids)),
+            'chat_instance': str(user_id),
+            'data': data,
+            'from': self._user(user_id),
+            'message': {'message_id': next(self._ids), 'date': int(time.time()),
+                        'chat': {'id': user_id, 'type': 'private'}, 'text': '...'},
+        })
+
+
+class LoadTest:
+    def __init__(self, dp, reactions: int, seed: int = 0):
+        self.dp = dp
+        self.reactions = reactions
+        self.updates = UpdateFactory()
+        self.random = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors = 0
+
+    async def _send(self, step: str, update):
+        started = time.perf_counter()
+        try:
+            # Отдельная задача на обновление и middleware уровня update - как в aiogram
+            await asyncio.ensure_future(self.dp.updates_handler.notify(update))
+        except Exception:
+            self.errors += 1
+        self.latencies[step].append(time.perf_counter() - started)
+
+    async def journey(self, user_id: int):
+        message, callback = self.updates.message, self.updates.callback
+        rnd = self.random
+        gender = rnd.choice(['👨 Мужской', '👩 Женский'])
+        looking_for = rnd.choice(['👨 Мужчин', '👩 Женщин', '👥 Всех'])
+
+        # Создание анкеты
+        await self._send('start', message(user_id, '/start'))
+        await self._send('create_profile', message(user_id, '📝 Создать профиль'))
+        await self._send('profile_form', message(user_id, f'User{user_id}'))
+        await self._send('profile_form', message(user_id, str(rnd.randint(18, 45))))
+        await self._send('profile_form', message(user_id, gender))
+        await self._send('profile_form', message(user_id, looking_for))
+        await self._send('profile_form', message(user_id, '-'))
+        await self._send('profile_form', message(user_id, 'Люблю путешествия и хорошее кино'))
+        await self._send('profile_photo', message(user_id, photo=f'photo{user_id}'))
+        for interest_id in rnd.sample(INTEREST_IDS, rnd.randint(1, 4)):
+            await self._send('interest_select', callback(user_id, f'interest_{interest_id}'))
+        await self._send('interests_done', callback(user_id, 'interests_done'))
+
+        # Лента: лайки и дизлайки
+        await self._send('feed_start', message(user_id, '👀 Смотреть анкеты'))
+        for _ in range(self.reactions):
+            reaction = '❤️ Лайк' if rnd.random() < 0.5 else '👎 Дизлайк'
+            await self._send('feed_reaction', message(user_id, reaction))
+
+        # Взаимная симпатия
+        await self._send('who_liked', message(user_id, '👀 Посмотреть кто лайкнул'))
+        await self._send('return_like', message(user_id, '❤️ Лайкнуть в ответ'))
+
+        # Редактирование анкеты
+        await self._send('edit', message(user_id, '📝 Редактировать профиль'))
+        await self._send('edit', message(user_id, '✏️ Изменить имя'))
+        await self._send('edit', message(user_id, f'Renamed{user_id}'))
+        await self._send('edit', message(user_id, '🎯 Изменить интересы'))
+        await self._send('edit', callback(user_id, f'edit_interest_{rnd.choice(INTEREST_IDS)}'))
+        await self._send('edit', callback(user_id, 'edit_interests_done'))
+        await self._send('edit', message(user_id, '🔙 Вернуться'))
+        await self._send('my_profile', message(user_id, '👤 Мой профиль'))
+
+    def reset(self):
+        self.latencies.clear()
+        self.errors = 0
+
+
+def _db_totals(metrics) -> Dict[str, float]:
+    wait_count, wait_sum = metrics.executor_wait_seconds.totals().get((), (0, 0.0))
+    query_count = sum(count for count, _ in metrics.query_seconds.totals().values())
+    query_sum = sum(total for _, total in metrics.query_seconds.totals().values())
+    return {
+        'db_calls': wait_count,
+        'executor_wait_total': wait_sum,
+        'queries': query_count,
+        'query_time_total': query_sum,
+        'query_errors': metrics.query_errors.total(),
+    }
+
+
+async def run(args) -> List[dict]:
+    import main
+    import metrics
+    from aiogram import Bot, Dispatcher
+    from aiogram.bot.api import TelegramAPIServer
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+    main.bot.server = TelegramAPIServer.from_base(api.url)
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    await main.on_startup(main.dp)
+
+    test = LoadTest(main.dp, reactions=args.reactions, seed=args.seed)
+    next_user = USER_ID_BASE
+    results = []
+    try:
+        for users in args.users:
+            test.reset()
+            before = _db_totals(metrics)
+            user_ids = range(next_user, next_user + users)
+            next_user += users
+
+            started = time.perf_counter()
+            await asyncio.gather(*(test.journey(user_id) for user_id in user_ids))
+            elapsed = time.perf_counter() - started
+
+            after = _db_totals(metrics)
+            all_latencies = [value for values in test.latencies.values() for value in values]
+            db_calls = after['db_calls'] - before['db_calls']
+            queries = after['queries'] - before['queries']
+            results.append({
+                'users': users,
+                'total_profiles': next_user - USER_ID_BASE,
+                'updates': len(all_latencies),
+                'seconds': round(elapsed, 3),
+                'updates_per_second': round(len(all_latencies) / elapsed, 1),
+                'errors': test.errors,
+                'latency_ms': {
+                    step: {
+                        'count': len(values),
+                        'p50': round(percentile(values, 50) * 1000, 2),
+                        'p95': round(percentile(values, 95) * 1000, 2),
+                        'p99': round(percentile(values, 99) * 1000, 2),
+                    }
+                    for step, values in sorted(test.latencies.items()) + [('ALL', all_latencies)]
+                },
+                'db': {
+                    'calls': db_calls,
+                    'avg_executor_wait_ms': round(
+                        (after['executor_wait_total'] - before['executor_wait_total']) / db_calls * 1000, 3
+                    ) if db_calls else 0.0,
+                    'queries': queries,
+                    'avg_query_ms': round(
+                        (after['query_time_total'] - before['query_time_total']) / queries * 1000, 3
+                    ) if queries else 0.0,
+                    'query_errors': after['query_errors'] - before['query_errors'],
+                },
+            })
+            _print_level(results[-1])
+    finally:
+        await main.on_shutdown(main.dp)
+        await (await main.bot.get_session()).close()
+        await api.stop()
+    return results
+
+
+def _print_level(result: dict):
+    print(f"\n=== {result['users']} users (total profiles: {result['total_profiles']}) ===")
+    print(f"updates: {result['updates']} in {result['seconds']}s -> "
+          f"{result['updates_per_second']} updates/s, errors: {result['errors']}")
+    print(f"{'step':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, stats in result['latency_ms'].items():
+        print(f"{step:<18}{stats['count']:>8}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}")
+    db = result['db']
+    print(f"db: {db['calls']} calls, avg executor wait {db['avg_executor_wait_ms']} ms, "
+          f"{db['queries']} queries, avg query {db['avg_query_ms']} ms, errors {db['query_errors']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота знакомств')
+    parser.add_argument('--users', default='10,100,500',
+                        help='число одновременных пользователей на каждом уровне, через запятую')
+    parser.add_argument('--reactions', type=int, default=10, help='лайков/дизлайков на пользователя')
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='задержка ответа имитации Bot API, мс')
+    parser.add_argument('--db', default='loadtest.db', help='файл БД для теста (пересоздается)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args(argv)
+    args.users = [int(value) for value in args.users.split(',') if value]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    # Настройки читаются при импорте main.py - задаем их до него
+    os.environ['DATABASE_PATH'] = args.db
+    os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('DB_LOG_FILE', '')
+    os.environ['METRICS_PORT'] = '0'
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Настройка логирования бота.
+
+Обработчики (консоль, файлы) работают в отдельном потоке QueueListener:
+вызов logger.info() в обработчике сообщения только кладет запись в
+очередь и не ждет записи на диск или в консоль.
+
+Настройки (переменные окружения / .env):
+- LOG_LEVEL - уровень по умолчанию (INFO);
+- LOG_LEVELS - уровни отдельных модулей: "database=WARNING,aiogram=INFO";
+- LOG_SAMPLE - доля сохраняемых записей ниже WARNING для частых логгеров:
+  "database=0.1,write_buffer=0.01" (предупреждения и ошибки не отбрасываются);
+- LOG_FORMAT - "text" (по умолчанию) или "json" - одна JSON-запись на строку;
+- DB_LOG_FILE - файл для логов database.py (database.log, пустая строка - без файла).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from typing import Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _parse_mapping(value: str) -> Dict[str, str]:
+    """'a=1,b=2' -> {'a': '1', 'b': '2'}"""
+    result = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, _, setting = item.partition('=')
+            result[name.strip()] = setting.strip()
+    return result
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только часть записей ниже WARNING от заданных логгеров.
+
+    rates - логгер -> доля (0..1); действует и на дочерние логгеры.
+    Отбор детерминированный: каждая N-я запись логгера.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        every = round(1 / rate)
+        with self._lock:
+            count = self._counters.get(record.name, 0)
+            self._counters[record.name] = count + 1
+        return count % every == 0
+
+
+def setup_logging():
+    """Настраивает логирование через очередь; повторные вызовы ничего не делают"""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if os.getenv('LOG_FORMAT', 'text') == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    handlers = [console_handler]
+
+    db_log_file = os.getenv('DB_LOG_FILE', 'database.log')
+    if db_log_file:
+        file_handler = logging.FileHandler(db_log_file, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        file_handler.addFilter(logging.Filter('database'))
+        handlers.append(file_handler)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    sample = {name: float(rate) for name, rate in _parse_mapping(os.getenv('LOG_SAMPLE', '')).items()}
+    if sample:
+        queue_handler.addFilter(SamplingFilter(sample))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in _parse_mapping(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает записи из очереди и останавливает поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,31 +1,31 @@
+import asyncio
 import logging
 from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import os
 from dotenv import load_dotenv
-from profile_editor import register_handlers
 
+# Загрузка переменных окружения (до импорта модулей, читающих настройки, например DATABASE_PATH)
+load_dotenv()
 
-from database import (
-    get_profile, add_profile, get_matching_profiles, add_like,
-    get_user_interests, add_user_interests, get_all_interests,
-    add_viewed_profile, check_mutual_like, add_report, add_block,
-    get_recent_likes, update_last_active, clear_user_interests,
-    update_username, get_all_users, get_users_by_interests
-)
+from profile_editor import register_handlers
+from broadcast import Broadcaster
+from cache import LRUCache
+from fsm_storage import SQLiteStorage
+from keyboards import InterestKeyboard
+from logging_config import setup_logging
+from media import PhotoValidator, send_card
+from metrics import MetricsExporter, timed
+from middlewares import HandlerTimingMiddleware, UserSerializationMiddleware
 
-# Загрузка переменных окружения
-load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import async_db as db
+
+# Настройка логирования (см. logging_config.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Инициализация бота
@@ -34,8 +34,15 @@ if not TOKEN:
     raise ValueError("Не установлен токен бота. Проверьте файл .env")
 
 bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+storage = SQLiteStorage()
 dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(HandlerTimingMiddleware())
+# Подключается последней: см. docstring UserSerializationMiddleware
+dp.middleware.setup(UserSerializationMiddleware())
+metrics_exporter = MetricsExporter()
+broadcaster = Broadcaster(bot)
+photo_validator = PhotoValidator(bot)
+interests_keyboard = InterestKeyboard(prefix='interest_', done_data='interests_done')
 
 # Состояния FSM
 class ProfileStates(StatesGroup):
@@ -51,16 +58,14 @@ class ProfileStates(StatesGroup):
     broadcast_interests = State()
 
 # Клавиатуры
-def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
+def _build_main_keyboard(has_profile: bool, has_likes: bool) -> ReplyKeyboardMarkup:
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    profile = get_profile(user_id)
     
-    if profile:
+    if has_profile:
         keyboard.add(KeyboardButton("👀 Смотреть анкеты"))
         keyboard.add(KeyboardButton("👤 Мой профиль"))  # Добавляем новую кнопку
         
-        recent_likes = get_recent_likes(user_id)
-        if recent_likes:
+        if has_likes:
             keyboard.add(KeyboardButton("👀 Посмотреть кто лайкнул"))
             
         keyboard.add(KeyboardButton("📝 Редактировать профиль"))
@@ -70,6 +75,17 @@ def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
     
     return keyboard
 
+# Все варианты главной клавиатуры строятся один раз
+MAIN_KEYBOARDS = {
+    (has_profile, has_likes): _build_main_keyboard(has_profile, has_likes)
+    for has_profile in (False, True)
+    for has_likes in (False, True)
+}
+
+async def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
+    has_profile, has_likes = await db.get_keyboard_state(user_id)
+    return MAIN_KEYBOARDS[(has_profile, has_likes)]
+
 def get_like_keyboard():
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
     keyboard.row(
@@ -94,36 +110,9 @@ def get_looking_for_keyboard():
     )
     return keyboard
 
-def get_interests_keyboard(selected_interests: List[int] = None) -> InlineKeyboardMarkup:
-    """Создает клавиатуру с интересами"""
-    if selected_interests is None:
-        selected_interests = []
-        
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    interests = get_all_interests()
-    
-    buttons = []
-    for interest_id, interest_name in interests:
-        mark = "✅ " if interest_id in selected_interests else ""
-        buttons.append(
-            InlineKeyboardButton(
-                text=f"{mark}{interest_name}",
-                callback_data=f"interest_{interest_id}"
-            )
-        )
-    
-    # Добавляем кнопки по две в ряд
-    for i in range(0, len(buttons), 2):
-        row = buttons[i:i+2]
-        keyboard.row(*row)
-    
-    # Добавляем кнопку "Готово" отдельной строкой
-    keyboard.row(InlineKeyboardButton(
-        text="Готово ✅",
-        callback_data="interests_done"
-    ))
-    
-    return keyboard
+async def get_interests_keyboard(selected_interests: List[int] = None) -> InlineKeyboardMarkup:
+    """Клавиатура с интересами (готовая разметка из кэша, см. keyboards.py)"""
+    return interests_keyboard.build(await db.get_interest_catalog(), selected_interests or ())
 
 # Команда /start
 @dp.message_handler(commands=['start'])
@@ -131,12 +120,12 @@ async def cmd_start(message: types.Message):
     user_id = message.from_user.id
     username = message.from_user.username
     if username:
-        update_username(user_id, username)
-    profile = get_profile(user_id)
+        await db.update_username(user_id, username)
+    profile = await db.get_profile(user_id)
     
     if profile:
         # Получаем интересы пользователя
-        user_interests = get_user_interests(user_id)
+        user_interests = await db.get_user_interests(user_id)
         interests_text = ", ".join(user_interests) if user_interests else "Не указаны"
         
         # Маппинг для отображения пола
@@ -150,33 +139,26 @@ async def cmd_start(message: types.Message):
         # Формируем текст профиля
         profile_text = (
             f"👤 Ваш профиль:\n\n"
-            f"Имя: {profile[1]}\n"
-            f"Возраст: {profile[2]}\n"
-            f"Пол: {gender_map.get(profile[5], 'Не указан')}\n"
-            f"Ищу: {looking_for_map.get(profile[6], 'Не указано')}\n"
-            f"Город: {profile[7] if profile[7] else 'Не указан'}\n"
-            f"О себе: {profile[3]}\n\n"
+            f"Имя: {profile.name}\n"
+            f"Возраст: {profile.age}\n"
+            f"Пол: {gender_map.get(profile.gender, 'Не указан')}\n"
+            f"Ищу: {looking_for_map.get(profile.looking_for, 'Не указано')}\n"
+            f"Город: {profile.city if profile.city else 'Не указан'}\n"
+            f"О себе: {profile.description}\n\n"
             f"Интересы: {interests_text}\n\n"
         )
         
-        try:
-            # Отправляем фото с подписью
-            await bot.send_photo(
-                chat_id=message.chat.id,
-                photo=profile[4],  # photo_id
-                caption=profile_text,
-                reply_markup=get_main_keyboard(user_id)
-            )
-        except Exception as e:
-            logger.error(f"Error sending profile photo: {e}")
-            await message.answer(
-                f"❌ Фото недоступно\n\n{profile_text}",
-                reply_markup=get_main_keyboard(user_id)
-            )
+        # Отправляем фото с подписью
+        await send_card(
+            bot, message.chat.id, user_id,
+            None if profile.photo_broken else profile.photo_id,
+            profile_text,
+            reply_markup=await get_main_keyboard(user_id)
+        )
     else:
         await message.answer(
             "Добро пожаловать! Для начала создайте свой профиль:",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
 
 # Создание профиля
@@ -277,13 +259,7 @@ async def process_photo(message: types.Message, state: FSMContext):
         photo = message.photo[-1]
         photo_id = photo.file_id
         username = message.from_user.username  # Получаем username пользователя
-        
-        try:
-            await bot.get_file(photo_id)
-        except Exception as e:
-            logger.error(f"Invalid photo_id: {e}")
-            await message.answer("Ошибка при обработке фото. Пожалуйста, отправьте другое фото.")
-            return
+        # file_id из входящего сообщения рабочий - проверять его getFile не нужно (см. media.py)
         
         # Сохраняем фото и username в состояние
         await state.update_data({
@@ -294,18 +270,18 @@ async def process_photo(message: types.Message, state: FSMContext):
         await ProfileStates.interests.set()
         
         # Показываем клавиатуру с интересами
-        interests = get_all_interests()
+        interests = await db.get_all_interests()
         if not interests:
             logger.error("No interests found in database")
             await message.answer(
                 "Произошла ошибка при загрузке интересов. Пожалуйста, попробуйте позже.",
-                reply_markup=get_main_keyboard(message.from_user.id)
+                reply_markup=await get_main_keyboard(message.from_user.id)
             )
             return
             
         await message.answer(
             "Выберите ваши интересы (можно выбрать до 5):",
-            reply_markup=get_interests_keyboard()
+            reply_markup=await get_interests_keyboard()
         )
         
     except Exception as e:
@@ -336,8 +312,8 @@ async def process_interest_selection(callback_query: types.CallbackQuery, state:
         
         await state.update_data(selected_interests=selected_interests)
         
-        interests = get_all_interests()
-        selected_names = [name for id_, name in interests if id_ in selected_interests]
+        catalog = await db.get_interest_catalog()
+        selected_names = catalog.selected_names(selected_interests)
         
         text = "Выберите ваши интересы (можно выбрать до 5):\n\n"
         if selected_names:
@@ -347,7 +323,7 @@ async def process_interest_selection(callback_query: types.CallbackQuery, state:
             
         await callback_query.message.edit_text(
             text=text,
-            reply_markup=get_interests_keyboard(selected_interests)
+            reply_markup=await get_interests_keyboard(selected_interests)
         )
         
     except Exception as e:
@@ -366,8 +342,8 @@ async def process_interests_done(callback_query: types.CallbackQuery, state: FSM
         
         user_id = callback_query.from_user.id
         
-        # Сохраняем профиль с username
-        add_profile(
+        # Сохраняем профиль с username и интересы одной транзакцией
+        await db.create_profile(
             user_id=user_id,
             name=data['name'],
             age=data['age'],
@@ -376,28 +352,77 @@ async def process_interests_done(callback_query: types.CallbackQuery, state: FSM
             gender=data['gender'],
             looking_for=data['looking_for'],
             city=data.get('city'),
-            username=data.get('username')
+            username=data.get('username'),
+            interests=selected_interests
         )
         
-        # Сохраняем интересы
-        clear_user_interests(user_id)
-        add_user_interests(user_id, selected_interests)
-        
         await state.finish()
         await callback_query.message.answer(
             "Профиль успешно создан! Теперь вы можете смотреть анкеты.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
         
     except Exception as e:
         logger.error(f"Error in process_interests_done: {e}", exc_info=True)
         await callback_query.message.answer(
             "Произошла ошибка при создании профиля",
-            reply_markup=get_main_keyboard(callback_query.from_user.id)
+            reply_markup=await get_main_keyboard(callback_query.from_user.id)
         )
 
 # ... продолжение следует ...
 
+# Лента анкет: размер страницы и за сколько анкет до конца подгружать следующую
+FEED_PAGE_SIZE = 20
+FEED_PREFETCH_AHEAD = 5
+# Сколько секунд хранить подгруженную страницу, которую пользователь так и не открыл
+FEED_PREFETCH_TTL = 600
+
+# Подгружаемые в фоне страницы ленты: user_id -> (курсор, задача).
+# Пользователь может бросить ленту, не дойдя до конца страницы, поэтому
+# записи ограничены по числу и времени жизни
+_feed_prefetch = LRUCache(maxsize=10000, ttl=FEED_PREFETCH_TTL)
+
+@timed()
+async def _load_feed_page(user_id: int, cursor: Optional[list]) -> Tuple[List[int], Optional[list]]:
+    """Следующая страница ленты после курсора: (id анкет, новый курсор)"""
+    user_profile = await db.get_profile(user_id)
+    if not user_profile:
+        return [], None
+    profile_ids, next_cursor = await db.get_matching_profile_ids(
+        user_id=user_id,
+        looking_for=user_profile.looking_for,
+        limit=FEED_PAGE_SIZE,
+        after=cursor
+    )
+    # Курсор хранится в состоянии FSM (JSON), поэтому списком
+    return profile_ids, list(next_cursor) if next_cursor is not None else None
+
+def _prefetch_feed_page(user_id: int, cursor: list):
+    pending = _feed_prefetch.peek(user_id)
+    if pending is None or pending[0] != cursor:
+        _feed_prefetch.set(user_id, (cursor, asyncio.ensure_future(_load_feed_page(user_id, cursor))))
+
+def _take_prefetched_page(user_id: int) -> Optional[Tuple[Optional[list], asyncio.Task]]:
+    """Забирает подгружаемую страницу пользователя: (курсор, задача) или None"""
+    pending = _feed_prefetch.peek(user_id)
+    if pending is not None:
+        _feed_prefetch.invalidate(user_id)
+    return pending
+
+async def _next_feed_page(user_id: int, cursor: list) -> Tuple[List[int], Optional[list]]:
+    """Берет подгруженную заранее страницу или загружает ее сейчас"""
+    pending = _take_prefetched_page(user_id)
+    if pending is not None:
+        pending_cursor, task = pending
+        if pending_cursor == cursor:
+            try:
+                return await task
+            except Exception as e:
+                logger.error(f"Error prefetching feed page for user {user_id}: {e}")
+        else:
+            task.cancel()
+    return await _load_feed_page(user_id, cursor)
+
 # Просмотр анкет
 @dp.message_handler(lambda message: message.text == "👀 Смотреть анкеты")
 async def start_viewing_profiles(message: types.Message):
@@ -405,36 +430,35 @@ async def start_viewing_profiles(message: types.Message):
         user_id = message.from_user.id
         
         # Получаем профиль пользователя
-        user_profile = get_profile(user_id)
+        user_profile = await db.get_profile(user_id)
         if not user_profile:
             await message.answer(
                 "Сначала создайте свой профиль.",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
             return
             
-        # Получаем подходящие анкеты
-        profiles = get_matching_profiles(
-            user_id=user_id,
-            gender=user_profile[5],  # gender
-            looking_for=user_profile[6],  # looking_for
-            exclude_viewed=True
-        )
+        # Получаем первую страницу подходящих анкет
+        pending = _take_prefetched_page(user_id)
+        if pending is not None:
+            pending[1].cancel()
+        profiles, feed_cursor = await _load_feed_page(user_id, None)
         
         logger.info(f"Found profiles for user {user_id}: {len(profiles)}")
         
         if not profiles:
             await message.answer(
                 "Пока нет подходящих анкет. Попробуйте позже.",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
             return
             
-        # Сохраняем список анкет в состоянии
+        # Сохраняем в состоянии только id анкет и позицию
         state = dp.current_state(user=user_id)
         await state.update_data(
             profiles=profiles,
             current_profile_idx=0,
+            feed_cursor=feed_cursor,
             viewing_profiles=True
         )
         
@@ -445,9 +469,10 @@ async def start_viewing_profiles(message: types.Message):
         logger.error(f"Error starting profile viewing: {e}", exc_info=True)
         await message.answer(
             "Произошла ошибка при поиске анкет.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
 
+@timed()
 async def send_next_profile(message: types.Message, user_id: int):
     try:
         state = dp.current_state(user=user_id)
@@ -455,23 +480,39 @@ async def send_next_profile(message: types.Message, user_id: int):
         
         profiles = data.get('profiles', [])
         current_profile_idx = data.get('current_profile_idx', 0)
-        
-        if not profiles or current_profile_idx >= len(profiles):
+        feed_cursor = data.get('feed_cursor')
+        
+        profile = None
+        while profile is None:
+            if current_profile_idx >= len(profiles):
+                if feed_cursor is None:
+                    break
+                # Страница закончилась - берем следующую после курсора.
+                # Из показанных оставляем только последнюю анкету: на нее
+                # ссылаются лайк и жалоба
+                page, feed_cursor = await _next_feed_page(user_id, feed_cursor)
+                shown = profiles[current_profile_idx - 1:current_profile_idx] if current_profile_idx else []
+                profiles = shown + page
+                current_profile_idx = len(shown)
+                continue
+            # Анкету могли удалить после того, как она попала в ленту - пропускаем
+            profile = await db.get_feed_card(profiles[current_profile_idx])
+            if profile is None:
+                current_profile_idx += 1
+        
+        if profile is None:
             await message.answer(
                 "Вы просмотрели все анкеты. Попробуйте позже.",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
             await state.reset_data()
             return
             
-        profile = profiles[current_profile_idx]
-        profile_id, name, age, description, photo_id, common_interests, age_diff = profile
+        profile_id, name, age, description, photo_id, user_interests = profile
         
         # Отмечаем профиль как просмотренный
-        add_viewed_profile(user_id, profile_id)
+        await db.add_viewed_profile(user_id, profile_id)
         
-        # Получаем интересы пользователя
-        user_interests = get_user_interests(profile_id)
         interests_text = ", ".join(user_interests) if user_interests else "Не указаны"
         
         caption = (
@@ -481,28 +522,24 @@ async def send_next_profile(message: types.Message, user_id: int):
             f"Интересы: {interests_text}"
         )
         
-        try:
-            await bot.send_photo(
-                chat_id=message.chat.id,
-                photo=photo_id,
-                caption=caption,
-                reply_markup=get_like_keyboard()
-            )
-        except Exception as photo_error:
-            logger.error(f"Error sending photo: {photo_error}")
-            await message.answer(
-                f"❌ Фото недоступно\n\n{caption}",
-                reply_markup=get_like_keyboard()
-            )
+        await send_card(bot, message.chat.id, profile_id, photo_id, caption, reply_markup=get_like_keyboard())
+        
+        # Анкеты подходят к концу - подгружаем следующую страницу заранее
+        if feed_cursor is not None and len(profiles) - current_profile_idx - 1 <= FEED_PREFETCH_AHEAD:
+            _prefetch_feed_page(user_id, feed_cursor)
         
         # Обновляем индекс текущего профиля
-        await state.update_data(current_profile_idx=current_profile_idx + 1)
+        await state.update_data(
+            profiles=profiles,
+            current_profile_idx=current_profile_idx + 1,
+            feed_cursor=feed_cursor
+        )
         
     except Exception as e:
         logger.error(f"Error sending profile: {e}", exc_info=True)
         await message.answer(
             "Произошла ошибка при показе анкеты.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
 
 # Обработка лайков/дизлайков
@@ -522,48 +559,47 @@ async def process_reaction(message: types.Message):
         if current_profile_idx <= 0:
             return
             
-        liked_profile = profiles[current_profile_idx - 1]
-        liked_user_id = liked_profile[0]
+        liked_user_id = profiles[current_profile_idx - 1]
         
         if message.text == "❤️ Лайк":
-            add_like(user_id, liked_user_id)
+            matched = await db.like_and_check_match(user_id, liked_user_id)
             
             # Получаем информацию о лайкнувшем пользователе
-            liker_profile = get_profile(user_id)
+            liker_profile = await db.get_profile(user_id)
             if liker_profile:
                 try:
                     # Отправляем уведомление о лайке
-                    liker_name = liker_profile[1]  # Имя лайкнувшего
+                    liker_name = liker_profile.name  # Имя лайкнувшего
                     notification_text = f"🔔 Вас лайкнул(а) {liker_name}!\nПосмотрите, кто вас лайкнул, нажав на кнопку '👀 Посмотреть кто лайкнул'"
                     
                     await bot.send_message(
                         chat_id=liked_user_id,
                         text=notification_text,
-                        reply_markup=get_main_keyboard(liked_user_id)
+                        reply_markup=await get_main_keyboard(liked_user_id)
                     )
                     logger.info(f"Like notification sent from {user_id} to {liked_user_id}")
                 except Exception as e:
                     logger.error(f"Error sending like notification: {e}")
             
-            # Проверяем взаимный лайк
-            if check_mutual_like(user_id, liked_user_id):
+            # Взаимный лайк
+            if matched:
                 # Получаем информацию о профиле
-                matched_profile = get_profile(liked_user_id)
+                matched_profile = await db.get_profile(liked_user_id)
                 if matched_profile:
-                    matched_name = matched_profile[1]
+                    matched_name = matched_profile.name
                     
                     # Отправляем уведомление о взаимной симпатии обоим пользователям
                     match_text = f"💕 У вас взаимная симпатия с {matched_name}!"
                     
                     await message.answer(
                         match_text,
-                        reply_markup=get_main_keyboard(user_id)
+                        reply_markup=await get_main_keyboard(user_id)
                     )
                     
                     await bot.send_message(
                         chat_id=liked_user_id,
-                        text=f"💕 У вас взаимная симпатия с {liker_profile[1]}!",
-                        reply_markup=get_main_keyboard(liked_user_id)
+                        text=f"💕 У вас взаимная симпатия с {liker_profile.name}!",
+                        reply_markup=await get_main_keyboard(liked_user_id)
                     )
         
         # Показываем следующую анкету
@@ -573,7 +609,7 @@ async def process_reaction(message: types.Message):
         logger.error(f"Error processing reaction: {e}", exc_info=True)
         await message.answer(
             "Произошла ошибка при обработке реакции.",
-            reply_markup=get_main_keyboard(message.from_user.id)
+            reply_markup=await get_main_keyboard(message.from_user.id)
         )
 
 # Просмотр лайков
@@ -582,14 +618,14 @@ async def show_who_liked(message: types.Message, state: FSMContext):
     try:
         user_id = message.from_user.id
         
-        # Получаем последние лайки
-        recent_likes = get_recent_likes(user_id)
+        # Получаем последний лайк без ответа
+        recent_likes = await db.get_recent_likes(user_id, limit=1)
         logger.info(f"Retrieved likes for user {user_id}: {len(recent_likes)}")
         
         if not recent_likes:
             await message.answer(
                 "У вас пока нет новых лайков.",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
             return
             
@@ -597,8 +633,8 @@ async def show_who_liked(message: types.Message, state: FSMContext):
         liked_from_id, name, age, description, photo_id, timestamp = recent_likes[0]
         
         # Получаем профиль лайкнувшего пользователя
-        liker_profile = get_profile(liked_from_id)
-        username = liker_profile[8] if liker_profile and len(liker_profile) > 8 else "нет_username"
+        liker_profile = await db.get_profile(liked_from_id)
+        username = liker_profile.username if liker_profile else "нет_username"
         
         # Сохраняем ID пользователя для возможного ответного лайка
         await state.update_data(current_profile_id=liked_from_id)
@@ -618,25 +654,13 @@ async def show_who_liked(message: types.Message, state: FSMContext):
             f"О себе: {description}\n"
         )
         
-        try:
-            await bot.send_photo(
-                chat_id=message.chat.id,
-                photo=photo_id,
-                caption=caption,
-                reply_markup=response_keyboard
-            )
-        except Exception as e:
-            logger.error(f"Error sending photo: {e}")
-            await message.answer(
-                f"❌ Фото недоступно\n\n{caption}",
-                reply_markup=response_keyboard
-            )
+        await send_card(bot, message.chat.id, liked_from_id, photo_id, caption, reply_markup=response_keyboard)
             
     except Exception as e:
         logger.error(f"Error in show_who_liked: {e}", exc_info=True)
         await message.answer(
             "Произошла ошибка при показе профиля.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
 
 # Обработка жалоб
@@ -651,13 +675,13 @@ async def handle_report(message: types.Message, state: FSMContext):
             await message.answer("Нет активного профиля для жалобы.")
             return
             
-        reported_user_id = profiles[current_profile_idx - 1][0]
-        add_report(message.from_user.id, reported_user_id)
-        add_block(message.from_user.id, reported_user_id)
+        reported_user_id = profiles[current_profile_idx - 1]
+        await db.add_report(message.from_user.id, reported_user_id)
+        await db.add_block(message.from_user.id, reported_user_id)
         
         await message.answer(
             "Жалоба отправлена. Пользователь заблокирован.",
-            reply_markup=get_main_keyboard(message.from_user.id)
+            reply_markup=await get_main_keyboard(message.from_user.id)
         )
         
     except Exception as e:
@@ -670,7 +694,7 @@ async def return_to_main_menu(message: types.Message, state: FSMContext):
     await state.finish()
     await message.answer(
         "Вы вернулись в главное меню.",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        reply_markup=await get_main_keyboard(message.from_user.id)
     )
 
 
@@ -684,23 +708,23 @@ async def process_return_like(message: types.Message, state: FSMContext):
         if not profile_to_like:
             await message.answer(
                 "Не удалось найти профиль для лайка.",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
             return
             
-        add_like(user_id, profile_to_like)
+        matched = await db.like_and_check_match(user_id, profile_to_like)
         logger.info(f"Return like added from {user_id} to {profile_to_like}")
         
-        if check_mutual_like(user_id, profile_to_like):
-            matched_profile = get_profile(profile_to_like)
-            user_profile = get_profile(user_id)
+        if matched:
+            matched_profile = await db.get_profile(profile_to_like)
+            user_profile = await db.get_profile(user_id)
             
             if matched_profile and user_profile:
-                matched_name = matched_profile[1]
-                user_name = user_profile[1]
+                matched_name = matched_profile.name
+                user_name = user_profile.name
                 
                 # Получаем username и формируем контактную информацию
-                matched_username = matched_profile[8]
+                matched_username = matched_profile.username
                 contact_info = ""
                 if matched_username:
                     contact_info = f"\n\nНаписать в личные сообщения: @{matched_username}\nили перейти по ссылке: https://t.me/{matched_username}"
@@ -708,7 +732,7 @@ async def process_return_like(message: types.Message, state: FSMContext):
                 match_text = f"💕 У вас взаимная симпатия с {matched_name}!{contact_info}"
                 
                 # То же самое для второго пользователя
-                user_username = user_profile[8]
+                user_username = user_profile.username
                 other_contact_info = ""
                 if user_username:
                     other_contact_info = f"\n\nНаписать в личные сообщения: @{user_username}\nили перейти по ссылке: https://t.me/{user_username}"
@@ -717,20 +741,20 @@ async def process_return_like(message: types.Message, state: FSMContext):
                 
                 await message.answer(
                     match_text,
-                    reply_markup=get_main_keyboard(user_id),
+                    reply_markup=await get_main_keyboard(user_id),
                     disable_web_page_preview=True
                 )
                 
                 await bot.send_message(
                     chat_id=profile_to_like,
                     text=other_match_text,
-                    reply_markup=get_main_keyboard(profile_to_like),
+                    reply_markup=await get_main_keyboard(profile_to_like),
                     disable_web_page_preview=True
                 )
         else:
             await message.answer(
                 "Лайк отправлен! ❤️",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
         
         await state.finish()
@@ -739,7 +763,7 @@ async def process_return_like(message: types.Message, state: FSMContext):
         logger.error(f"Error processing return like: {e}", exc_info=True)
         await message.answer(
             "Произошла ошибка при отправке лайка.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
 
 # Добавим также обработчик для пропуска
@@ -748,7 +772,7 @@ async def skip_profile(message: types.Message, state: FSMContext):
     await state.finish()
     await message.answer(
         "Профиль пропущен.",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        reply_markup=await get_main_keyboard(message.from_user.id)
     )
 
 
@@ -756,17 +780,17 @@ async def skip_profile(message: types.Message, state: FSMContext):
 async def show_my_profile(message: types.Message):
     try:
         user_id = message.from_user.id
-        profile = get_profile(user_id)
+        profile = await db.get_profile(user_id)
         
         if not profile:
             await message.answer(
                 "У вас еще нет профиля. Создайте его!",
-                reply_markup=get_main_keyboard(user_id)
+                reply_markup=await get_main_keyboard(user_id)
             )
             return
             
         # Получаем интересы пользователя
-        user_interests = get_user_interests(user_id)
+        user_interests = await db.get_user_interests(user_id)
         interests_text = ", ".join(user_interests) if user_interests else "Не указаны"
         
         # Маппинг для отображения пола
@@ -780,35 +804,28 @@ async def show_my_profile(message: types.Message):
         # Формируем текст профиля
         profile_text = (
             f"👤 Ваш профиль:\n\n"
-            f"Имя: {profile[1]}\n"
-            f"Возраст: {profile[2]}\n"
-            f"Пол: {gender_map.get(profile[5], 'Не указан')}\n"
-            f"Ищу: {looking_for_map.get(profile[6], 'Не указано')}\n"
-            f"Город: {profile[7] if profile[7] else 'Не указан'}\n"
-            f"О себе: {profile[3]}\n\n"
+            f"Имя: {profile.name}\n"
+            f"Возраст: {profile.age}\n"
+            f"Пол: {gender_map.get(profile.gender, 'Не указан')}\n"
+            f"Ищу: {looking_for_map.get(profile.looking_for, 'Не указано')}\n"
+            f"Город: {profile.city if profile.city else 'Не указан'}\n"
+            f"О себе: {profile.description}\n\n"
             f"Интересы: {interests_text}\n\n"
         )
         
-        try:
-            # Отправляем фото с подписью
-            await bot.send_photo(
-                chat_id=message.chat.id,
-                photo=profile[4],  # photo_id
-                caption=profile_text,
-                reply_markup=get_main_keyboard(user_id)
-            )
-        except Exception as e:
-            logger.error(f"Error sending profile photo: {e}")
-            await message.answer(
-                f"❌ Фото недоступно\n\n{profile_text}",
-                reply_markup=get_main_keyboard(user_id)
-            )
+        # Отправляем фото с подписью
+        await send_card(
+            bot, message.chat.id, user_id,
+            None if profile.photo_broken else profile.photo_id,
+            profile_text,
+            reply_markup=await get_main_keyboard(user_id)
+        )
             
     except Exception as e:
         logger.error(f"Error showing profile: {e}", exc_info=True)
         await message.answer(
             "Произошла ошибка при отображении профиля.",
-            reply_markup=get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(user_id)
         )
 
 @dp.message_handler(lambda message: message.text == "📢 Рассылка")
@@ -824,7 +841,7 @@ async def process_broadcast_message(message: types.Message, state: FSMContext):
     await state.update_data(broadcast_message=message.text)
     await message.answer(
         "Выберите интересы, которым будет отправлено сообщение:",
-        reply_markup=get_interests_keyboard()
+        reply_markup=await get_interests_keyboard()
     )
     await ProfileStates.broadcast_interests.set()
 
@@ -844,8 +861,8 @@ async def process_broadcast_interest_selection(callback_query: types.CallbackQue
         
         await state.update_data(selected_interests=selected_interests)
         
-        interests = get_all_interests()
-        selected_names = [name for id_, name in interests if id_ in selected_interests]
+        catalog = await db.get_interest_catalog()
+        selected_names = catalog.selected_names(selected_interests)
         
         text = "Выберите интересы, которым будет отправлено сообщение:\n\n"
         if selected_names:
@@ -855,7 +872,7 @@ async def process_broadcast_interest_selection(callback_query: types.CallbackQue
             
         await callback_query.message.edit_text(
             text=text,
-            reply_markup=get_interests_keyboard(selected_interests)
+            reply_markup=await get_interests_keyboard(selected_interests)
         )
         
     except Exception as e:
@@ -877,9 +894,10 @@ async def process_broadcast_interests_done(callback_query: types.CallbackQuery,
         ADMIN_ID = int(os.getenv('ADMIN_ID').split()[0])  # Загружаем ID администратора из переменных окружения
         admin_id = ADMIN_ID  # Используем загруженный ID администратора
         
+        all_interests = await db.get_all_interests()
         await bot.send_message(
             chat_id=admin_id,
-            text=f"Сообщение от {callback_query.from_user.username}:\n{data['broadcast_message']}\n\nВыбранные интересы: {', '.join([name for id_, name in get_all_interests() if id_ in selected_interests])}",
+            text=f"Сообщение от {callback_query.from_user.username}:\n{data['broadcast_message']}\n\nВыбранные интересы: {', '.join([name for id_, name in all_interests if id_ in selected_interests])}",
             reply_markup=InlineKeyboardMarkup().add(
                 InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_broadcast"),
                 InlineKeyboardButton("❌ Отклонить", callback_data="decline_broadcast")
@@ -892,7 +910,7 @@ async def process_broadcast_interests_done(callback_query: types.CallbackQuery,
         logger.error(f"Error in process_broadcast_interests_done: {e}", exc_info=True)
         await callback_query.message.answer(
             "Произошла ошибка при отправке сообщения администратору.",
-            reply_markup=get_main_keyboard(callback_query.from_user.id)
+            reply_markup=await get_main_keyboard(callback_query.from_user.id)
         )
 
 @dp.callback_query_handler(lambda c: c.data == 'confirm_broadcast')
@@ -913,13 +931,13 @@ async def confirm_broadcast(callback_query: types.CallbackQuery, state: FSMConte
         logger.info(f"Selected interests: {selected_interests_text}")
         
         # Получаем ID выбранных интересов
-        all_interests = get_all_interests()
+        all_interests = await db.get_all_interests()
         selected_interests = [id_ for id_, name in all_interests if name in selected_interests_text.split(', ')]
         
         logger.info(f"Selected interest IDs: {selected_interests}")
         
         # Получаем всех пользователей, у которых есть выбранные интересы
-        users_with_interests = get_users_by_interests(selected_interests)
+        users_with_interests = await db.get_users_by_interests(selected_interests)
         
         logger.info(f"Users with selected interests: {users_with_interests}")
         
@@ -928,14 +946,18 @@ async def confirm_broadcast(callback_query: types.CallbackQuery, state: FSMConte
             return
         
         username = callback_query.message.text.split(':')[0].split(' ')[-1]  # Получаем username отправителя
-        for user_id in users_with_interests:
-            try:
-                await bot.send_message(user_id, f"{message_text}\nНаписать в личные сообщения: @{username}")
-                logger.info(f"Message sent to user {user_id}")
-            except Exception as e:
-                logger.error(f"Error sending message to user {user_id}: {e}")
         
-        await callback_query.message.answer("Рассылка успешно отправлена!")
+        # Сохраняем рассылку в БД и отправляем ее в фоне
+        job_id = await db.create_broadcast_job(
+            f"{message_text}\nНаписать в личные сообщения: @{username}",
+            callback_query.message.chat.id,
+            users_with_interests
+        )
+        progress_message = await callback_query.message.answer(
+            f"Рассылка запущена: 0 из {len(users_with_interests)}"
+        )
+        await db.set_broadcast_progress_message(job_id, progress_message.message_id)
+        broadcaster.start(job_id)
         await state.finish()
         
     except Exception as e:
@@ -947,7 +969,28 @@ async def decline_broadcast(callback_query: types.CallbackQuery):
     await callback_query.answer()
     await callback_query.message.answer("Сообщение отклонено.")
 
-# Запуск бота
+# Обработчики редактирования профиля (profile_editor.py)
+register_handlers(dp)
+
+async def on_startup(dp: Dispatcher):
+    await db.bootstrap()
+    await metrics_exporter.start()
+    await broadcaster.resume()
+    photo_validator.start()
+
+async def on_shutdown(dp: Dispatcher):
+    await photo_validator.stop()
+    await broadcaster.stop()
+    await metrics_exporter.stop()
+    # Состояния FSM нужно записать до остановки пула потоков БД
+    await dp.storage.close()
+    db.shutdown()
+
+# Запуск бота (режим - BOT_MODE в .env, см. webhook.py)
 if __name__ == '__main__':
-    from aiogram import executor
-    executor.start_polling(dp, skip_updates=True)
\ No newline at end of file
+    import webhook
+    if webhook.BOT_MODE == 'webhook':
+        webhook.start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        from aiogram import executor
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
\ No newline at end of file
@@ -0,0 +1,226 @@
+import bisect
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from interest_index import InterestIndex
+
+logger = logging.getLogger(__name__)
+
+# Сколько лучших кандидатов держим в очереди одного пользователя
+QUEUE_SIZE = 200
+# Сколько очередей держим в памяти одновременно (LRU)
+MAX_QUEUES = 2000
+
+# Ключ сортировки кандидата: (-общие интересы, разница в возрасте, user_id)
+Key = Tuple[int, int, int]
+
+
+class _Queue:
+    """Отсортированная очередь кандидатов одного пользователя"""
+
+    __slots__ = ('looking_for', 'keys', 'by_id', 'complete')
+
+    def __init__(self, looking_for: str, keys: List[Key], complete: bool):
+        self.looking_for = looking_for
+        self.keys = keys
+        self.by_id = {key[2]: key for key in keys}
+        # complete=False означает, что очередь обрезана до QUEUE_SIZE
+        # и кандидаты хуже последнего ключа в ней не хранятся
+        self.complete = complete
+
+    def discard(self, candidate_id: int):
+        key = self.by_id.pop(candidate_id, None)
+        if key is not None:
+            i = bisect.bisect_left(self.keys, key)
+            del self.keys[i]
+
+    def offer(self, key: Key):
+        if not self.complete and (not self.keys or key > self.keys[-1]):
+            # Кандидат хуже всех в обрезанной очереди - попадет в нее при перестроении
+            return
+        bisect.insort(self.keys, key)
+        self.by_id[key[2]] = key
+        if len(self.keys) > QUEUE_SIZE:
+            dropped = self.keys.pop()
+            del self.by_id[dropped[2]]
+            self.complete = False
+
+
+class MatchingEngine:
+    """
+    Движок подбора анкет.
+
+    Хранит в памяти то, что нужно для ранжирования (пол, возраст и
+    интересы - в InterestIndex, а также просмотры, лайки, блокировки),
+    и для каждого активного пользователя - очередь лучших кандидатов.
+    Очереди обновляются точечно при изменении анкет и событиях, поэтому
+    выдача страницы не требует пересчета всей таблицы profiles.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.index = InterestIndex()
+        self._seen: Dict[int, Set[int]] = defaultdict(set)     # просмотренные и лайкнутые
+        self._blocked: Dict[int, Set[int]] = defaultdict(set)  # блокировки в обе стороны
+        self._queues: 'OrderedDict[int, _Queue]' = OrderedDict()
+        self.loaded = False
+
+    # --- загрузка ---
+
+    def ensure_loaded(self, loader):
+        """
+        Загружает данные при первом обращении.
+
+        loader() возвращает (profiles, interests, seen, blocks). Вызывается
+        под блокировкой движка, поэтому события, пришедшие во время
+        загрузки, будут применены после нее, а не потеряны.
+        """
+        if self.loaded:
+            return
+        with self._lock:
+            if not self.loaded:
+                self.load(*loader())
+
+    def load(self, profiles: Iterable[tuple], interests: Iterable[tuple],
+             seen: Iterable[tuple], blocks: Iterable[tuple]):
+        """Заполняет движок данными из БД"""
+        with self._lock:
+            self.index = InterestIndex()
+            self.index.load(profiles, interests)
+            self._seen.clear()
+            for user_id, other_id in seen:
+                self._seen[user_id].add(other_id)
+            self._blocked.clear()
+            for user_id, other_id in blocks:
+                self._blocked[user_id].add(other_id)
+                self._blocked[other_id].add(user_id)
+            self._queues.clear()
+            self.loaded = True
+        logger.info(f"Matching engine loaded {len(self.index)} profiles")
+
+    # --- ранжирование ---
+
+    def _key(self, viewer_id: int, candidate_id: int) -> Key:
+        common, age_diff = self.index.score(viewer_id, candidate_id)
+        return (-common, age_diff, candidate_id)
+
+    def _is_candidate(self, viewer_id: int, candidate_id: int, looking_for: str) -> bool:
+        return (candidate_id != viewer_id
+                and self.index.matches_gender(candidate_id, looking_for)
+                and candidate_id not in self._seen.get(viewer_id, ())
+                and candidate_id not in self._blocked.get(viewer_id, ()))
+
+    def _build_queue(self, viewer_id: int, looking_for: str) -> _Queue:
+        exclude = self._seen.get(viewer_id, set()) | self._blocked.get(viewer_id, set())
+        keys = self.index.rank(viewer_id, looking_for, exclude=exclude, limit=QUEUE_SIZE + 1)
+        queue = _Queue(looking_for, keys[:QUEUE_SIZE], complete=len(keys) <= QUEUE_SIZE)
+        self._queues[viewer_id] = queue
+        self._queues.move_to_end(viewer_id)
+        if len(self._queues) > MAX_QUEUES:
+            self._queues.popitem(last=False)
+        return queue
+
+    def page(self, viewer_id: int, looking_for: str, limit: int = 50,
+             exclude_viewed: bool = True, after: Optional[Key] = None) -> List[Tuple[int, int, int]]:
+        """
+        Возвращает до limit лучших кандидатов для пользователя.
+
+        after - ключ последнего кандидата предыдущей страницы (см. cursor()):
+        страница начинается сразу после него, без пересчета предыдущих.
+
+        Результат - список (user_id, common_interests, age_diff).
+        """
+        with self._lock:
+            if viewer_id not in self.index:
+                return []
+            if not exclude_viewed:
+                keys = self.index.rank(viewer_id, looking_for, limit=limit, after=after)
+            else:
+                queue = self._queues.get(viewer_id)
+                if (queue is None or queue.looking_for != looking_for
+                        or (after is None and not queue.complete and len(queue.keys) < limit)):
+                    queue = self._build_queue(viewer_id, looking_for)
+                else:
+                    self._queues.move_to_end(viewer_id)
+                start = bisect.bisect_right(queue.keys, after) if after is not None else 0
+                keys = queue.keys[start:start + limit]
+                if len(keys) < limit and not queue.complete:
+                    # Страница выходит за обрезанную очередь - ранжируем от курсора
+                    exclude = self._seen.get(viewer_id, set()) | self._blocked.get(viewer_id, set())
+                    keys = self.index.rank(viewer_id, looking_for, exclude=exclude,
+                                           limit=limit, after=after)
+            return [(candidate_id, -neg_common, age_diff)
+                    for neg_common, age_diff, candidate_id in keys]
+
+    @staticmethod
+    def cursor(entry: Tuple[int, int, int]) -> Key:
+        """Курсор страницы по последней записи (user_id, common_interests, age_diff)"""
+        candidate_id, common, age_diff = entry
+        return (-common, age_diff, candidate_id)
+
+    # --- события ---
+
+    def _reindex(self, candidate_id: int):
+        """Пересчитывает позицию анкеты во всех очередях"""
+        self._queues.pop(candidate_id, None)
+        for viewer_id, queue in self._queues.items():
+            queue.discard(candidate_id)
+            if candidate_id in self.index and self._is_candidate(
+                    viewer_id, candidate_id, queue.looking_for):
+                queue.offer(self._key(viewer_id, candidate_id))
+
+    def upsert_profile(self, user_id: int, gender: Optional[str] = None,
+                       looking_for: Optional[str] = None, age: Optional[int] = None):
+        """Добавляет анкету или обновляет переданные поля"""
+        with self._lock:
+            if not self.loaded:
+                return
+            if None in (gender, looking_for, age):
+                current = self.index.profile(user_id)
+                if current is None:
+                    return  # неполная анкета, которой нет в движке
+                gender = gender if gender is not None else current[0]
+                looking_for = looking_for if looking_for is not None else current[1]
+                age = age if age is not None else current[2]
+            self.index.set_profile(user_id, gender, looking_for, age)
+            self._reindex(user_id)
+
+    def add_interests(self, user_id: int, interest_ids: Iterable[int]):
+        with self._lock:
+            if not self.loaded:
+                return
+            self.index.add_interests(user_id, interest_ids)
+            self._reindex(user_id)
+
+    def set_interests(self, user_id: int, interest_ids: Iterable[int]):
+        with self._lock:
+            if not self.loaded:
+                return
+            self.index.set_interests(user_id, interest_ids)
+            self._reindex(user_id)
+
+    def clear_interests(self, user_id: int):
+        self.set_interests(user_id, ())
+
+    def mark_seen(self, user_id: int, other_id: int):
+        """Анкета просмотрена или лайкнута - больше не показываем ее пользователю"""
+        with self._lock:
+            if not self.loaded:
+                return
+            self._seen[user_id].add(other_id)
+            queue = self._queues.get(user_id)
+            if queue is not None:
+                queue.discard(other_id)
+
+    def block(self, user_id: int, blocked_user_id: int):
+        with self._lock:
+            if not self.loaded:
+                return
+            self._blocked[user_id].add(blocked_user_id)
+            self._blocked[blocked_user_id].add(user_id)
+            for viewer_id, other_id in ((user_id, blocked_user_id), (blocked_user_id, user_id)):
+                queue = self._queues.get(viewer_id)
+                if queue is not None:
+                    queue.discard(other_id)
@@ -0,0 +1,153 @@
+"""
+Фото анкет: проверка file_id и отправка карточек с фото.
+
+file_id из входящего сообщения Telegram выдал только что, поэтому при
+загрузке фото (регистрация, редактирование анкеты) он не проверяется
+запросом getFile - анкета сразу считается проверенной. Время последней
+проверки хранится в profiles.photo_checked_at, нерабочее фото отмечается
+в profiles.photo_broken.
+
+PhotoValidator в фоне перепроверяет через getFile фото, которые не
+проверялись дольше MEDIA_REVALIDATE_AGE секунд (отмеченные нерабочими -
+дольше MEDIA_BROKEN_REVALIDATE_AGE). Анкеты с нерабочим фото
+лента, входящие лайки и "Мой профиль" показывают текстом, без попытки
+sendPhoto. Ошибка file_id при sendPhoto тоже отмечает фото нерабочим;
+новое фото снимает отметку.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import (
+    BadRequest, RetryAfter, TypeOfFileMismatch, WrongFileIdentifier, WrongRemoteFileIdSpecified
+)
+
+import async_db as db
+from broadcast import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд фото перепроверяется (по умолчанию - неделя)
+MEDIA_REVALIDATE_AGE = float(os.getenv('MEDIA_REVALIDATE_AGE', str(7 * 24 * 3600)))
+# Через сколько секунд перепроверяется фото, отмеченное нерабочим (по умолчанию - 30 дней):
+# отметка могла появиться из-за временного сбоя Telegram
+MEDIA_BROKEN_REVALIDATE_AGE = float(os.getenv('MEDIA_BROKEN_REVALIDATE_AGE', str(30 * 24 * 3600)))
+# Пауза между проходами, когда устаревших фото не осталось (секунды)
+MEDIA_REVALIDATE_INTERVAL = float(os.getenv('MEDIA_REVALIDATE_INTERVAL', '60'))
+# Сколько фото берем из БД за проход
+BATCH_SIZE = 50
+# Запросов getFile в секунду: проверка не должна отнимать лимит у ответов пользователям
+CHECK_RATE = 5
+
+# Ошибки sendPhoto, которые означают нерабочий file_id (а не сбой сети или API)
+BROKEN_PHOTO_ERRORS = (WrongFileIdentifier, WrongRemoteFileIdSpecified, TypeOfFileMismatch)
+
+PHOTO_UNAVAILABLE = "❌ Фото недоступно"
+
+
+async def send_card(bot: Bot, chat_id: int, owner_id: int, photo_id: Optional[str], caption: str,
+                    reply_markup=None) -> types.Message:
+    """
+    Отправляет анкету owner_id с фото; без фото (photo_id None) - текстом.
+
+    Если Telegram не принял file_id, фото отмечается нерабочим и анкета
+    уходит текстом - следующие показы обойдутся без sendPhoto.
+    """
+    if photo_id:
+        try:
+            return await bot.send_photo(
+                chat_id=chat_id,
+                photo=photo_id,
+                caption=caption,
+                reply_markup=reply_markup
+            )
+        except BROKEN_PHOTO_ERRORS as e:
+            logger.warning(f"Photo of user {owner_id} is broken: {e}")
+            await db.set_photo_status(owner_id, photo_id, broken=True)
+        except Exception as e:
+            logger.error(f"Error sending photo: {e}")
+    return await bot.send_message(chat_id, f"{PHOTO_UNAVAILABLE}\n\n{caption}", reply_markup=reply_markup)
+
+
+class PhotoValidator:
+    """
+    Фоновая перепроверка file_id фото анкет.
+
+    Берет из БД порции давно не проверявшихся фото (давние первыми) и
+    вызывает для них getFile с ограничением частоты. Ответ Bad Request
+    означает нерабочее фото. Если проверить не удалось (сбой сети), время
+    попытки все равно запоминается: иначе такие фото оставались бы в
+    начале очереди и каждая порция состояла бы из них. Отметка о нерабочем
+    фото при этом не меняется, фото перепроверится через max_age.
+
+    Фото, отмеченные нерабочими, перепроверяются реже - раз в
+    broken_max_age секунд: рабочее снова показывается в карточках. Они
+    дополняют порцию, если в ней осталось место после рабочих фото.
+    """
+
+    def __init__(self, bot: Bot, max_age: float = MEDIA_REVALIDATE_AGE,
+                 interval: float = MEDIA_REVALIDATE_INTERVAL, rate: float = CHECK_RATE,
+                 broken_max_age: float = MEDIA_BROKEN_REVALIDATE_AGE):
+        self.bot = bot
+        self.max_age = max_age
+        self.broken_max_age = broken_max_age
+        self.interval = interval
+        self._limit = TokenBucket(rate)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                checked = await self.revalidate()
+            except Exception as e:
+                logger.error(f"Error revalidating photos: {e}", exc_info=True)
+                checked = 0
+            # Полная порция - вероятно, устаревшие фото еще есть
+            if checked < BATCH_SIZE:
+                await asyncio.sleep(self.interval)
+
+    async def revalidate(self) -> int:
+        """
+        Проверяет одну порцию устаревших фото; возвращает число проверенных
+        (без фото, которые проверить не удалось).
+        """
+        checked = 0
+        photos = await db.get_stale_photos(self.max_age, BATCH_SIZE)
+        if len(photos) < BATCH_SIZE:
+            photos += await db.get_stale_photos(self.broken_max_age, BATCH_SIZE - len(photos), broken=True)
+        for user_id, photo_id in photos:
+            await self._limit.acquire()
+            broken = await self.check(photo_id)
+            await db.set_photo_status(user_id, photo_id, broken)
+            if broken is not None:
+                checked += 1
+        return checked
+
+    async def check(self, photo_id: str) -> Optional[bool]:
+        """True - file_id нерабочий, False - рабочий, None - проверить не удалось"""
+        try:
+            await self.bot.get_file(photo_id)
+            return False
+        except RetryAfter as e:
+            self._limit.pause(e.timeout)
+        except BadRequest as e:
+            logger.info(f"Photo {photo_id} failed revalidation: {e}")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not revalidate photo {photo_id}: {e}")
+        return None
@@ -0,0 +1,228 @@
+"""
+Метрики производительности бота.
+
+Собираются в памяти процесса (REGISTRY) и отдаются в текстовом
+формате Prometheus:
+- по HTTP, если задан METRICS_PORT (GET /metrics);
+- и/или периодически в лог, если задан METRICS_DUMP_INTERVAL (секунды).
+
+Что измеряется:
+- bot_handler_seconds - время обработчиков aiogram (middlewares.HandlerTimingMiddleware)
+  и отдельных корутин, помеченных @timed;
+- db_query_seconds, db_query_rows_total, db_query_errors_total - запросы
+  execute_query и _timed_execute по метке, которую передает вызывающая
+  функция database.py (обычно ее имя);
+- db_transaction_seconds - транзакции transaction();
+- db_executor_wait_seconds - ожидание свободного потока пула БД (async_db.run);
+- значения, которые считаются при выдаче (gauge): открытые соединения,
+  размеры и попадания кэшей, очередь отложенной записи.
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', '0'))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, отдельная серия на каждый набор меток"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List] = {}  # метки -> [счетчики корзин, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def totals(self) -> Dict[Labels, Tuple[int, float]]:
+        """Метки -> (количество, сумма) по всем сериям"""
+        with self._lock:
+            return {key: (count, total) for key, (_, total, count) in self._series.items()}
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(key, list(counts), total, count)
+                     for key, (counts, total, count) in sorted(self._series.items())]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(key, ("le", str(bound)))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total:.6f}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f'{self.name}{_format_labels(key)} {value:g}' for key, value in items)
+        return lines
+
+
+class Gauge:
+    """Значение, которое вычисляется функцией в момент выдачи метрик"""
+
+    def __init__(self, name: str, help_text: str, func: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.help = help_text
+        self.func = func
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.error(f"Error collecting gauge {self.name}: {e}")
+            return lines
+        lines.extend(f'{self.name}{_format_labels(key)} {value:g}' for key, value in sorted(values.items()))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], Dict[Labels, float]]) -> Gauge:
+        gauge = Gauge(name, help_text, func)
+        self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+handler_seconds = REGISTRY.histogram('bot_handler_seconds', 'Handler execution time')
+handler_errors = REGISTRY.counter('bot_handler_errors_total', 'Handlers finished with an exception')
+query_seconds = REGISTRY.histogram('db_query_seconds', 'execute_query latency by query name')
+query_rows = REGISTRY.counter('db_query_rows_total', 'Rows returned by execute_query by query name')
+query_errors = REGISTRY.counter('db_query_errors_total', 'Failed execute_query calls by query name')
+transaction_seconds = REGISTRY.histogram('db_transaction_seconds', 'transaction() duration including COMMIT')
+executor_wait_seconds = REGISTRY.histogram('db_executor_wait_seconds', 'Time a DB call waited for a free executor thread')
+user_queue_wait_seconds = REGISTRY.histogram('bot_user_queue_wait_seconds', 'Time an update waited for the previous update of the same user')
+updates_dropped = REGISTRY.counter('bot_updates_dropped_total', 'Updates dropped by per-user serialization by reason')
+
+
+def timed(name: Optional[str] = None):
+    """Декоратор корутины: время выполнения попадает в bot_handler_seconds"""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(handler=label)
+                raise
+            finally:
+                handler_seconds.observe(time.perf_counter() - started, handler=label)
+        return wrapper
+    return decorator
+
+
+async def _handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+
+class MetricsExporter:
+    """HTTP-эндпоинт /metrics и/или периодический вывод метрик в лог"""
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT,
+                 dump_interval: float = METRICS_DUMP_INTERVAL):
+        self.host = host
+        self.port = port
+        self.dump_interval = dump_interval
+        self._runner = None
+        self._dump_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.port:
+            from aiohttp import web
+            app = web.Application()
+            app.router.add_get('/metrics', _handle_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+        if self.dump_interval:
+            self._dump_task = asyncio.ensure_future(self._dump_loop())
+
+    async def _dump_loop(self):
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            logger.info("Metrics:\n" + REGISTRY.render())
+
+    async def stop(self):
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+            self._dump_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
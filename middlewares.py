@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional, Set
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+USER_BACKLOG = int(os.getenv('USER_BACKLOG', '3'))
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Измеряет время обработки каждого события от pre_process до post_process
+    (метрика bot_handler_seconds).
+
+    Имя обработчика берется из current_handler на этапе process - он
+    известен только после проверки фильтров. События, которые не
+    подошли ни одному обработчику, учитываются как "unhandled".
+    """
+
+    async def trigger(self, action: str, args):
+        if action.endswith('_update'):
+            return
+        data = args[-1]
+        if action.startswith('pre_process_'):
+            data['_metrics_started'] = time.perf_counter()
+        elif action.startswith('process_'):
+            handler = current_handler.get(None)
+            data['_metrics_handler'] = getattr(handler, '__name__', repr(handler))
+        elif action.startswith('post_process_'):
+            started = data.pop('_metrics_started', None)
+            if started is not None:
+                metrics.handler_seconds.observe(time.perf_counter() - started,
+                                                handler=data.pop('_metrics_handler', 'unhandled'))
+
+
+# Поля Update, у события в которых есть пользователь (from_user или user)
+_USER_EVENTS = ('message', 'edited_message', 'callback_query', 'inline_query',
+                'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+                'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def _event_user_id(update: types.Update) -> int:
+    for name in _USER_EVENTS:
+        event = getattr(update, name, None)
+        if event is None:
+            continue
+        user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+        return user.id if user else 0
+    return 0
+
+
+def _press_key(update: types.Update) -> Optional[tuple]:
+    """Ключ нажатия кнопки: одинаковый у повторных нажатий; None - не кнопка"""
+    if update.callback_query:
+        query = update.callback_query
+        message_id = query.message.message_id if query.message else query.inline_message_id
+        return 'callback', message_id, query.data
+    if update.message and update.message.text:
+        # Кнопки обычной клавиатуры приходят текстом сообщения
+        return 'text', update.message.text
+    return None
+
+
+class _UserSlot:
+    __slots__ = ('lock', 'waiting', 'presses')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        # ключи нажатий, которые ждут очереди или обрабатываются
+        self.presses: Set[tuple] = set()
+
+
+class UserSerializationMiddleware(BaseMiddleware):
+    """
+    Обрабатывает обновления одного пользователя строго по очереди.
+
+    aiogram запускает обработку обновлений параллельно (в polling - пачкой
+    через gather, в webhook - по запросу на обновление), поэтому двойное
+    нажатие "❤️ Лайк" читает один и тот же current_profile_idx и пропускает
+    или дублирует анкету. Middleware держит на время обработки обновления
+    блокировку пользователя; обновления разных пользователей
+    обрабатываются параллельно, как и раньше.
+
+    Отбрасываются (метрика bot_updates_dropped_total):
+    - повторное нажатие той же кнопки, пока предыдущее ждет очереди или
+      в обработке. Закончившееся нажатие не мешает следующему: два
+      быстрых "❤️" подряд - лайки двух разных анкет;
+    - обновления сверх backlog ожидающих у одного пользователя.
+
+    Работает на уровне update: post_process_update вызывается в finally
+    после всех обработчиков. Отмена в pre_process_update другой middleware
+    оставила бы блокировку занятой, поэтому эта middleware подключается
+    последней.
+    """
+
+    def __init__(self, backlog: int = USER_BACKLOG):
+        super().__init__()
+        self.backlog = backlog
+        self._slots: Dict[int, _UserSlot] = {}
+        self._swept = time.monotonic()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        user_id = _event_user_id(update)
+        if not user_id:
+            return
+        now = time.monotonic()
+        self._sweep(now)
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._slots[user_id] = _UserSlot()
+
+        press = _press_key(update)
+        if press is not None and press in slot.presses:
+            await self._drop(update, 'duplicate')
+        if slot.waiting >= self.backlog:
+            await self._drop(update, 'backlog')
+
+        slot.waiting += 1
+        if press is not None:
+            slot.presses.add(press)
+        try:
+            await slot.lock.acquire()
+        except BaseException:
+            # Задачу отменили в очереди - post_process_update не будет
+            self._finish(slot, press)
+            raise
+        finally:
+            slot.waiting -= 1
+        metrics.user_queue_wait_seconds.observe(time.monotonic() - now)
+        data['_user_slot'] = (slot, press)
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        entry = data.pop('_user_slot', None)
+        if entry is None:
+            return
+        slot, press = entry
+        slot.lock.release()
+        self._finish(slot, press)
+
+    def _finish(self, slot: '_UserSlot', press: Optional[tuple]):
+        if press is not None:
+            slot.presses.discard(press)
+
+    async def _drop(self, update: types.Update, reason: str):
+        metrics.updates_dropped.inc(reason=reason)
+        if update.callback_query:
+            # Иначе у пользователя будут "часики" на кнопке до таймаута Telegram
+            try:
+                await update.callback_query.answer()
+            except Exception as e:
+                logger.debug(f"Failed to answer dropped callback query: {e}")
+        raise CancelHandler()
+
+    def _sweep(self, now: float):
+        """Удаляет состояние пользователей без очереди и обработки"""
+        if now - self._swept < 1.0:
+            return
+        self._swept = now
+        for user_id, slot in list(self._slots.items()):
+            if not (slot.lock.locked() or slot.waiting or slot.presses):
+                del self._slots[user_id]
@@ -0,0 +1,397 @@
+"""
+Миграции схемы БД.
+
+Версия схемы хранится в PRAGMA user_version. Каждый шаг MIGRATIONS
+выполняется один раз; все недостающие шаги применяются одной
+транзакцией вместе с записью новой версии - прерванная миграция не
+оставляет схему наполовину измененной.
+Новый шаг добавляется в конец списка со следующим номером версии;
+уже выпущенные шаги не меняются.
+
+check_query_plans() проверяет через EXPLAIN QUERY PLAN, что горячие
+запросы используют индексы, а не полный просмотр таблиц:
+
+    python migrations.py [путь к БД]
+"""
+import logging
+import sqlite3
+import sys
+from typing import Callable, List, Sequence, Tuple
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+
+def _create_base_tables(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS profiles (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            photo_id TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            looking_for TEXT NOT NULL,
+            city TEXT,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # В старых базах таблица profiles создавалась без username
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(profiles)")}
+    if 'username' not in columns:
+        conn.execute('ALTER TABLE profiles ADD COLUMN username TEXT')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS interests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_interests (
+            user_id INTEGER,
+            interest_id INTEGER,
+            FOREIGN KEY (user_id) REFERENCES profiles (user_id),
+            FOREIGN KEY (interest_id) REFERENCES interests (id),
+            PRIMARY KEY (user_id, interest_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS likes (
+            user_id INTEGER,
+            liked_user_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES profiles (user_id),
+            FOREIGN KEY (liked_user_id) REFERENCES profiles (user_id),
+            PRIMARY KEY (user_id, liked_user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS viewed_profiles (
+            user_id INTEGER,
+            viewed_user_id INTEGER,
+            viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES profiles (user_id),
+            FOREIGN KEY (viewed_user_id) REFERENCES profiles (user_id),
+            PRIMARY KEY (user_id, viewed_user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            from_user_id INTEGER,
+            reported_user_id INTEGER,
+            reason TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (from_user_id) REFERENCES profiles (user_id),
+            FOREIGN KEY (reported_user_id) REFERENCES profiles (user_id),
+            PRIMARY KEY (from_user_id, reported_user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS blocks (
+            user_id INTEGER,
+            blocked_user_id INTEGER,
+            reason TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES profiles (user_id),
+            FOREIGN KEY (blocked_user_id) REFERENCES profiles (user_id),
+            PRIMARY KEY (user_id, blocked_user_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_likes_user ON likes(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_likes_liked_user ON likes(liked_user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_viewed_user ON viewed_profiles(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_interests ON user_interests(user_id)')
+
+
+def _create_service_tables(conn: sqlite3.Connection):
+    # Рассылки (см. broadcast.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            admin_chat_id INTEGER NOT NULL,
+            progress_message_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',  -- running / done
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER,
+            user_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending / sent / failed
+            FOREIGN KEY (job_id) REFERENCES broadcast_jobs (id),
+            PRIMARY KEY (job_id, user_id)
+        )
+    ''')
+    # Состояния FSM (см. fsm_storage.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            chat TEXT NOT NULL,
+            user TEXT NOT NULL,
+            state TEXT,
+            data TEXT,    -- JSON
+            bucket TEXT,  -- JSON
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat, user)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _add_hot_query_indexes(conn: sqlite3.Connection):
+    # Индексы по user_id дублировали первичные ключи и только замедляли запись
+    conn.execute('DROP INDEX IF EXISTS idx_likes_user')
+    conn.execute('DROP INDEX IF EXISTS idx_viewed_user')
+    conn.execute('DROP INDEX IF EXISTS idx_user_interests')
+    # Кто лайкнул пользователя, новые сначала (get_recent_likes, get_last_like,
+    # состояние клавиатуры); user_id в индексе - чтобы не читать саму таблицу
+    conn.execute('DROP INDEX IF EXISTS idx_likes_liked_user')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_likes_liked_user_created ON likes(liked_user_id, created_at, user_id)')
+    # Кто заблокировал пользователя (блокировки действуют в обе стороны)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_blocks_blocked_user ON blocks(blocked_user_id, user_id)')
+    # Пользователи с выбранными интересами (get_users_by_interests)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_interests_interest ON user_interests(interest_id, user_id)')
+    # Анкеты по полу и возрасту
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_profiles_gender_age ON profiles(gender, age)')
+    # Неотправленные получатели рассылки; частичный индекс уменьшается по мере отправки
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_pending ON broadcast_recipients(job_id, user_id)
+        WHERE status = 'pending'
+    ''')
+
+
+BASIC_INTERESTS = (
+    "Спорт", "Музыка", "Кино", "Путешествия", "Книги",
+    "Искусство", "Фотография", "Кулинария", "Танцы", "Игры",
+    "Технологии", "Природа", "Животные", "Йога", "Медитация",
+)
+
+
+def _add_basic_interests(conn: sqlite3.Connection):
+    conn.executemany("INSERT OR IGNORE INTO interests (name) VALUES (?)",
+                     [(name,) for name in BASIC_INTERESTS])
+
+
+def _create_matches_table(conn: sqlite3.Connection):
+    # Взаимные симпатии (database.like_and_check_match); пара хранится в обе
+    # стороны, чтобы список симпатий пользователя читался по первичному ключу
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS matches (
+            user_id INTEGER NOT NULL,
+            matched_user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, matched_user_id)
+        ) WITHOUT ROWID
+    ''')
+    # Уже существующие взаимные лайки; время симпатии - время второго лайка
+    conn.execute('''
+        INSERT OR IGNORE INTO matches (user_id, matched_user_id, created_at)
+        SELECT l1.user_id, l1.liked_user_id, max(l1.created_at, l2.created_at)
+        FROM likes l1
+        JOIN likes l2 ON l2.user_id = l1.liked_user_id AND l2.liked_user_id = l1.user_id
+    ''')
+
+
+def rebuild_like_inbox(conn: sqlite3.Connection):
+    """
+    Пересобирает входящие лайки из likes: лайки, на которые пользователь
+    еще не ответил, без пар с блокировкой. Дальше их поддерживает database.py.
+    """
+    conn.execute('DELETE FROM like_inbox')
+    conn.execute('DELETE FROM like_inbox_counts')
+    conn.execute('''
+        INSERT INTO like_inbox (user_id, liker_id, created_at)
+        SELECT l.liked_user_id, l.user_id, l.created_at
+        FROM likes l
+        JOIN profiles p ON p.user_id = l.user_id
+        WHERE NOT EXISTS (SELECT 1 FROM likes WHERE user_id = l.liked_user_id AND liked_user_id = l.user_id)
+        AND NOT EXISTS (SELECT 1 FROM blocks WHERE user_id = l.user_id AND blocked_user_id = l.liked_user_id)
+        AND NOT EXISTS (SELECT 1 FROM blocks WHERE user_id = l.liked_user_id AND blocked_user_id = l.user_id)
+    ''')
+    conn.execute('''
+        INSERT INTO like_inbox_counts (user_id, pending)
+        SELECT user_id, COUNT(*) FROM like_inbox GROUP BY user_id
+    ''')
+
+
+def _create_like_inbox(conn: sqlite3.Connection):
+    # Входящие лайки без ответа (кто лайкнул пользователя) и их число -
+    # для кнопки "Посмотреть кто лайкнул" без anti-join по likes
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS like_inbox (
+            user_id INTEGER NOT NULL,
+            liker_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, liker_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_like_inbox_user_created ON like_inbox(user_id, created_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS like_inbox_counts (
+            user_id INTEGER PRIMARY KEY,
+            pending INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    rebuild_like_inbox(conn)
+
+
+def _create_changes_table(conn: sqlite3.Connection):
+    # Журнал изменений для нескольких процессов бота (cluster.py): каждый
+    # процесс читает чужие записи и обновляет свои кэши и движок подбора
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,        -- profile / interests / like / block
+            user_id INTEGER NOT NULL,
+            other_id INTEGER,
+            origin INTEGER NOT NULL,   -- номер процесса, сделавшего изменение
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _add_photo_checks(conn: sqlite3.Connection):
+    # Проверка file_id фото анкет (media.py): время последней проверки и
+    # признак нерабочего фото. Старые анкеты считаются непроверенными
+    conn.execute('ALTER TABLE profiles ADD COLUMN photo_checked_at TIMESTAMP')
+    conn.execute('ALTER TABLE profiles ADD COLUMN photo_broken INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_profiles_photo_check
+        ON profiles(photo_broken, photo_checked_at)
+    ''')
+
+
+def _add_matches_order_index(conn: sqlite3.Connection):
+    # get_matches отдает симпатии новыми первыми: без индекса по created_at
+    # SQLite сортирует все симпатии пользователя ради одной страницы
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_matches_user_created ON matches(user_id, created_at)')
+
+
+def _drop_unused_indexes(conn: sqlite3.Connection):
+    # Подбор анкет идет в памяти (matching.py): ни один запрос не ищет
+    # блокировки по blocked_user_id и анкеты по полу и возрасту, а индексы
+    # замедляли каждую запись в blocks и profiles
+    conn.execute('DROP INDEX IF EXISTS idx_blocks_blocked_user')
+    conn.execute('DROP INDEX IF EXISTS idx_profiles_gender_age')
+
+
+# (версия, описание, шаг)
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, 'base tables', _create_base_tables),
+    (2, 'broadcast and FSM tables', _create_service_tables),
+    (3, 'indexes for hot queries', _add_hot_query_indexes),
+    (4, 'basic interests', _add_basic_interests),
+    (5, 'matches table', _create_matches_table),
+    (6, 'pending likes inbox', _create_like_inbox),
+    (7, 'change log', _create_changes_table),
+    (8, 'photo checks', _add_photo_checks),
+    (9, 'matches order index', _add_matches_order_index),
+    (10, 'drop unused indexes', _drop_unused_indexes),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции и возвращает итоговую версию схемы"""
+    version = get_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than "
+                           f"supported version {SCHEMA_VERSION}")
+    pending = [migration for migration in MIGRATIONS if migration[0] > version]
+    if not pending:
+        return version
+    if conn.in_transaction:
+        conn.commit()
+    # sqlite3 не открывает транзакцию перед DDL сам - делаем это явно.
+    # IMMEDIATE: несколько одновременно запущенных процессов не начнут
+    # миграцию параллельно - второй дождется первого и увидит новую версию
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if get_version(conn) != version:
+            conn.rollback()
+            return migrate(conn)
+        for step_version, description, step in pending:
+            logger.info(f"Applying migration {step_version}: {description}")
+            step(conn)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        logger.error(f"Migration failed, schema left at version {version}")
+        raise
+    return SCHEMA_VERSION
+
+
+# Горячие запросы из database.py: (название, запрос, индексы, которые должен использовать план).
+# Шаблоны со списком IN ({}) проверяются с двумя элементами
+_IN_PAIR = '?, ?'
+QUERY_PLAN_CHECKS: List[Tuple[str, str, Sequence[str]]] = [
+    ('get_recent_likes', queries.RECENT_LIKES, ('idx_like_inbox_user_created',)),
+    ('get_last_like', queries.LAST_LIKE, ('idx_likes_liked_user_created',)),
+    ('keyboard_state', queries.KEYBOARD_STATE, ()),
+    ('get_matches', queries.MATCHES, ('idx_matches_user_created',)),
+    ('like_state', queries.LIKE_STATE, ()),
+    ('get_users_by_interests', queries.USERS_BY_INTERESTS.format(_IN_PAIR), ('idx_user_interests_interest',)),
+    ('changed_profiles', queries.CHANGED_PROFILES.format(_IN_PAIR), ()),
+    ('feed_cards', queries.FEED_CARDS.format(_IN_PAIR), ()),
+    ('stale_photos', queries.STALE_PHOTOS, ('idx_profiles_photo_check',)),
+    ('stale_broken_photos', queries.STALE_BROKEN_PHOTOS, ('idx_profiles_photo_check',)),
+    ('pending_broadcast_recipients', queries.PENDING_BROADCAST_RECIPIENTS, ('idx_broadcast_recipients_pending',)),
+]
+
+
+def explain(conn: sqlite3.Connection, query: str) -> List[str]:
+    """Строки EXPLAIN QUERY PLAN запроса (параметры подставляются как NULL)"""
+    params = (None,) * query.count('?')
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+
+
+def check_query_plans(conn: sqlite3.Connection, strict: bool = False) -> List[str]:
+    """
+    Проверяет планы горячих запросов.
+
+    Возвращает список проблем: полный просмотр таблицы (SCAN без индекса),
+    сортировка во временном B-дереве у постраничного запроса (с LIMIT) или
+    неиспользуемый ожидаемый индекс. Пустой список - все в порядке.
+    strict=True - при проблемах вместо списка бросает RuntimeError.
+    """
+    problems = []
+    for name, query, indexes in QUERY_PLAN_CHECKS:
+        plan = explain(conn, query)
+        for line in plan:
+            if line.startswith('SCAN') and 'INDEX' not in line and line != 'SCAN CONSTANT ROW':
+                problems.append(f"{name}: full table scan ({line})")
+            # Постраничный запрос должен читать строки в порядке индекса,
+            # а не сортировать все подходящие строки ради первой страницы
+            if 'USE TEMP B-TREE' in line and 'LIMIT' in query:
+                problems.append(f"{name}: sorts in a temp b-tree ({line})")
+        for index in indexes:
+            if not any(index in line for line in plan):
+                problems.append(f"{name}: index {index} is not used ({'; '.join(plan)})")
+    if strict and problems:
+        raise RuntimeError("Query plan check failed: " + "; ".join(problems))
+    return problems
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    connection = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else 'dating_bot.db')
+    print(f"Schema version: {migrate(connection)}")
+    found = check_query_plans(connection)
+    for problem in found:
+        print(problem)
+    print("Query plans: OK" if not found else f"Query plans: {len(found)} problem(s)")
+    sys.exit(1 if found else 0)
@@ -0,0 +1,58 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class Profile:
+    """Анкета пользователя (строка таблицы profiles)"""
+
+    __slots__ = ('user_id', 'name', 'age', 'description', 'photo_id',
+                 'gender', 'looking_for', 'city', 'username', 'photo_broken')
+
+    def __init__(self, user_id: int, name: str, age: int, description: str, photo_id: str,
+                 gender: str, looking_for: str, city: Optional[str], username: Optional[str],
+                 photo_broken: bool = False):
+        self.user_id = user_id
+        self.name = name
+        self.age = age
+        self.description = description
+        self.photo_id = photo_id
+        self.gender = gender
+        self.looking_for = looking_for
+        self.city = city
+        self.username = username
+        # file_id фото перестал работать (см. media.py)
+        self.photo_broken = bool(photo_broken)
+
+    def __repr__(self) -> str:
+        return f"Profile(user_id={self.user_id}, name={self.name!r}, age={self.age})"
+
+
+class InterestCatalog:
+    """
+    Справочник интересов: (id, name) в порядке показа (по названию).
+
+    Каждому интересу соответствует бит по его позиции, поэтому набор
+    выбранных интересов можно записать одним числом (mask).
+    """
+
+    __slots__ = ('items', 'names', '_bits')
+
+    def __init__(self, rows: Iterable[Tuple[int, str]]):
+        self.items: Tuple[Tuple[int, str], ...] = tuple((interest_id, name) for interest_id, name in rows)
+        self.names: Dict[int, str] = dict(self.items)
+        self._bits: Dict[int, int] = {interest_id: 1 << position
+                                      for position, (interest_id, _) in enumerate(self.items)}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def mask(self, interest_ids: Iterable[int]) -> int:
+        """Битовая маска набора интересов; неизвестные id пропускаются"""
+        mask = 0
+        for interest_id in interest_ids:
+            mask |= self._bits.get(interest_id, 0)
+        return mask
+
+    def selected_names(self, interest_ids: Iterable[int]) -> List[str]:
+        """Названия выбранных интересов в порядке справочника"""
+        mask = self.mask(interest_ids)
+        return [name for position, (_, name) in enumerate(self.items) if mask >> position & 1]
@@ -1,17 +1,13 @@
-from aiogram import types, Bot
+from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup
 import logging
 from typing import List, Optional
 
-from database import (
-    get_profile, update_profile, get_user_interests,
-    add_user_interests, get_all_interests, clear_user_interests
-)
+import async_db as db
+from keyboards import InterestKeyboard
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Состояния редактирования профиля
@@ -54,39 +50,16 @@ def get_looking_for_keyboard():
     )
     return keyboard
 
-def get_interests_keyboard(selected_interests: List[int] = None) -> InlineKeyboardMarkup:
-    if selected_interests is None:
-        selected_interests = []
-        
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    interests = get_all_interests()
-    
-    buttons = []
-    for interest_id, interest_name in interests:
-        mark = "✅ " if interest_id in selected_interests else ""
-        buttons.append(
-            InlineKeyboardButton(
-                text=f"{mark}{interest_name}",
-                callback_data=f"edit_interest_{interest_id}"
-            )
-        )
-    
-    for i in range(0, len(buttons), 2):
-        row = buttons[i:i+2]
-        keyboard.row(*row)
-    
-    keyboard.row(InlineKeyboardButton(
-        text="Готово ✅",
-        callback_data="edit_interests_done"
-    ))
-    
-    return keyboard
+_interests_keyboard = InterestKeyboard(prefix='edit_interest_', done_data='edit_interests_done')
+
+async def get_interests_keyboard(selected_interests: List[int] = None) -> InlineKeyboardMarkup:
+    return _interests_keyboard.build(await db.get_interest_catalog(), selected_interests or ())
 
 async def start_profile_editing(message: types.Message, state: FSMContext):
     """Начало редактирования профиля"""
     try:
         user_id = message.from_user.id
-        profile = get_profile(user_id)
+        profile = await db.get_profile(user_id)
         
         if not profile:
             await message.answer("Сначала создайте профиль!")
@@ -159,10 +132,13 @@ async def process_edit_choice(message: types.Message, state: FSMContext):
         elif choice == "🎯 Изменить интересы":
             await ProfileEditStates.edit_interests.set()
             user_id = message.from_user.id
-            current_interests = get_user_interests(user_id)
+            current_names = set(await db.get_user_interests(user_id))
+            interest_names = await db.get_interest_names()
+            current_interests = [id_ for id_, name in interest_names.items() if name in current_names]
+            await state.update_data(selected_interests=current_interests)
             await message.answer(
                 "Выберите ваши интересы (можно выбрать до 5):",
-                reply_markup=get_interests_keyboard([int(i) for i in current_interests])
+                reply_markup=await get_interests_keyboard(current_interests)
             )
             
         elif choice == "🔙 Вернуться":
@@ -170,7 +146,7 @@ async def process_edit_choice(message: types.Message, state: FSMContext):
             from main import get_main_keyboard  # Импортируем здесь во избежание циклического импорта
             await message.answer(
                 "Вы вернулись в главное меню",
-                reply_markup=get_main_keyboard(message.from_user.id)
+                reply_markup=await get_main_keyboard(message.from_user.id)
             )
             
     except Exception as e:
@@ -186,7 +162,7 @@ async def process_edit_name(message: types.Message, state: FSMContext):
             return
             
         user_id = message.from_user.id
-        update_profile(user_id, name=new_name)
+        await db.update_profile(user_id, name=new_name)
         await message.answer(
             "Имя успешно обновлено!",
             reply_markup=get_edit_keyboard()
@@ -210,7 +186,7 @@ async def process_edit_age(message: types.Message, state: FSMContext):
             return
             
         user_id = message.from_user.id
-        update_profile(user_id, age=new_age)
+        await db.update_profile(user_id, age=new_age)
         await message.answer(
             "Возраст успешно обновлен!",
             reply_markup=get_edit_keyboard()
@@ -234,7 +210,7 @@ async def process_edit_gender(message: types.Message, state: FSMContext):
             return
             
         user_id = message.from_user.id
-        update_profile(user_id, gender=gender_map[message.text])
+        await db.update_profile(user_id, gender=gender_map[message.text])
         await message.answer(
             "Пол успешно обновлен!",
             reply_markup=get_edit_keyboard()
@@ -259,7 +235,7 @@ async def process_edit_looking_for(message: types.Message, state: FSMContext):
             return
             
         user_id = message.from_user.id
-        update_profile(user_id, looking_for=looking_for_map[message.text])
+        await db.update_profile(user_id, looking_for=looking_for_map[message.text])
         await message.answer(
             "Предпочтения поиска успешно обновлены!",
             reply_markup=get_edit_keyboard()
@@ -275,7 +251,7 @@ async def process_edit_city(message: types.Message, state: FSMContext):
     try:
         new_city = None if message.text == '-' else message.text
         user_id = message.from_user.id
-        update_profile(user_id, city=new_city)
+        await db.update_profile(user_id, city=new_city)
         await message.answer(
             "Город успешно обновлен!",
             reply_markup=get_edit_keyboard()
@@ -295,7 +271,7 @@ async def process_edit_description(message: types.Message, state: FSMContext):
             return
             
         user_id = message.from_user.id
-        update_profile(user_id, description=new_description)
+        await db.update_profile(user_id, description=new_description)
         await message.answer(
             "Описание успешно обновлено!",
             reply_markup=get_edit_keyboard()
@@ -315,18 +291,10 @@ async def process_edit_photo(message: types.Message, state: FSMContext):
             
         photo = message.photo[-1]
         photo_id = photo.file_id
-        
-        try:
-            # Проверяем валидность file_id
-            bot = Bot.get_current()
-            await bot.get_file(photo_id)
-        except Exception as e:
-            logger.error(f"Invalid photo_id: {e}")
-            await message.answer("Ошибка при обработке фото. Пожалуйста, отправьте другое фото.")
-            return
+        # file_id из входящего сообщения рабочий; update_profile отметит фото проверенным
             
         user_id = message.from_user.id
-        update_profile(user_id, photo_id=photo_id)
+        await db.update_profile(user_id, photo_id=photo_id)
         await message.answer(
             "Фото успешно обновлено!",
             reply_markup=get_edit_keyboard()
@@ -356,8 +324,8 @@ async def process_edit_interest_selection(callback_query: types.CallbackQuery, s
         
         await state.update_data(selected_interests=selected_interests)
         
-        interests = get_all_interests()
-        selected_names = [name for id_, name in interests if id_ in selected_interests]
+        catalog = await db.get_interest_catalog()
+        selected_names = catalog.selected_names(selected_interests)
         
         text = "Выберите ваши интересы (можно выбрать до 5):\n\n"
         if selected_names:
@@ -367,7 +335,7 @@ async def process_edit_interest_selection(callback_query: types.CallbackQuery, s
             
         await callback_query.message.edit_text(
             text=text,
-            reply_markup=get_interests_keyboard(selected_interests)
+            reply_markup=await get_interests_keyboard(selected_interests)
         )
         
     except Exception as e:
@@ -385,8 +353,7 @@ async def process_edit_interests_done(callback_query: types.CallbackQuery, state
             return
         
         user_id = callback_query.from_user.id
-        clear_user_interests(user_id)
-        add_user_interests(user_id, selected_interests)
+        await db.replace_user_interests(user_id, selected_interests)
         
         await callback_query.message.answer(
             "Интересы успешно обновлены!",
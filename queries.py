@@ -0,0 +1,101 @@
+"""
+Текст горячих запросов к БД.
+
+Их выполняет database.py, а migrations.check_query_plans() проверяет их
+планы - текст запроса один на оба места. Запросы со списком IN ({})
+- шаблоны: число плейсхолдеров подставляется через str.format.
+"""
+
+RECENT_LIKES = '''
+    SELECT
+        i.liker_id,
+        p.name,
+        p.age,
+        p.description,
+        CASE WHEN p.photo_broken = 0 THEN p.photo_id END,
+        i.created_at
+    FROM like_inbox i
+    JOIN profiles p ON p.user_id = i.liker_id
+    WHERE i.user_id = ?
+    ORDER BY i.created_at DESC
+    LIMIT ?
+'''
+
+LAST_LIKE = '''
+    SELECT
+        l.user_id,
+        p.name,
+        p.age,
+        p.photo_id,
+        l.created_at
+    FROM likes l
+    JOIN profiles p ON l.user_id = p.user_id
+    WHERE l.liked_user_id = ?
+    ORDER BY l.created_at DESC
+    LIMIT 1
+'''
+
+KEYBOARD_STATE = '''
+    SELECT
+        EXISTS (SELECT 1 FROM profiles WHERE user_id = ?),
+        COALESCE((SELECT pending FROM like_inbox_counts WHERE user_id = ?), 0)
+'''
+
+MATCHES = '''
+    SELECT m.matched_user_id, p.name, p.age, p.photo_id, p.username, m.created_at
+    FROM matches m
+    JOIN profiles p ON p.user_id = m.matched_user_id
+    WHERE m.user_id = ?
+    ORDER BY m.created_at DESC
+    LIMIT ?
+'''
+
+# Встречный лайк и блокировка в любую сторону для пары (from, to)
+LIKE_STATE = '''
+    SELECT
+        EXISTS (SELECT 1 FROM likes WHERE user_id = ? AND liked_user_id = ?),
+        EXISTS (
+            SELECT 1 FROM blocks
+            WHERE (user_id = ? AND blocked_user_id = ?) OR (user_id = ? AND blocked_user_id = ?)
+        )
+'''
+
+USERS_BY_INTERESTS = '''
+    SELECT DISTINCT user_id
+    FROM user_interests
+    WHERE interest_id IN ({})
+'''
+
+CHANGED_PROFILES = "SELECT user_id, gender, looking_for, age FROM profiles WHERE user_id IN ({})"
+
+FEED_CARDS = '''
+    SELECT p.user_id, p.name, p.age, p.description,
+           CASE WHEN p.photo_broken = 0 THEN p.photo_id END,
+           group_concat(ui.interest_id)
+    FROM profiles p
+    LEFT JOIN user_interests ui ON ui.user_id = p.user_id
+    WHERE p.user_id IN ({})
+    GROUP BY p.user_id
+'''
+
+STALE_PHOTOS = '''
+    SELECT user_id, photo_id FROM profiles
+    WHERE photo_broken = 0
+      AND (photo_checked_at IS NULL OR photo_checked_at < datetime('now', ?))
+    ORDER BY photo_checked_at
+    LIMIT ?
+'''
+
+STALE_BROKEN_PHOTOS = '''
+    SELECT user_id, photo_id FROM profiles
+    WHERE photo_broken = 1 AND photo_checked_at < datetime('now', ?)
+    ORDER BY photo_checked_at
+    LIMIT ?
+'''
+
+PENDING_BROADCAST_RECIPIENTS = '''
+    SELECT user_id FROM broadcast_recipients
+    WHERE job_id = ? AND status = 'pending'
+    ORDER BY user_id
+    LIMIT ?
+'''
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py открывает пул по DATABASE_PATH при импорте - тесты не должны трогать рабочую БД
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='dating_bot_tests_'), 'test.db'))
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+# main.py настраивает логирование при импорте - без файла database.log в корне репозитория
+os.environ.setdefault('DB_LOG_FILE', '')
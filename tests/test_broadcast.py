@@ -0,0 +1,84 @@
+import asyncio
+
+from aiogram.utils.exceptions import RetryAfter
+
+import broadcast
+
+
+class FakeBot:
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        error = self.errors.get(chat_id)
+        if error is not None:
+            raise error
+        self.sent.append(chat_id)
+
+
+def _broadcaster(bot):
+    return broadcast.Broadcaster(bot, workers=2, rate=1000, per_chat_rate=1000)
+
+
+def test_unexpected_error_fails_one_recipient_not_the_batch():
+    bot = FakeBot({2: ValueError('boom')})
+    sent, failed = asyncio.run(_broadcaster(bot)._send_batch('hi', [1, 2, 3]))
+    assert sorted(sent) == [1, 3]
+    assert failed == [2]
+
+
+def test_endless_flood_wait_gives_up():
+    bot = FakeBot({1: RetryAfter(0)})
+    sent, failed = asyncio.run(_broadcaster(bot)._send_batch('hi', [1]))
+    assert (sent, failed) == ([], [1])
+    assert bot.calls == broadcast.MAX_FLOOD_WAITS
+
+
+def test_recipient_query_error_leaves_job_unfinished(monkeypatch):
+    finished = []
+
+    async def get_job(job_id):
+        return (job_id, 'hi', 100, None, 'running', 3, 0, 0)
+
+    async def get_recipients(job_id, limit):
+        raise RuntimeError('database is locked')
+
+    async def finish(job_id):
+        finished.append(job_id)
+
+    monkeypatch.setattr(broadcast.db, 'get_broadcast_job', get_job)
+    monkeypatch.setattr(broadcast.db, 'get_pending_broadcast_recipients', get_recipients)
+    monkeypatch.setattr(broadcast.db, 'finish_broadcast_job', finish)
+    bot = FakeBot()
+    asyncio.run(_broadcaster(bot)._run(1))
+    assert finished == []
+    assert bot.sent == []
+
+
+def test_inactive_broadcaster_leaves_job_to_the_active_one(monkeypatch):
+    started = []
+
+    async def unfinished():
+        return [7]
+
+    async def fake_run(self, job_id):
+        started.append(job_id)
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(broadcast.db, 'get_unfinished_broadcast_jobs', unfinished)
+    monkeypatch.setattr(broadcast.Broadcaster, '_run', fake_run)
+    passive = _broadcaster(FakeBot())
+    passive.active = False
+    active = _broadcaster(FakeBot())
+
+    async def scenario():
+        assert passive.start(7) is None
+        active.watch(interval=0)
+        await asyncio.sleep(0.01)
+        await active.stop()
+
+    asyncio.run(scenario())
+    assert started == [7]
@@ -0,0 +1,26 @@
+import cache
+from cache import LRUCache
+
+
+def test_peek_counts_hit_and_refreshes_lru_order():
+    lru = LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.peek('a') == 1
+    assert lru.peek('missing') is None
+    assert (lru.hits, lru.misses) == (1, 0)
+    lru.set('c', 3)  # вытесняется 'b': peek сделал 'a' самой свежей
+    assert lru.peek('b') is None
+    assert lru.peek('a') == 1
+
+
+def test_peek_leaves_expired_entry_for_get(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    lru = LRUCache(maxsize=10, ttl=1)
+    lru.set('a', 1)
+    now[0] += 2
+    assert lru.peek('a') is None
+    assert len(lru._data) == 1
+    assert lru.get('a') is None
+    assert len(lru._data) == 0
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import cache
+import main
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Подменяет загрузку страницы ленты; возвращает список вызовов (user_id, cursor)"""
+    calls = []
+
+    async def fake_load(user_id, cursor):
+        calls.append((user_id, cursor))
+        await asyncio.sleep(0)
+        return [cursor[0] + 1 if cursor else 1], [cursor[0] + 1 if cursor else 1]
+
+    monkeypatch.setattr(main, '_load_feed_page', fake_load)
+    main._feed_prefetch.clear()
+    yield calls
+    main._feed_prefetch.clear()
+
+
+def test_prefetched_page_is_consumed_once(loads):
+    async def scenario():
+        main._prefetch_feed_page(1, [10])
+        main._prefetch_feed_page(1, [10])  # повторная подгрузка того же курсора не запускается
+        page = await main._next_feed_page(1, [10])
+        assert page == ([11], [11])
+        assert loads == [(1, [10])]
+        assert main._feed_prefetch.peek(1) is None
+
+        # Следующая страница без подгрузки загружается сразу
+        assert await main._next_feed_page(1, [11]) == ([12], [12])
+        assert loads == [(1, [10]), (1, [11])]
+
+    asyncio.run(scenario())
+
+
+def test_prefetch_for_other_cursor_is_cancelled(loads):
+    async def scenario():
+        main._prefetch_feed_page(1, [10])
+        task = main._feed_prefetch.peek(1)[1]
+        assert await main._next_feed_page(1, [20]) == ([21], [21])
+        assert task.cancelled()
+        assert main._feed_prefetch.peek(1) is None
+
+    asyncio.run(scenario())
+
+
+def test_restarting_feed_drops_prefetch(loads, monkeypatch):
+    async def get_profile(user_id):
+        return SimpleNamespace(user_id=user_id, looking_for='MF')
+
+    async def get_main_keyboard(user_id):
+        return None
+
+    monkeypatch.setattr(main.db, 'get_profile', get_profile)
+    monkeypatch.setattr(main, 'get_main_keyboard', get_main_keyboard)
+
+    async def fake_load(user_id, cursor):
+        return [], None
+
+    answers = []
+
+    async def answer(text, **kwargs):
+        answers.append(text)
+
+    message = SimpleNamespace(from_user=SimpleNamespace(id=1), answer=answer)
+
+    async def scenario():
+        main._prefetch_feed_page(1, [10])
+        task = main._feed_prefetch.peek(1)[1]
+        monkeypatch.setattr(main, '_load_feed_page', fake_load)
+        await main.start_viewing_profiles(message)
+        await asyncio.sleep(0)
+        assert task.cancelled()
+        assert main._feed_prefetch.peek(1) is None
+        assert answers == ["Пока нет подходящих анкет. Попробуйте позже."]
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_prefetch_expires(loads, monkeypatch):
+    async def scenario():
+        main._prefetch_feed_page(1, [10])
+        await main._feed_prefetch.peek(1)[1]
+
+    asyncio.run(scenario())
+    # Пользователь ушел из ленты: запись исчезает по TTL, а не висит до конца работы процесса
+    real_monotonic = cache.time.monotonic
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: real_monotonic() + main.FEED_PREFETCH_TTL + 1)
+    assert main._feed_prefetch.peek(1) is None
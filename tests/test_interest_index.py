@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from interest_index import MAX_AGE, InterestIndex
+
+
+def brute_rank(profiles, interests, viewer_id, looking_for, exclude=(), limit=50, after=None):
+    """Ранжирование перебором всех анкет - эталон для InterestIndex.rank"""
+    ages = {user_id: min(max(age, 0), MAX_AGE) for user_id, _, _, age in profiles}
+    genders = {user_id: gender for user_id, gender, _, _ in profiles}
+    mine = {interest_id for user_id, interest_id in interests if user_id == viewer_id}
+    keys = []
+    for user_id, gender, _, age in profiles:
+        if user_id == viewer_id or user_id in exclude:
+            continue
+        if looking_for != 'MF' and genders[user_id] != looking_for:
+            continue
+        theirs = {interest_id for other_id, interest_id in interests if other_id == user_id}
+        key = (-len(mine & theirs), abs(ages[user_id] - ages[viewer_id]), user_id)
+        if after is None or key > after:
+            keys.append(key)
+    return sorted(keys)[:limit]
+
+
+def random_data(rnd, count, interest_ids, ages=(18, 60)):
+    profiles = [(user_id, rnd.choice('MF'), rnd.choice(['M', 'F', 'MF']), rnd.randint(*ages))
+                for user_id in range(1, count + 1)]
+    interests = [(user_id, interest_id)
+                 for user_id in range(1, count + 1)
+                 for interest_id in rnd.sample(interest_ids, rnd.randint(0, 5))]
+    return profiles, interests
+
+
+def check_against_brute_force(profiles, interests, rnd, viewers=20):
+    index = InterestIndex()
+    index.load(profiles, interests)
+    user_ids = [row[0] for row in profiles]
+    for viewer_id in rnd.sample(user_ids, min(viewers, len(user_ids))):
+        looking_for = rnd.choice(['M', 'F', 'MF'])
+        exclude = set(rnd.sample(user_ids, len(user_ids) // 10))
+        first = index.rank(viewer_id, looking_for, exclude=exclude, limit=7)
+        assert first == brute_rank(profiles, interests, viewer_id, looking_for, exclude, limit=7)
+        if first:
+            assert (index.rank(viewer_id, looking_for, exclude=exclude, limit=7, after=first[-1])
+                    == brute_rank(profiles, interests, viewer_id, looking_for, exclude,
+                                  limit=7, after=first[-1]))
+
+
+def test_rank_matches_brute_force():
+    rnd = random.Random(1)
+    profiles, interests = random_data(rnd, 300, list(range(1, 16)))
+    check_against_brute_force(profiles, interests, rnd)
+
+
+def test_interest_ids_above_63():
+    rnd = random.Random(2)
+    profiles, interests = random_data(rnd, 200, [1, 2, 63, 64, 65, 100, 1000])
+    check_against_brute_force(profiles, interests, rnd)
+
+    index = InterestIndex()
+    index.load(profiles, interests)
+    index.set_interests(1, [64, 1000])
+    index.add_interests(1, [200])
+    updated = [row for row in interests if row[0] != 1] + [(1, 64), (1, 1000), (1, 200)]
+    assert index.rank(2, 'MF', limit=300) == brute_rank(profiles, updated, 2, 'MF', limit=300)
+
+
+def test_ages_above_byte_range():
+    rnd = random.Random(3)
+    profiles, interests = random_data(rnd, 200, list(range(1, 16)), ages=(18, 400))
+    check_against_brute_force(profiles, interests, rnd)
+
+    index = InterestIndex()
+    index.load(profiles, interests)
+    index.set_profile(1, 'M', 'MF', 1000)
+    assert index.profile(1) == ('M', 'MF', MAX_AGE)
+
+
+def test_negative_interest_id_rejected():
+    index = InterestIndex()
+    with pytest.raises(ValueError):
+        index.load([(1, 'M', 'F', 20)], [(1, -1)])
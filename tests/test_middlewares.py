@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+
+from middlewares import UserSerializationMiddleware
+
+
+def _text_update(update_id, text, user_id=42):
+    return types.Update.to_object({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': text,
+        },
+    })
+
+
+async def _process(middleware, update, handled):
+    data = {}
+    await middleware.on_pre_process_update(update, data)
+    try:
+        await asyncio.sleep(0.01)
+        handled.append(update.update_id)
+    finally:
+        await middleware.on_post_process_update(update, [], data)
+
+
+def test_fast_likes_on_consecutive_cards_are_both_processed():
+    middleware = UserSerializationMiddleware()
+    handled = []
+
+    async def scenario():
+        await _process(middleware, _text_update(1, '❤️ Лайк'), handled)
+        await _process(middleware, _text_update(2, '❤️ Лайк'), handled)
+
+    asyncio.run(scenario())
+    assert handled == [1, 2]
+
+
+def test_press_is_dropped_while_identical_one_is_in_flight():
+    middleware = UserSerializationMiddleware()
+    handled = []
+
+    async def scenario():
+        first = asyncio.ensure_future(_process(middleware, _text_update(1, '❤️ Лайк'), handled))
+        await asyncio.sleep(0)
+        with pytest.raises(CancelHandler):
+            await middleware.on_pre_process_update(_text_update(2, '❤️ Лайк'), {})
+        await first
+
+    asyncio.run(scenario())
+    assert handled == [1]
@@ -0,0 +1,66 @@
+import asyncio
+
+import database
+import media
+
+
+class FlakyBot:
+    """getFile падает с сетевой ошибкой для file_id из failing"""
+
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.requested = []
+
+    async def get_file(self, photo_id):
+        self.requested.append(photo_id)
+        if photo_id in self.failing:
+            raise ConnectionError('network is unreachable')
+
+
+def _add_stale_profile(user_id, photo_id, checked_at, gender='M', looking_for='F'):
+    database.add_profile(user_id, f'user{user_id}', 25, 'about', photo_id, gender, looking_for, None)
+    database.execute_query('test_fixture', "UPDATE profiles SET photo_checked_at = ? WHERE user_id = ?",
+                           (checked_at, user_id))
+
+
+def test_inconclusive_check_does_not_stall_revalidation(monkeypatch):
+    database.bootstrap()
+    _add_stale_profile(9001, 'flaky-photo', None)
+    _add_stale_profile(9002, 'good-photo', '2000-01-01 00:00:00', gender='F', looking_for='M')
+    monkeypatch.setattr(media, 'BATCH_SIZE', 1)
+    bot = FlakyBot(['flaky-photo'])
+    validator = media.PhotoValidator(bot, max_age=3600, rate=1000)
+
+    async def scenario():
+        assert await validator.revalidate() == 0
+        # Фото, которое не удалось проверить, больше не в начале очереди
+        assert await validator.revalidate() == 1
+        assert await validator.revalidate() == 0
+
+    asyncio.run(scenario())
+    assert bot.requested == ['flaky-photo', 'good-photo']
+    assert database.get_stale_photos(3600, 10) == []
+    row = database.execute_query(
+        'test_fixture', "SELECT photo_broken, photo_checked_at IS NOT NULL FROM profiles WHERE user_id = ?", (9001,), fetch=True)
+    assert row == [(0, 1)]
+    # Анкета с непроверенным фото остается в ленте с фото
+    feed = database.get_matching_profiles(9002, 'F', 'M', exclude_viewed=False)
+    assert [(row[0], row[4]) for row in feed if row[0] == 9001] == [(9001, 'flaky-photo')]
+
+
+def test_broken_photo_is_rechecked_after_longer_interval(monkeypatch):
+    database.bootstrap()
+    _add_stale_profile(9011, 'restored-photo', '2000-01-01 00:00:00')
+    database.execute_query('test_fixture', "UPDATE profiles SET photo_broken = 1 WHERE user_id = ?", (9011,))
+    bot = FlakyBot([])
+
+    async def scenario():
+        # Отметка свежее broken_max_age - фото не перепроверяется
+        fresh = media.PhotoValidator(bot, max_age=3600, rate=1000, broken_max_age=50 * 365 * 24 * 3600)
+        assert await fresh.revalidate() == 0
+        due = media.PhotoValidator(bot, max_age=3600, rate=1000, broken_max_age=3600)
+        assert await due.revalidate() == 1
+
+    asyncio.run(scenario())
+    assert bot.requested == ['restored-photo']
+    assert database.get_profile(9011).photo_broken is False
@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+import migrations
+import queries
+
+
+def _migrated(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'plans.db'))
+    assert migrations.migrate(conn) == migrations.SCHEMA_VERSION
+    return conn
+
+
+def test_hot_queries_use_indexes_on_fresh_database(tmp_path):
+    conn = _migrated(tmp_path)
+    assert migrations.check_query_plans(conn, strict=True) == []
+
+
+def test_missing_order_index_is_reported(tmp_path):
+    conn = _migrated(tmp_path)
+    conn.execute('DROP INDEX idx_matches_user_created')
+    problems = migrations.check_query_plans(conn)
+    assert any(p.startswith('get_matches: sorts in a temp b-tree') for p in problems)
+    assert any('idx_matches_user_created is not used' in p for p in problems)
+    with pytest.raises(RuntimeError, match='get_matches'):
+        migrations.check_query_plans(conn, strict=True)
+
+
+def test_checks_cover_database_queries():
+    checked = {query for _, query, _ in migrations.QUERY_PLAN_CHECKS}
+    for name in ('RECENT_LIKES', 'LAST_LIKE', 'KEYBOARD_STATE', 'MATCHES', 'LIKE_STATE',
+                 'STALE_PHOTOS', 'STALE_BROKEN_PHOTOS', 'PENDING_BROADCAST_RECIPIENTS'):
+        assert getattr(queries, name) in checked
+    for name in ('USERS_BY_INTERESTS', 'CHANGED_PROFILES', 'FEED_CARDS'):
+        assert getattr(queries, name).format(migrations._IN_PAIR) in checked
+
+
+def test_every_index_is_used_by_a_checked_query(tmp_path):
+    conn = _migrated(tmp_path)
+    indexes = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'")}
+    expected = {index for _, _, names in migrations.QUERY_PLAN_CHECKS for index in names}
+    assert indexes == expected
@@ -0,0 +1,37 @@
+import sqlite3
+
+import migrations
+from db_pool import ConnectionPool
+from write_buffer import WriteBuffer
+
+
+def _closed_buffer(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'buffer.db'))
+    migrations.migrate(pool.connection())
+    buffer = WriteBuffer(pool)
+    buffer.close()
+    return pool, buffer
+
+
+def _viewed(conn):
+    return conn.execute("SELECT user_id, viewed_user_id FROM viewed_profiles").fetchall()
+
+
+def test_write_after_close_joins_callers_transaction(tmp_path):
+    pool, buffer = _closed_buffer(tmp_path)
+    conn = pool.connection()
+    conn.execute("INSERT INTO blocks (user_id, blocked_user_id) VALUES (1, 2)")
+    buffer.add_viewed(1, 3)
+    assert conn.in_transaction
+    conn.rollback()
+
+    other = sqlite3.connect(pool.path)
+    assert other.execute("SELECT COUNT(*) FROM blocks").fetchone()[0] == 0
+    assert _viewed(other) == []
+
+
+def test_write_after_close_outside_transaction_is_committed(tmp_path):
+    pool, buffer = _closed_buffer(tmp_path)
+    buffer.add_viewed(1, 3)
+    assert not pool.connection().in_transaction
+    assert _viewed(sqlite3.connect(pool.path)) == [(1, 3)]
@@ -0,0 +1,143 @@
+"""
+Запуск бота в режиме webhook.
+
+Telegram сам присылает обновления POST-запросами на адрес бота, вместо
+цикла getUpdates. Если бот недоступен (перезапуск), Telegram
+повторяет доставку - накопившиеся обновления не теряются.
+
+Настройки (переменные окружения / .env):
+- BOT_MODE - "polling" (по умолчанию) или "webhook";
+- WEBHOOK_URL - публичный адрес бота, например https://bot.example.com;
+- WEBHOOK_PATH - путь эндпоинта (/webhook);
+- WEBHOOK_SECRET - секрет заголовка X-Telegram-Bot-Api-Secret-Token (по желанию);
+- WEBHOOK_MAX_CONNECTIONS - одновременных запросов от Telegram (40);
+- WEBAPP_HOST, WEBAPP_PORT - адрес HTTP-сервера (127.0.0.1:8080, обычно за reverse proxy);
+- WEBHOOK_DRAIN_TIMEOUT - сколько секунд при остановке ждать обработки
+  уже принятых обновлений (30).
+
+При остановке сервер перестает принимать соединения, дожидается
+обновлений в обработке и только потом закрывает БД и хранилище FSM.
+Webhook при остановке не удаляется: Telegram копит обновления до
+следующего запуска.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '127.0.0.1')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class InFlightUpdates:
+    """Счетчик обновлений в обработке; drain() ждет, пока он не обнулится"""
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def enter(self):
+        self.count += 1
+        self._idle.clear()
+
+    def leave(self):
+        self.count -= 1
+        if self.count == 0:
+            self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Перестает принимать обновления и ждет текущие; False - не дождались"""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+in_flight = InFlightUpdates()
+
+
+class DrainingRequestHandler(WebhookRequestHandler):
+    """
+    Обработчик webhook с проверкой секрета и учетом обновлений в обработке.
+
+    Во время остановки отвечает 503: Telegram повторит доставку
+    после перезапуска.
+    """
+
+    async def post(self):
+        if WEBHOOK_SECRET and self.request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        if in_flight.draining:
+            return web.Response(status=503)
+        in_flight.enter()
+        try:
+            return await super().post()
+        finally:
+            in_flight.leave()
+
+
+def webhook_url() -> str:
+    return WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+
+
+def start_webhook(dp: Dispatcher,
+                  on_startup: Callable[[Dispatcher], Awaitable[None]],
+                  on_shutdown: Callable[[Dispatcher], Awaitable[None]],
+                  host: str = WEBAPP_HOST, port: int = WEBAPP_PORT,
+                  drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+    """Запускает HTTP-сервер webhook; возвращается после остановки (SIGINT/SIGTERM)"""
+    if not WEBHOOK_URL:
+        raise ValueError("Не задан WEBHOOK_URL для режима webhook. Проверьте файл .env")
+
+    async def startup(dp: Dispatcher):
+        await on_startup(dp)
+        # Webhook ставится после инициализации БД, чтобы первые обновления не пришли раньше
+        await dp.bot.set_webhook(
+            webhook_url(),
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=False
+        )
+        logger.info(f"Webhook set to {webhook_url()}, listening on {host}:{port}")
+
+    async def shutdown(dp: Dispatcher):
+        # К этому моменту aiohttp уже не принимает новые соединения
+        pending = in_flight.count
+        if not await in_flight.drain(drain_timeout):
+            logger.warning(f"Webhook drain timed out after {drain_timeout}s, "
+                           f"{in_flight.count} update(s) still in progress")
+        elif pending:
+            logger.info(f"Webhook drained {pending} in-flight update(s)")
+        await on_shutdown(dp)
+
+    executor = Executor(dp, skip_updates=False)
+    executor.on_startup(startup, polling=False)
+    executor.on_shutdown(shutdown, polling=False)
+    executor.start_webhook(
+        webhook_path=WEBHOOK_PATH,
+        request_handler=DrainingRequestHandler,
+        host=host,
+        port=port,
+        # aiohttp ждет открытые соединения уже после on_shutdown - с запасом на drain
+        shutdown_timeout=drain_timeout + 5,
+        access_log=None
+    )
@@ -0,0 +1,179 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from db_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Как часто сбрасывать накопленные записи в БД (секунды)
+FLUSH_INTERVAL = 0.5
+# Сбрасываем сразу, если накопилось столько записей
+MAX_PENDING = 1000
+
+
+class WriteBuffer:
+    """
+    Отложенная запись частых и некритичных к потере изменений.
+
+    Просмотры анкет, last_active и username копятся в памяти и пишутся
+    в БД одной транзакцией (executemany) раз в FLUSH_INTERVAL секунд
+    или при накоплении MAX_PENDING записей. Повторные изменения одного
+    ключа схлопываются. При остановке бота буфер сбрасывается в close();
+    после этого записи пишутся сразу - в открытую транзакцию вызывающего,
+    если она есть.
+
+    Пока запись не сброшена, ее видно через pending_viewed() и
+    pending_username() - так лента и профиль читают свои же изменения.
+    """
+
+    def __init__(self, pool: ConnectionPool, interval: float = FLUSH_INTERVAL,
+                 max_pending: int = MAX_PENDING,
+                 on_flush: Optional[Callable[[sqlite3.Connection, Dict[int, str]], None]] = None):
+        self.pool = pool
+        # Вызывается внутри транзакции сброса с записанными username
+        self.on_flush = on_flush
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        # Сериализует сбросы: порядок записей в БД совпадает с порядком сбросов
+        self._flush_lock = threading.Lock()
+        self._viewed: Set[Tuple[int, int]] = set()
+        self._last_active: Dict[int, str] = {}
+        self._usernames: Dict[int, str] = {}
+        # Записи, которые сейчас пишутся в БД, тоже считаются несброшенными
+        self._flushing_viewed: Set[Tuple[int, int]] = set()
+        self._flushing_usernames: Dict[int, str] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.flushed = 0
+
+    def __len__(self) -> int:
+        return len(self._viewed) + len(self._last_active) + len(self._usernames)
+
+    def add_viewed(self, user_id: int, viewed_user_id: int):
+        with self._lock:
+            self._viewed.add((user_id, viewed_user_id))
+        self._after_add()
+
+    def touch(self, user_id: int):
+        """Обновляет last_active пользователя"""
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._last_active[user_id] = now
+        self._after_add()
+
+    def set_username(self, user_id: int, username: str):
+        with self._lock:
+            self._usernames[user_id] = username
+        self._after_add()
+
+    def pending_viewed(self) -> Set[Tuple[int, int]]:
+        """Просмотры, еще не записанные в БД"""
+        with self._lock:
+            return self._viewed | self._flushing_viewed
+
+    def pending_username(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            username = self._usernames.get(user_id)
+            if username is None:
+                username = self._flushing_usernames.get(user_id)
+            return username
+
+    def _after_add(self):
+        if self._closed:
+            # Фонового потока уже нет - пишем сразу
+            self.flush()
+            return
+        if self._thread is None:
+            self._start()
+        if len(self) >= self.max_pending:
+            self._wakeup.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='db-write-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing write buffer: {e}")
+
+    def flush(self) -> int:
+        """Записывает накопленные изменения в БД одной транзакцией"""
+        with self._flush_lock:
+            with self._lock:
+                if not len(self):
+                    return 0
+                viewed, self._viewed = self._viewed, set()
+                last_active, self._last_active = self._last_active, {}
+                usernames, self._usernames = self._usernames, {}
+                self._flushing_viewed = viewed
+                self._flushing_usernames = usernames
+
+            started = time.monotonic()
+            conn = self.pool.connection()
+            try:
+                if conn.in_transaction:
+                    # После close() сброс идет в потоке вызывающего, возможно
+                    # внутри его транзакции (database.transaction()): пишем в
+                    # нее же, не фиксируя и не откатывая ее раньше времени
+                    self._write(conn, viewed, last_active, usernames)
+                else:
+                    with conn:
+                        self._write(conn, viewed, last_active, usernames)
+            except sqlite3.Error:
+                # Возвращаем записи в буфер (более новые значения не затираем)
+                with self._lock:
+                    self._viewed |= viewed
+                    for user_id, moment in last_active.items():
+                        self._last_active.setdefault(user_id, moment)
+                    for user_id, username in usernames.items():
+                        self._usernames.setdefault(user_id, username)
+                raise
+            finally:
+                with self._lock:
+                    self._flushing_viewed = set()
+                    self._flushing_usernames = {}
+
+            count = len(viewed) + len(last_active) + len(usernames)
+            self.flushed += count
+            logger.debug(f"Flushed {count} buffered writes in {time.monotonic() - started:.3f}s")
+            return count
+
+    def _write(self, conn: sqlite3.Connection, viewed: Set[Tuple[int, int]],
+               last_active: Dict[int, str], usernames: Dict[int, str]):
+        if viewed:
+            conn.executemany(
+                "INSERT OR REPLACE INTO viewed_profiles (user_id, viewed_user_id) VALUES (?, ?)",
+                viewed)
+        if last_active:
+            conn.executemany(
+                "UPDATE profiles SET last_active = ? WHERE user_id = ?",
+                [(moment, user_id) for user_id, moment in last_active.items()])
+        if usernames:
+            conn.executemany(
+                "UPDATE profiles SET username = ? WHERE user_id = ?",
+                [(username, user_id) for user_id, username in usernames.items()])
+            if self.on_flush is not None:
+                self.on_flush(conn, usernames)
+
+    def close(self):
+        """Останавливает фоновый поток и сбрасывает оставшиеся записи"""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        logger.info(f"Write buffer closed, {self.flushed} writes flushed in total")